@@ -0,0 +1 @@
+"""Micro benchmarks, run them with ``invoke benchmark``."""
@@ -0,0 +1,67 @@
+"""
+Memory cost of idle AsyncSecureChannel instances on one event loop.
+
+Every channel pair uses a socket pair, so the process needs
+``4 * CHANNEL_PAIRS`` file descriptors (see ``ulimit -n``).
+"""
+
+import asyncio
+import os
+import random
+import resource
+import socket
+import time
+import tracemalloc
+
+from secure_channel import api, data_source, key_negotiation, secure_channel
+
+from . import utils
+
+CHANNEL_PAIRS = int(os.environ.get("CHANNEL_PAIRS", "5000"))
+
+
+async def create_pair():
+  """Create connected alice and bob channels."""
+  result = []
+  for sock, side in zip(
+      socket.socketpair(), (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+  ):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    result.append(secure_channel.AsyncSecureChannel(
+      data_source=data_source.StreamDataSource(api.DEFAULT_CONFIGURATION, reader, writer),
+      key_generator=key_negotiation.TestSessionKeyNegotiator(utils.SESSION_KEY, side),
+    ))
+  return result
+
+
+async def main():
+  """Run the benchmark."""
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, 4 * CHANNEL_PAIRS + 100)), hard))
+
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  pairs = [await create_pair() for __ in range(CHANNEL_PAIRS)]
+  after = tracemalloc.get_traced_memory()[0]
+
+  receivers = [asyncio.ensure_future(bob.receive_message()) for __, bob in pairs]
+  active = random.sample(range(CHANNEL_PAIRS), min(100, CHANNEL_PAIRS))
+  start = time.perf_counter()
+  for index in active:
+    await pairs[index][0].send_message(b'\0' * 16)
+  await asyncio.gather(*(receivers[index] for index in active))
+  elapsed = time.perf_counter() - start
+
+  for receiver in receivers:
+    receiver.cancel()
+
+  utils.print_row("channels", "bytes/channel", "msg latency [us]")
+  utils.print_row(
+    2 * CHANNEL_PAIRS,
+    (after - before) // (2 * CHANNEL_PAIRS),
+    "{:.1f}".format(elapsed / len(active) * 1e6),
+  )
+
+
+if __name__ == "__main__":
+  asyncio.run(main())
@@ -0,0 +1,66 @@
+"""
+Batch send and receive of small messages over a socket pair,
+compared with sending messages one by one.
+"""
+
+import os
+import socket
+import threading
+
+from secure_channel import api, data_source, key_negotiation, secure_channel
+
+from . import utils
+
+BATCH_SIZE = 256
+
+
+def create_socket_channels():
+  """Create alice and bob channels connected with a socket pair."""
+  return tuple(
+    secure_channel.SecureChannel(
+      data_source=data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, sock),
+      key_generator=key_negotiation.TestSessionKeyNegotiator(utils.SESSION_KEY, side),
+    )
+    for sock, side in zip(
+      socket.socketpair(), (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+    )
+  )
+
+
+def main():
+  """Run the benchmark."""
+  alice, bob = create_socket_channels()
+  utils.print_row("size [B]", "single [us/msg]", "batch [us/msg]", "syscalls/batch")
+  for size in (16, 64, 256):
+    batch = [os.urandom(size) for __ in range(BATCH_SIZE)]
+
+    def send_single():
+      receiver = threading.Thread(
+        target=lambda: [bob.receive_message() for __ in range(BATCH_SIZE)]
+      )
+      receiver.start()
+      for message in batch:
+        alice.send_message(message)
+      receiver.join()
+
+    def send_batch():
+      def receive():
+        received = 0
+        while received < BATCH_SIZE:
+          received += len(bob.receive_messages(BATCH_SIZE))
+      receiver = threading.Thread(target=receive)
+      receiver.start()
+      alice.send_messages(batch)
+      receiver.join()
+
+    single = utils.time_per_call(send_single, 5) / BATCH_SIZE
+    calls_before = alice._data_source.statistics.send_calls  # pylint: disable=protected-access
+    batched = utils.time_per_call(send_batch, 5) / BATCH_SIZE
+    calls = alice._data_source.statistics.send_calls - calls_before  # pylint: disable=protected-access
+    utils.print_row(
+      size, "{:.1f}".format(single), "{:.1f}".format(batched), "{:.1f}".format(calls / 25)
+    )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+"""
+Per message cost of SecureChannel for small messages.
+
+Compares channel send path, which uses crypto context prepared once per
+channel, with encrypting using primitives created for every message.
+"""
+
+import os
+import pickle
+
+from secure_channel.primitives import BACKEND, Direction
+from secure_channel.primitives.utils import format_counter
+from secure_channel.secure_channel import utils as channel_utils
+
+from . import utils
+
+
+def encrypt_without_context(channel, message_id, data):
+  """Encrypt message building every primitive from scratch."""
+  keys = channel._session_state.get_extended_keys()  # pylint: disable=protected-access
+  config = channel._crypto_config  # pylint: disable=protected-access
+  details = pickle.dumps(channel_utils.CryptoDetailsSerializedForm(config))
+  hmac = BACKEND.create_hmac(keys.send_sign_key, config.hash_algo)
+  hmac.update(format_counter(message_id))
+  hmac.update(format_counter(len(details)))
+  hmac.update(details)
+  hmac.update(format_counter(len(data)))
+  hmac.update(data)
+  cipher = BACKEND.create_cipher_mode(
+    key=keys.send_encryption_key,
+    ctr=message_id,
+    cipher=config.block_cipher,
+    direction=Direction.ENCRYPT
+  )
+  return cipher.update(data), cipher.update(cipher.pad(hmac.finalize()))
+
+
+def main():
+  """Run the benchmark."""
+  alice, bob = utils.create_channel_pair()
+  utils.print_row("size [B]", "no context [us]", "send [us]", "round trip [us]")
+  for size in (16, 64, 256, 1024, 4096):
+    data = os.urandom(size)
+
+    def round_trip():
+      alice.send_message(data)
+      bob._data_source.in_messages = alice._data_source.out_messages  # pylint: disable=protected-access
+      alice._data_source.out_messages.clear()  # pylint: disable=protected-access
+      bob.receive_message()
+
+    utils.print_row(
+      size,
+      "{:.1f}".format(utils.time_per_call(lambda: encrypt_without_context(alice, 1, data), 2000)),
+      "{:.1f}".format(utils.time_per_call(lambda: alice.send_message(data), 2000)),
+      "{:.1f}".format(utils.time_per_call(round_trip, 2000)),
+    )
+    alice._data_source.out_messages.clear()  # pylint: disable=protected-access
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,46 @@
+"""
+Batched CTR encryption of small messages compared with creating
+a cipher mode for every message.
+"""
+
+import os
+
+from secure_channel.primitives import BACKEND, Direction
+
+from . import utils
+
+BATCH_SIZE = 256
+
+
+def main():
+  """Run the benchmark."""
+  key = os.urandom(32)
+  context = BACKEND.create_cipher_context(key, "AES")
+  utils.print_row("size [B]", "new mode [us]", "context [us]", "batch [us]")
+  for size in (16, 64, 256):
+    messages = [(message_id, os.urandom(size)) for message_id in range(1, BATCH_SIZE + 1)]
+
+    def new_mode():
+      return [
+        BACKEND.create_cipher_mode(key, message_id, "AES", Direction.ENCRYPT).update(data)
+        for message_id, data in messages
+      ]
+
+    def context_mode():
+      return [
+        context.create_cipher_mode(message_id, Direction.ENCRYPT).update(data)
+        for message_id, data in messages
+      ]
+
+    def batch():
+      return context.update_many(messages, Direction.ENCRYPT)
+
+    assert new_mode() == context_mode() == batch()
+    utils.print_row(size, *(
+      "{:.2f}".format(utils.time_per_call(func, 20) / BATCH_SIZE)
+      for func in (new_mode, context_mode, batch)
+    ))
+
+
+if __name__ == "__main__":
+  main()
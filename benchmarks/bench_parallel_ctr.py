@@ -0,0 +1,35 @@
+"""
+CTR encryption of a single huge message on one core compared with
+parallel encryption of block aligned segments in a thread pool.
+"""
+
+import os
+
+from secure_channel.primitives import Direction, pycrypto_backend
+
+from . import utils
+
+MB = 1024 * 1024
+
+
+def main():
+  """Run the benchmark."""
+  key = os.urandom(32)
+  single = pycrypto_backend.PycryptoBackend(parallel_threshold_bytes=2 ** 62)
+  parallel = pycrypto_backend.PycryptoBackend()
+  contexts = [backend.create_cipher_context(key, "AES") for backend in (single, parallel)]
+  print("cores: {}".format(os.cpu_count()))
+  utils.print_row("size [MB]", "one core [ms]", "parallel [ms]")
+  for size in (16, 64, 256):
+    data = os.urandom(size * MB)
+    output = bytearray(len(data))
+    utils.print_row(size, *(
+      utils.best_time(lambda context=context: context.create_cipher_mode(
+        1, Direction.ENCRYPT
+      ).update_into(data, output))
+      for context in contexts
+    ))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,54 @@
+"""
+Throughput of many independent messages: sent one by one from a single
+thread, compared with sends from many threads and with ``SendPipeline``.
+"""
+
+import concurrent.futures
+import os
+import time
+
+from . import utils
+
+MESSAGES = 256
+
+
+def throughput(channel, func, size: int) -> str:
+  """Best of three runs of ``func`` sending ``MESSAGES``, in MB/s."""
+  times = []
+  for __ in range(3):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+    # Don't keep sent messages around.
+    channel._data_source.out_messages.clear()  # pylint: disable=protected-access
+  return "{:.0f}".format(MESSAGES * size / min(times) / 1e6)
+
+
+def main():
+  """Run the benchmark."""
+  workers = os.cpu_count() or 1
+  print("cores: {}".format(workers))
+  utils.print_row("size [B]", "serial [MB/s]", "threads [MB/s]", "pipeline [MB/s]")
+  channel, __ = utils.create_channel_pair()
+  with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+    pipeline = channel.open_send_pipeline(executor)
+    for size in (1024, 64 * 1024, 1024 * 1024):
+      data = os.urandom(size)
+
+      def serial():
+        for __ in range(MESSAGES):
+          channel.send_message(data)
+
+      def threads():
+        list(executor.map(channel.send_message, [data] * MESSAGES))
+
+      def pipelined():
+        concurrent.futures.wait([pipeline.submit(data) for __ in range(MESSAGES)])
+
+      utils.print_row(size, *(
+        throughput(channel, func, size) for func in (serial, threads, pipelined)
+      ))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,41 @@
+"""Bulk throughput and per message overhead of each protocol version."""
+
+import os
+
+from secure_channel import codec
+from secure_channel.secure_channel import utils as channel_utils
+
+from . import utils
+
+CONFIGURATIONS = (
+  ("HMAC+CTR", channel_utils.CRYPTO_CONFIGURATION),
+  ("AES-GCM", channel_utils.AES_GCM_CRYPTO_CONFIGURATION),
+  ("ChaCha20", channel_utils.CHACHA20_POLY1305_CRYPTO_CONFIGURATION),
+)
+
+
+def main():
+  """Run the benchmark."""
+  utils.print_row("protocol", "size [B]", "overhead [B]", "send [MB/s]", "recv [MB/s]")
+  for name, configuration in CONFIGURATIONS:
+    alice, bob = utils.create_channel_pair(crypto_configuration=configuration)
+    for size in (1024, 64 * 1024, 1024 * 1024):
+      data = os.urandom(size)
+      alice.send_message(data)
+      message = alice._data_source.out_messages.pop()  # pylint: disable=protected-access
+
+      # pylint: disable=protected-access
+      send = utils.time_per_call(lambda: alice._send_utils.create_message(data), 20)
+      # Session state would reject replayed message, so time only the crypto.
+      recv = utils.time_per_call(lambda: bob._crypto_context.open(message), 20)
+      utils.print_row(
+        name,
+        size,
+        codec.frame_size(message) - size,
+        "{:.0f}".format(size / send),
+        "{:.0f}".format(size / recv),
+      )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+"""
+Receiving a single stream of messages over a socket pair, one message at
+a time compared with ``ReceivePipeline``, that overlaps reads with crypto.
+"""
+
+import os
+import socket
+import threading
+import time
+
+from secure_channel import api, data_source, key_negotiation, secure_channel
+
+from . import utils
+
+MESSAGES = 256
+
+
+def create_channels():
+  """Alice and bob channels connected by a socket pair."""
+  return [
+    secure_channel.SecureChannel(
+      data_source=data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, sock),
+      key_generator=key_negotiation.TestSessionKeyNegotiator(utils.SESSION_KEY, side)
+    )
+    for sock, side in zip(
+      socket.socketpair(), (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+    )
+  ]
+
+
+def throughput(size: int, pipelined: bool) -> str:
+  """Receive throughput in MB/s."""
+  sender, receiver = create_channels()
+  data = os.urandom(size)
+  thread = threading.Thread(target=lambda: [sender.send_message(data) for __ in range(MESSAGES)])
+  start = time.perf_counter()
+  thread.start()
+  if pipelined:
+    with receiver.open_receive_pipeline() as pipeline:
+      for __ in range(MESSAGES):
+        pipeline.receive_message()
+  else:
+    for __ in range(MESSAGES):
+      receiver.receive_message()
+  elapsed = time.perf_counter() - start
+  thread.join()
+  for channel in (sender, receiver):
+    channel._data_source.socket.close()  # pylint: disable=protected-access
+  return "{:.0f}".format(MESSAGES * size / elapsed / 1e6)
+
+
+def main():
+  """Run the benchmark."""
+  print("cores: {}".format(os.cpu_count()))
+  utils.print_row("size [B]", "serial [MB/s]", "pipeline [MB/s]")
+  for size in (1024, 64 * 1024, 1024 * 1024):
+    utils.print_row(size, throughput(size, False), throughput(size, True))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,45 @@
+"""
+Cost of rejecting forged messages of protocol 1 (MAC-then-encrypt)
+and protocol 4 (encrypt-then-MAC).
+"""
+
+import os
+
+from secure_channel import api, exceptions
+from secure_channel.secure_channel import utils as channel_utils
+
+from . import utils
+
+CONFIGURATIONS = (
+  ("HMAC+CTR", channel_utils.CRYPTO_CONFIGURATION),
+  ("EtM", channel_utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION),
+)
+
+
+def main():
+  """Run the benchmark."""
+  utils.print_row("protocol", "size [B]", "reject [us]", "accept [us]")
+  for name, configuration in CONFIGURATIONS:
+    alice, bob = utils.create_channel_pair(crypto_configuration=configuration)
+    context = bob._crypto_context  # pylint: disable=protected-access
+    for size in (1024, 64 * 1024, 1024 * 1024):
+      alice.send_message(os.urandom(size))
+      valid = alice._data_source.out_messages.pop()  # pylint: disable=protected-access
+      forged = api.Message(valid.message_id, os.urandom(size), os.urandom(len(valid.hmac)))
+
+      def reject():
+        try:
+          context.open(forged)
+        except exceptions.InvalidSignature:
+          pass
+
+      utils.print_row(
+        name,
+        size,
+        "{:.1f}".format(utils.time_per_call(reject, 20)),
+        "{:.1f}".format(utils.time_per_call(lambda: context.open(valid), 20)),  # pylint: disable=cell-var-from-loop
+      )
+
+
+if __name__ == "__main__":
+  main()
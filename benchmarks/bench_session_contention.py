@@ -0,0 +1,65 @@
+"""
+Send message ids per second taken from one session state by 1 to 64
+threads, while another thread keeps verifying received ids and reading keys.
+
+Compares the shared send counter with per-thread id blocks.
+"""
+
+import threading
+import time
+
+from secure_channel import api, key_extension, session_state
+
+from . import utils
+
+IDS_PER_RUN = 200000
+
+
+def ids_per_second(threads: int, id_block_size: int) -> str:
+  """Thousands of ids per second taken by ``threads`` threads."""
+  keys = key_extension.DefaultKeyExtensionFunction().extend_keys(
+    api.CommunicationSide.ALICE, bytearray(utils.SESSION_KEY)
+  )
+  state = session_state.DefaultSessionState(
+    api.DEFAULT_CONFIGURATION, keys, id_block_size=id_block_size
+  )
+  per_thread = IDS_PER_RUN // threads
+  done = threading.Event()
+  start_barrier = threading.Barrier(threads + 1)
+
+  def send():
+    start_barrier.wait()
+    for __ in range(per_thread):
+      state.get_send_message_number()
+
+  def receive():
+    message_id = 0
+    while not done.is_set():
+      message_id += 1
+      state.verify_recv_message_number(message_id)
+      state.get_extended_keys()
+
+  senders = [threading.Thread(target=send) for __ in range(threads)]
+  receiver = threading.Thread(target=receive)
+  receiver.start()
+  for thread in senders:
+    thread.start()
+  start_barrier.wait()
+  start = time.perf_counter()
+  for thread in senders:
+    thread.join()
+  elapsed = time.perf_counter() - start
+  done.set()
+  receiver.join()
+  return "{:.0f}".format(per_thread * threads / elapsed / 1e3)
+
+
+def main():
+  """Run the benchmark."""
+  utils.print_row("threads", "counter [k/s]", "64 id blocks [k/s]")
+  for threads in (1, 2, 4, 8, 16, 32, 64):
+    utils.print_row(threads, ids_per_second(threads, 1), ids_per_second(threads, 64))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,56 @@
+"""
+Memory used by sessions of many peers: ``DefaultSessionState`` objects
+compared with records in ``SessionStore``, and time to reopen the store.
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+from secure_channel import api, key_extension, session_state, session_store
+
+from . import utils
+
+PEERS = 100000
+
+
+def main():
+  """Run the benchmark."""
+  keys = key_extension.DefaultKeyExtensionFunction().extend_keys(
+    api.CommunicationSide.ALICE, bytearray(utils.SESSION_KEY)
+  )
+  tracemalloc.start()
+  states = [
+    session_state.DefaultSessionState(
+      api.DEFAULT_CONFIGURATION, api.ExtendedKeys(*(bytearray(key) for key in keys))
+    )
+    for __ in range(PEERS)
+  ]
+  objects_size = tracemalloc.get_traced_memory()[0]
+  del states
+  tracemalloc.stop()
+
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "sessions")
+    with session_store.SessionStore(path, PEERS) as store:
+      for peer_id in range(PEERS):
+        store.put(peer_id, keys)
+    start = time.perf_counter()
+    tracemalloc.start()
+    with session_store.SessionStore(path, PEERS) as store:
+      opened = time.perf_counter() - start
+      state = store.session_state(PEERS - 1, api.DEFAULT_CONFIGURATION)
+      state.get_send_message_number()
+      store_heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+  utils.print_row("", "bytes per peer")
+  utils.print_row("objects", "{:.0f}".format(objects_size / PEERS))
+  utils.print_row("store file", session_store.RECORD_SIZE)
+  utils.print_row("store heap", "{:.2f}".format(store_heap / PEERS))
+  print("store with {} peers opened in {:.2f} ms".format(PEERS, opened * 1e3))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+"""
+Throughput of ``shutil.copyfileobj`` into a send stream, compared with
+plain AES-CTR encryption of the same data.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from secure_channel import api, data_source, key_negotiation, secure_channel
+from secure_channel.primitives import BACKEND, Direction
+
+from . import utils
+
+STREAM_SIZE = 64 * 1024 * 1024
+
+
+class NullDataSource(data_source.TestDataSource):
+  """Data source dropping everything that is written."""
+
+  def write(self, data: api.Message):
+    pass
+
+
+def throughput(func) -> str:
+  """Run ``func`` once and return throughput in MB/s."""
+  start = time.perf_counter()
+  func()
+  return "{:.0f}".format(STREAM_SIZE / (time.perf_counter() - start) / 1e6)
+
+
+def main():
+  """Run the benchmark."""
+  channel = secure_channel.SecureChannel(
+    data_source=NullDataSource(api.DEFAULT_CONFIGURATION, []),
+    key_generator=key_negotiation.TestSessionKeyNegotiator(
+      utils.SESSION_KEY, api.CommunicationSide.ALICE
+    ),
+  )
+  chunk = os.urandom(1024 * 1024)
+  with tempfile.TemporaryFile() as source:
+    for __ in range(STREAM_SIZE // len(chunk)):
+      source.write(chunk)
+
+    def copy():
+      source.seek(0)
+      with channel.open_send_stream() as stream:
+        shutil.copyfileobj(source, stream, len(chunk))
+
+    def aes_ctr():
+      mode = BACKEND.create_cipher_mode(os.urandom(32), 1, "AES", Direction.ENCRYPT)
+      for __ in range(STREAM_SIZE // len(chunk)):
+        mode.update(chunk)
+
+    utils.print_row("AES-CTR [MB/s]", "stream [MB/s]")
+    utils.print_row(throughput(aes_ctr), throughput(copy))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,55 @@
+"""
+Time and peak allocated memory of encrypting large messages with ``update``,
+which allocates ciphertext, compared with ``update_into`` working in place,
+and of sealing and opening whole messages.
+"""
+
+import os
+import time
+import tracemalloc
+
+from secure_channel.primitives import BACKEND, Direction
+
+from . import utils
+
+MB = 1024 * 1024
+
+
+def measure(func):
+  """Return time in milliseconds and peak traced allocation in MB of single call."""
+  tracemalloc.start()
+  start = time.perf_counter()
+  func()
+  elapsed = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return "{:.1f}".format(elapsed * 1e3), "{:.1f}".format(peak / MB)
+
+
+def main():
+  """Run the benchmark."""
+  context = BACKEND.create_cipher_context(os.urandom(32), "AES")
+  alice, bob = utils.create_channel_pair()
+  utils.print_row(
+    "size [MB]", "update [ms]", "update [MB]", "into [ms]", "into [MB]",
+    "seal+open [ms]", "seal+open [MB]"
+  )
+  for size in (1, 16, 64, 256):
+    data = bytearray(os.urandom(size * MB))
+
+    def update():
+      context.create_cipher_mode(1, Direction.ENCRYPT).update(data)
+
+    def update_into():
+      context.create_cipher_mode(1, Direction.ENCRYPT).update_into(data, data)
+
+    def seal_and_open():
+      # pylint: disable=protected-access
+      message = alice._crypto_context.seal(1, data)
+      bob._crypto_context.open(message)
+
+    utils.print_row(size, *measure(update), *measure(update_into), *measure(seal_and_open))
+
+
+if __name__ == "__main__":
+  main()
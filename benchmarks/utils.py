@@ -0,0 +1,47 @@
+"""Helpers shared by benchmarks."""
+
+import time
+import timeit
+import typing
+
+from secure_channel import api, data_source, key_negotiation, secure_channel
+from secure_channel.secure_channel import utils as channel_utils
+
+
+SESSION_KEY = b'benchmark session key, never use it for real traffic'
+
+
+def create_channel_pair(
+    configuration: api.ChannelConfiguration = api.DEFAULT_CONFIGURATION,
+    crypto_configuration: api.ChannelCryptoConfiguration = channel_utils.CRYPTO_CONFIGURATION,
+) -> typing.Tuple[secure_channel.SecureChannel, secure_channel.SecureChannel]:
+  """Create alice and bob channels using test data sources."""
+  return tuple(
+    secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(configuration, []),
+      key_generator=key_negotiation.TestSessionKeyNegotiator(SESSION_KEY, side),
+      configuration=configuration,
+      crypto_configration=crypto_configuration,
+    )
+    for side in (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+  )
+
+
+def time_per_call(func: typing.Callable, number: int, repeat: int = 5) -> float:
+  """Return best time of a single call of ``func`` in microseconds."""
+  return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def best_time(func: typing.Callable, repeat: int = 3) -> str:
+  """Best of ``repeat`` runs of ``func`` in milliseconds."""
+  times = []
+  for __ in range(repeat):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+  return "{:.1f}".format(min(times) * 1e3)
+
+
+def print_row(*columns):
+  """Print single row of benchmark table."""
+  print("".join("{:>18}".format(column) for column in columns))
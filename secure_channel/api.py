@@ -88,6 +88,24 @@ class SessionState(_ConfigurationAware, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError
 
+  def get_send_message_numbers(self, count: int) -> range:
+    """
+    Reserve ``count`` consecutive message ids.
+
+    Override it if you can reserve ids more efficiently than by
+    calling ``get_send_message_number`` ``count`` times.
+    """
+    message_numbers = range(0)
+    while len(message_numbers) < count:
+      message_number = self.get_send_message_number()
+      if message_numbers and message_number == message_numbers.stop:
+        message_numbers = range(message_numbers.start, message_number + 1)
+      else:
+        # Some other thread got message id in the meantime, just ignore
+        # previous ids, as gaps in message ids are allowed.
+        message_numbers = range(message_number, message_number + 1)
+    return message_numbers
+
   @abc.abstractmethod
   def verify_recv_message_number(self, message_number: int):
     """
@@ -124,11 +142,33 @@ class SessionState(_ConfigurationAware, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError
 
+  def precheck_recv_message_number(self, message_number: int):
+    """
+    Cheap check of received message number, done before message is verified.
+
+    Raises the same errors as ``verify_recv_message_number`` for message
+    numbers that can't possibly be accepted, but **never** updates the state.
+    Default implementation accepts everything.
+    """
+
   @abc.abstractmethod
   def get_extended_keys(self) -> ExtendedKeys:
     """Return extended keys, you may cache instances of this."""
     raise NotImplementedError
 
+  def create_crypto_context(
+      self,
+      crypto_configuration: ChannelCryptoConfiguration,
+      factory: typing.Callable[[ChannelCryptoConfiguration, ExtendedKeys], typing.Any]
+  ) -> typing.Any:
+    """
+    Create crypto context used by channel, ``factory`` creates context
+    of the protocol version from keys.
+
+    Override it if keys change during the session.
+    """
+    return factory(crypto_configuration, self.get_extended_keys())
+
   @abc.abstractmethod
   def reset(self):
     """Destroy state of this instance."""
@@ -155,6 +195,19 @@ Message = typing.NamedTuple(
 )
 
 
+ReceivedMessage = typing.NamedTuple(
+  "ReceivedMessage",
+  (
+    ("message_id", int),
+    # Verified plaintext, None if message was invalid.
+    ("data", typing.Optional[DataBuffer]),
+    # Exception raised while verifying the message, None if it was valid.
+    ("error", typing.Optional[Exception]),
+  ),
+)
+"""Result of receiving single message from a batch."""
+
+
 class DataSource(_ConfigurationAware, metaclass=abc.ABCMeta):
 
   """
@@ -181,6 +234,47 @@ class DataSource(_ConfigurationAware, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError()
 
+  def write_many(self, messages: typing.Sequence[Message]):
+    """
+    Write many messages, implementations should do it with as few system
+    calls as possible. Default implementation writes them one by one.
+    """
+    for message in messages:
+      self.write(message)
+
+  def read_many(self, max_messages: int) -> typing.List[Message]:
+    """
+    Read at least one and at most ``max_messages`` messages.
+
+    Blocks only until first message is available, implementations should
+    return messages that are available without blocking. Default
+    implementation returns a single message.
+    """
+    assert max_messages > 0
+    return [self.read()]
+
+
+class AsyncDataSource(_ConfigurationAware, metaclass=abc.ABCMeta):
+
+  """
+  Two-way data source for asyncio, counterpart of ``DataSource``.
+  """
+
+  @abc.abstractmethod
+  async def write(self, message: Message):
+    """
+    Write data to the underlying stream.
+
+    Returns when whole message was handed to the transport, and transport
+    buffers are below high-water mark.
+    """
+    raise NotImplementedError()
+
+  @abc.abstractmethod
+  async def read(self) -> Message:
+    """Read next message from underlying stream."""
+    raise NotImplementedError()
+
 
 class SessionKeyNegotiator(object, metaclass=abc.ABCMeta):
 
@@ -279,3 +373,21 @@ class SessionStateLoader(object, metaclass=abc.ABCMeta):
   ) -> SessionState:
     """Load session state."""
     raise NotImplementedError
+
+
+class SessionColdStore(object, metaclass=abc.ABCMeta):
+
+  """
+  Storage of sessions evicted from memory, records are opaque bytes
+  (with keys wrapped) identified by peer id.
+  """
+
+  @abc.abstractmethod
+  def put(self, peer_id: str, record: bytes):
+    """Store record of peer, replacing previous one."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def pop(self, peer_id: str) -> typing.Optional[bytes]:
+    """Remove and return record of peer, None if there is none."""
+    raise NotImplementedError
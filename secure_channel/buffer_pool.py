@@ -0,0 +1,116 @@
+"""Pool of reusable buffers for received plaintext."""
+
+import threading
+
+DEFAULT_POOL_BUFFER_SIZE = 64 * 1024
+"""Size of buffers kept in the pool, larger leases are not pooled."""
+
+DEFAULT_MAX_FREE_BUFFERS = 16
+"""Number of released buffers kept for reuse."""
+
+
+class BufferLease(object):
+  """
+  Buffer leased from ``BufferPool``.
+
+  ``view`` is valid until lease is released, after that the buffer is
+  zeroed and reused, so don't keep any views into it. Lease is a context
+  manager releasing it on exit.
+  """
+
+  def __init__(self, pool: "BufferPool", buffer: bytearray, size: int):
+    self.__pool = pool
+    self.__buffer = buffer
+    self.__view = memoryview(buffer)[:size]
+
+  @property
+  def view(self) -> memoryview:
+    """Leased part of the buffer."""
+    if self.__view is None:
+      raise ValueError("lease was already released")
+    return self.__view
+
+  @property
+  def released(self) -> bool:
+    """True if lease was released."""
+    return self.__view is None
+
+  def release(self):
+    """Zero leased data and return buffer to the pool, can be called many times."""
+    if self.__view is None:
+      return
+    self.__pool.clear(self.__view)
+    self.__view = None
+    self.__pool.give_back(self.__buffer)
+    self.__buffer = None
+
+  def __enter__(self) -> "BufferLease":
+    return self
+
+  def __exit__(self, *args):
+    self.release()
+
+
+class BufferPool(object):
+  """
+  Thread safe pool of ``buffer_size`` bytes long buffers.
+
+  Buffers are zeroed when lease is released, the same as if they were
+  cleared with ``utils.clear_buffer``, so free buffers never hold plaintext.
+  """
+
+  def __init__(
+      self,
+      buffer_size: int = DEFAULT_POOL_BUFFER_SIZE,
+      max_free_buffers: int = DEFAULT_MAX_FREE_BUFFERS
+  ):
+    assert buffer_size > 0
+    self.__buffer_size = buffer_size
+    self.__max_free_buffers = max_free_buffers
+    self.__free = []
+    self.__lock = threading.Lock()
+    # Source of zeros for clearing, so clearing doesn't allocate.
+    self.__zeros = memoryview(bytes(buffer_size))
+
+  @property
+  def buffer_size(self) -> int:
+    """Size of pooled buffers."""
+    return self.__buffer_size
+
+  @property
+  def free_buffers(self) -> int:
+    """Number of buffers ready for reuse."""
+    return len(self.__free)
+
+  def lease(self, size: int) -> BufferLease:
+    """
+    Lease buffer of at least ``size`` bytes, its ``view`` is ``size`` bytes long.
+
+    Requests larger than ``buffer_size`` get a new buffer, that is not
+    returned to the pool.
+    """
+    buffer = None
+    if size <= self.__buffer_size:
+      with self.__lock:
+        if self.__free:
+          buffer = self.__free.pop()
+      if buffer is None:
+        buffer = bytearray(self.__buffer_size)
+    else:
+      buffer = bytearray(size)
+    return BufferLease(self, buffer, size)
+
+  def clear(self, view: memoryview):
+    """Set all bytes in ``view`` to zero."""
+    for start in range(0, len(view), len(self.__zeros)):
+      end = min(len(view), start + len(self.__zeros))
+      view[start:end] = self.__zeros[:end - start]
+
+  def give_back(self, buffer: bytearray):
+    """Return zeroed buffer to the pool."""
+    if len(buffer) != self.__buffer_size:
+      return
+    with self.__lock:
+      if len(self.__free) < self.__max_free_buffers:
+        self.__free.append(buffer)
+
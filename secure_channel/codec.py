@@ -0,0 +1,109 @@
+"""
+Binary wire format for ``api.Message``.
+
+Each message is sent as a single frame::
+
+  +------------+-------------+-------------+------------+------+
+  | message_id | data_length | hmac_length | data       | hmac |
+  | uint64     | uint32      | uint16      |            |      |
+  +------------+-------------+-------------+------------+------+
+
+All integers are big endian and unsigned. The header has fixed size, so
+transports read ``HEADER.size`` bytes, decode the header (which checks
+declared lengths against configuration) and only then read (or allocate
+space for) the rest of the frame.
+
+Decoding never copies message contents, ``data`` and ``hmac`` of decoded
+messages are views into the decoded buffer.
+"""
+
+import struct
+import typing
+
+from . import exceptions
+from .api import ChannelConfiguration, DataBuffer, Message
+
+HEADER = struct.Struct(">QIH")
+"""Frame header: message id, data length and hmac length."""
+
+MAX_HMAC_LENGTH = 2 ** 16 - 1
+
+
+FrameHeader = typing.NamedTuple(
+  "FrameHeader",
+  (
+    ("message_id", int),
+    ("data_length", int),
+    ("hmac_length", int),
+  )
+)
+
+
+def header_frame_size(header: FrameHeader) -> int:
+  """Size of the whole frame described by ``header``, in bytes."""
+  return HEADER.size + header.data_length + header.hmac_length
+
+
+def frame_size(message: Message) -> int:
+  """Size of encoded ``message``, in bytes."""
+  return HEADER.size + len(message.data) + len(message.hmac)
+
+
+def _check_lengths(data_length: int, hmac_length: int, configuration: ChannelConfiguration):
+  if data_length > configuration.max_message_size_bytes:
+    raise exceptions.MessageTooLarge()
+  if hmac_length > MAX_HMAC_LENGTH:
+    raise exceptions.MalformedFrame()
+
+
+def encode_header(message: Message, configuration: ChannelConfiguration) -> bytes:
+  """
+  Encode frame header for ``message``.
+
+  Transports that can do scatter/gather writes should send header, data
+  and hmac as separate buffers instead of calling ``encode_message``.
+  """
+  _check_lengths(len(message.data), len(message.hmac), configuration)
+  return HEADER.pack(message.message_id, len(message.data), len(message.hmac))
+
+
+def encode_message(message: Message, configuration: ChannelConfiguration) -> bytearray:
+  """Encode ``message`` as a single frame."""
+  result = bytearray(encode_header(message, configuration))
+  result += message.data
+  result += message.hmac
+  return result
+
+
+def decode_header(buffer: DataBuffer, configuration: ChannelConfiguration) -> FrameHeader:
+  """
+  Decode frame header from start of ``buffer``.
+
+  Raises ``MessageTooLarge`` when declared data is larger than configuration
+  allows, this is checked before anyone allocates buffers for the frame.
+  """
+  if len(buffer) < HEADER.size:
+    raise exceptions.NotEnoughDataInInput()
+  header = FrameHeader(*HEADER.unpack_from(buffer))
+  _check_lengths(header.data_length, header.hmac_length, configuration)
+  return header
+
+
+def decode_message(buffer: DataBuffer, configuration: ChannelConfiguration) -> Message:
+  """
+  Decode frame from start of ``buffer``.
+
+  ``data`` and ``hmac`` of returned message are views into ``buffer``,
+  so buffer can't be reused while message is in use. Use ``frame_size``
+  to get number of bytes consumed.
+  """
+  view = memoryview(buffer)
+  header = decode_header(view, configuration)
+  if len(view) < header_frame_size(header):
+    raise exceptions.NotEnoughDataInInput()
+  data_end = HEADER.size + header.data_length
+  return Message(
+    message_id=header.message_id,
+    data=view[HEADER.size:data_end],
+    hmac=view[data_end:data_end + header.hmac_length],
+  )
@@ -1,7 +1,14 @@
 """Implementations of data source."""
+import asyncio
+import os
+import select
+import socket
 import typing
 
-from .api import DataSource, Message, ChannelConfiguration
+from . import codec, exceptions
+from .api import (
+  AsyncDataSource, DataSource, Message, ChannelConfiguration, DEFAULT_CONFIGURATION
+)
 
 
 class TestDataSource(DataSource):
@@ -40,9 +47,434 @@ class TestDataSource(DataSource):
   def read(self) -> Message:
     return self.__in_messages.pop()
 
+  def read_many(self, max_messages: int) -> typing.List[Message]:
+    result = [self.read()]
+    while self.__in_messages and len(result) < max_messages:
+      result.append(self.__in_messages.pop())
+    return result
+
   #                                  some kind of false-positive
   def write(self, data: Message):  # pylint: disable=arguments-differ
     self.__out_messages.append(data)
 
 
+DEFAULT_BUFFER_SIZE = 64 * 1024
+"""Initial size of receive buffer, it grows for larger frames."""
+
+try:
+  IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):  # pragma: no cover
+  IOV_MAX = 1024
+"""Maximal number of buffers passed to a single ``sendmsg`` call."""
+
+
+class DataSourceStatistics(object):
+  """I/O counters of a data source."""
+
+  def __init__(self):
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.send_calls = 0
+    self.recv_calls = 0
+    # Received datagrams dropped because they were not valid frames.
+    self.malformed_received = 0
+    # Receive calls that reported that an earlier datagram was refused by peer.
+    self.refused_received = 0
+
+
+class SocketDataSource(DataSource):
+  """
+  Data source sending ``codec`` frames over a connected stream socket.
+
+  Received data is read with ``recv_into`` into a preallocated buffer, that
+  is reused between reads. Single ``recv_into`` call may read many frames,
+  these are then returned without further system calls. Messages returned
+  from ``read`` are views into this buffer, and are valid only until next
+  call to ``read``.
+
+  Frames are sent with ``sendmsg``, header, data and hmac are passed as
+  separate buffers, so they are never joined.
+
+  Reads block for at most ``timeout`` seconds (forever if ``None``), after
+  that ``socket.timeout`` is raised, and read may be retried. Writes are
+  not limited by ``timeout``, they block until whole frames are sent, as
+  frame that is sent only partially would break framing of all later ones.
+  """
+
+  def __init__(
+      self,
+      config: ChannelConfiguration,
+      sock: socket.socket,
+      *,
+      timeout: typing.Optional[float] = None,
+      buffer_size: int = DEFAULT_BUFFER_SIZE
+  ):
+    super().__init__(config)
+    self.__socket = sock
+    # Socket is blocking, so writes never time out, we wait for reads ourselves.
+    self.__socket.settimeout(None)
+    self.__timeout = timeout
+    self.__buffer = bytearray(max(buffer_size, codec.HEADER.size))
+    # Received but not yet returned data is in self.__buffer[start:end]
+    self.__start = 0
+    self.__end = 0
+    self.__statistics = DataSourceStatistics()
+
+  @property
+  def socket(self) -> socket.socket:
+    """Underlying socket."""
+    return self.__socket
+
+  @property
+  def statistics(self) -> DataSourceStatistics:
+    """I/O counters."""
+    return self.__statistics
+
+  @property
+  def timeout(self) -> typing.Optional[float]:
+    """Read timeout in seconds, ``None`` means blocking forever."""
+    return self.__timeout
+
+  @timeout.setter
+  def timeout(self, timeout: typing.Optional[float]):
+    self.__timeout = timeout
+
+  def __make_room(self, size: int):
+    """Make sure ``size`` bytes, counted from start of pending data, fit in the buffer."""
+    if self.__start + size <= len(self.__buffer):
+      return
+    pending = self.__end - self.__start
+    with memoryview(self.__buffer) as view, view[self.__start:self.__end] as pending_data:
+      if size <= len(self.__buffer):
+        # Memoryview assignment handles overlapping data, and doesn't
+        # allocate temporary copy of it.
+        view[:pending] = pending_data
+      else:
+        # Messages returned earlier might still hold views into current buffer,
+        # so we can't resize it.
+        buffer = bytearray(size)
+        buffer[:pending] = pending_data
+        self.__buffer = buffer
+    self.__start = 0
+    self.__end = pending
+
+  def __fill(self, size: int):
+    """Receive until at least ``size`` bytes are pending."""
+    self.__make_room(size)
+    with memoryview(self.__buffer) as view:
+      while self.__end - self.__start < size:
+        if self.__timeout is not None and not select.select(
+            [self.__socket], [], [], self.__timeout
+        )[0]:
+          raise socket.timeout()
+        received = self.__socket.recv_into(view[self.__end:])
+        self.__statistics.recv_calls += 1
+        if received == 0:
+          raise exceptions.NotEnoughDataInInput()
+        self.__statistics.bytes_received += received
+        self.__end += received
+
+  def __pending_frame_size(self) -> typing.Optional[int]:
+    """Size of first pending frame, if whole frame was already received."""
+    if self.__end - self.__start < codec.HEADER.size:
+      return None
+    header = codec.decode_header(
+      memoryview(self.__buffer)[self.__start:self.__end], self.configuration
+    )
+    size = codec.header_frame_size(header)
+    if self.__end - self.__start < size:
+      return None
+    return size
+
+  def __pop_frame(self, size: int) -> Message:
+    message = codec.decode_message(
+      memoryview(self.__buffer)[self.__start:self.__start + size], self.configuration
+    )
+    self.__start += size
+    if self.__start == self.__end:
+      self.__start = self.__end = 0
+    return message
+
+  def read(self) -> Message:
+    self.__fill(codec.HEADER.size)
+    header = codec.decode_header(
+      memoryview(self.__buffer)[self.__start:self.__end], self.configuration
+    )
+    size = codec.header_frame_size(header)
+    self.__fill(size)
+    return self.__pop_frame(size)
+
+  def read_many(self, max_messages: int) -> typing.List[Message]:
+    """
+    Read one message, and then all messages that are already received,
+    up to ``max_messages``.
+
+    All returned messages are valid until next call to ``read`` or ``read_many``.
+    Invalid frame after the first message is left in the buffer, so messages
+    before it are returned, and error is raised by the next read.
+    """
+    result = [self.read()]
+    while len(result) < max_messages:
+      try:
+        size = self.__pending_frame_size()
+      except (exceptions.MessageTooLarge, exceptions.MalformedFrame):
+        break
+      if size is None:
+        break
+      result.append(self.__pop_frame(size))
+    return result
+
+  def __message_buffers(self, message: Message) -> typing.List[memoryview]:
+    return [
+      memoryview(codec.encode_header(message, self.configuration)),
+      memoryview(message.data).cast('B'),
+      memoryview(message.hmac).cast('B'),
+    ]
+
+  #                                  some kind of false-positive
+  def write(self, data: Message):  # pylint: disable=arguments-differ
+    self.__send_buffers(self.__message_buffers(data))
+
+  def write_many(self, messages: typing.Sequence[Message]):
+    """Writes all messages using as few ``sendmsg`` calls as possible."""
+    buffers = []
+    for message in messages:
+      buffers.extend(self.__message_buffers(message))
+    self.__send_buffers(buffers)
+
+  def __send_buffers(self, buffers: typing.List[memoryview]):
+    # Keep buffers in reverse order, so sent ones are popped from the end.
+    buffers.reverse()
+    while buffers:
+      sent = self.__socket.sendmsg(reversed(buffers[-IOV_MAX:]))
+      self.__statistics.send_calls += 1
+      self.__statistics.bytes_sent += sent
+      while buffers and sent >= len(buffers[-1]):
+        sent -= len(buffers.pop())
+      if buffers:
+        buffers[-1] = buffers[-1][sent:]
+
+
+DEFAULT_MTU = 1500
+"""Ethernet MTU."""
+
+UDP_OVERHEAD = {
+  socket.AF_INET: 20 + 8,
+  socket.AF_INET6: 40 + 8,
+}
+"""Size of IP and UDP headers for each address family."""
+
+
+def max_datagram_size(mtu: int = DEFAULT_MTU, family: int = socket.AF_INET) -> int:
+  """Largest UDP payload that is sent without IP fragmentation."""
+  return mtu - UDP_OVERHEAD[family]
+
+
+def datagram_configuration(
+    mtu: int = DEFAULT_MTU,
+    family: int = socket.AF_INET,
+    configuration: ChannelConfiguration = DEFAULT_CONFIGURATION
+) -> ChannelConfiguration:
+  """
+  Return ``configuration`` with ``max_message_size_bytes`` limited, so
+  that frame header and data fit into a single datagram. Hmac still needs
+  to fit, so actual data must be smaller by hmac size of the protocol.
+  """
+  return configuration._replace(max_message_size_bytes=min(
+    configuration.max_message_size_bytes,
+    max_datagram_size(mtu, family) - codec.HEADER.size
+  ))
+
+
+class DatagramDataSource(DataSource):
+  """
+  Data source sending each message as a single datagram over a connected
+  datagram (UDP) socket.
+
+  Datagrams use ``codec`` frame format. Received datagrams that are not
+  valid frames (truncated, with trailing data, too large) are silently
+  dropped and counted in ``statistics.malformed_received``, as datagrams
+  can't be trusted to arrive, let alone arrive intact.
+
+  Datagrams are received with ``recv_into`` into preallocated buffers that
+  are reused between reads, ``read_many`` receives datagrams that are
+  already queued without blocking. Messages returned from ``read`` and
+  ``read_many`` are views into these buffers, and are valid only until
+  next read.
+
+  Writing a frame larger than ``max_datagram_size`` raises ``MessageTooLarge``.
+  """
+
+  def __init__(
+      self,
+      config: ChannelConfiguration,
+      sock: socket.socket,
+      *,
+      timeout: typing.Optional[float] = None,
+      mtu: int = DEFAULT_MTU
+  ):
+    super().__init__(config)
+    self.__socket = sock
+    # Socket is non-blocking, so read_many can check for queued datagrams
+    # without system calls changing socket mode, we wait for it ourselves.
+    self.__socket.setblocking(False)
+    self.__timeout = timeout
+    self.__max_datagram_size = max_datagram_size(mtu, sock.family)
+    # One byte more, so we can detect datagrams that were truncated.
+    self.__buffers = [bytearray(self.__max_datagram_size + 1)]
+    self.__statistics = DataSourceStatistics()
+
+  @property
+  def socket(self) -> socket.socket:
+    """Underlying socket."""
+    return self.__socket
+
+  @property
+  def statistics(self) -> DataSourceStatistics:
+    """I/O counters."""
+    return self.__statistics
+
+  @property
+  def timeout(self) -> typing.Optional[float]:
+    """Read timeout in seconds, ``None`` means blocking forever."""
+    return self.__timeout
+
+  @timeout.setter
+  def timeout(self, timeout: typing.Optional[float]):
+    self.__timeout = timeout
+
+  @property
+  def max_datagram_size(self) -> int:
+    """Largest datagram that is sent or received."""
+    return self.__max_datagram_size
+
+  def __wait(self, for_write: bool):
+    """Wait until socket is ready, raise ``socket.timeout`` after ``timeout``."""
+    sockets = [self.__socket]
+    if for_write:
+      ready = select.select([], sockets, [], self.__timeout)[1]
+    else:
+      ready = select.select(sockets, [], [], self.__timeout)[0]
+    if not ready:
+      raise socket.timeout()
+
+  def __decode(self, buffer: bytearray, size: int) -> typing.Optional[Message]:
+    """Decode received datagram, return ``None`` if it is malformed."""
+    view = memoryview(buffer)[:size]
+    try:
+      if size > self.__max_datagram_size:
+        raise exceptions.MessageTooLarge()
+      message = codec.decode_message(view, self.configuration)
+      if codec.frame_size(message) != size:
+        raise exceptions.MalformedFrame()
+    except exceptions.BaseCryptoException:
+      self.__statistics.malformed_received += 1
+      return None
+    return message
+
+  def __recv(self, buffer: bytearray) -> typing.Optional[Message]:
+    """
+    Receive one datagram, raises ``BlockingIOError`` if none is queued.
+
+    Returns ``None`` if datagram is malformed, or if receive reported that
+    peer refused an earlier datagram (ICMP port unreachable), that datagram
+    is lost like any other.
+    """
+    try:
+      size = self.__socket.recv_into(buffer)
+    except ConnectionRefusedError:
+      self.__statistics.refused_received += 1
+      return None
+    self.__statistics.recv_calls += 1
+    self.__statistics.bytes_received += size
+    return self.__decode(buffer, size)
+
+  def read(self) -> Message:
+    message = None
+    while message is None:
+      try:
+        message = self.__recv(self.__buffers[0])
+      except BlockingIOError:
+        self.__wait(for_write=False)
+    return message
+
+  def read_many(self, max_messages: int) -> typing.List[Message]:
+    """
+    Read one message, and then all datagrams that are already queued,
+    up to ``max_messages``.
+
+    All returned messages are valid until next call to ``read`` or ``read_many``.
+    """
+    result = [self.read()]
+    while len(result) < max_messages:
+      if len(self.__buffers) <= len(result):
+        self.__buffers.append(bytearray(self.__max_datagram_size + 1))
+      try:
+        message = self.__recv(self.__buffers[len(result)])
+      except BlockingIOError:
+        break
+      if message is not None:
+        result.append(message)
+    return result
+
+  #                                  some kind of false-positive
+  def write(self, data: Message):  # pylint: disable=arguments-differ
+    header = codec.encode_header(data, self.configuration)
+    if codec.frame_size(data) > self.__max_datagram_size:
+      raise exceptions.MessageTooLarge()
+    while True:
+      try:
+        sent = self.__socket.sendmsg((header, data.data, data.hmac))
+        break
+      except BlockingIOError:  # pragma: no cover
+        # Only happens when socket send buffer is full.
+        self.__wait(for_write=True)
+    self.__statistics.send_calls += 1
+    self.__statistics.bytes_sent += sent
+
+
+class StreamDataSource(AsyncDataSource):
+  """
+  Asyncio data source sending ``codec`` frames over asyncio streams.
+
+  Create streams with ``asyncio.open_connection`` or ``asyncio.start_server``.
+  """
+
+  def __init__(
+      self,
+      config: ChannelConfiguration,
+      reader: asyncio.StreamReader,
+      writer: asyncio.StreamWriter,
+  ):
+    super().__init__(config)
+    self.__reader = reader
+    self.__writer = writer
+
+  @property
+  def writer(self) -> asyncio.StreamWriter:
+    """Underlying stream writer."""
+    return self.__writer
+
+  async def read(self) -> Message:
+    try:
+      header_bytes = await self.__reader.readexactly(codec.HEADER.size)
+      header = codec.decode_header(header_bytes, self.configuration)
+      data = await self.__reader.readexactly(header.data_length)
+      hmac = await self.__reader.readexactly(header.hmac_length)
+    except asyncio.IncompleteReadError as error:
+      raise exceptions.NotEnoughDataInInput() from error
+    return Message(message_id=header.message_id, data=data, hmac=hmac)
+
+  #                                        some kind of false-positive
+  async def write(self, data: Message):  # pylint: disable=arguments-differ
+    self.__writer.writelines((
+      codec.encode_header(data, self.configuration),
+      data.data,
+      data.hmac,
+    ))
+    await self.__writer.drain()
 
+  async def close(self):
+    """Close underlying stream."""
+    self.__writer.close()
+    await self.__writer.wait_closed()
@@ -51,3 +51,35 @@ class CounterOverflowError(BaseCryptoException):
   """
   A counter has overflown.
   """
+
+
+class MalformedFrame(BaseCryptoException):
+  """
+  Received frame can't be decoded.
+  """
+
+
+class MessageTooLarge(MalformedFrame):
+  """
+  Frame declares message larger than ``max_message_size_bytes``.
+  """
+
+
+class MalformedStream(BaseCryptoException):
+  """
+  Records of received stream are missing, out of order or malformed.
+  """
+
+
+class CorruptedSessionState(FatalException):
+  """
+  Persisted session state can't be read, so it's not known which message
+  ids were already used.
+  """
+
+
+class SessionStateInUse(FatalException):
+  """
+  Persisted session state is used by another process, using it in both
+  would reuse message ids.
+  """
@@ -1,12 +1,17 @@
 """Implementation of key negotiation."""
 
+import typing
+
 from .api import (
   SessionKeyNegotiator,
   DataSource,
   KeyExtensionFunction,
   CommunicationSide,
   SessionState,
-  ChannelConfiguration
+  ChannelConfiguration,
+  ChannelCryptoConfiguration,
+  ExtendedKeys,
+  SessionStateLoader,
 )
 
 from .key_extension import DefaultKeyExtensionFunction
@@ -23,19 +28,45 @@ class TestSessionKeyNegotiator(SessionKeyNegotiator):
       key: bytes,
       side: CommunicationSide,
       kef: KeyExtensionFunction = None,
+      session_state_factory: typing.Callable[
+        [ChannelConfiguration, ExtendedKeys], SessionState
+      ] = DefaultSessionState,
   ):
     if kef is None:
       kef = DefaultKeyExtensionFunction()
     self.key = key
     self.kef = kef
     self.side = side
+    self.session_state_factory = session_state_factory
 
   def create_session_state(
       self,
       data_source: DataSource,
       configuration: ChannelConfiguration
   ) -> SessionState:
-    return DefaultSessionState(
+    return self.session_state_factory(
       configuration,
       self.kef.extend_keys(self.side, bytearray(self.key)),
     )
+
+
+class LoadedSessionKeyNegotiator(SessionKeyNegotiator):
+  """
+  Doesn't negotiate anything, session state along with the keys is
+  loaded by ``loader``, for example persisted between program invocations.
+  """
+
+  def __init__(
+      self,
+      loader: SessionStateLoader,
+      crypto_configuration: ChannelCryptoConfiguration,
+  ):
+    self.loader = loader
+    self.crypto_configuration = crypto_configuration
+
+  def create_session_state(
+      self,
+      data_source: DataSource,
+      configuration: ChannelConfiguration
+  ) -> SessionState:
+    return self.loader.create_session_state(configuration, self.crypto_configuration)
@@ -0,0 +1,259 @@
+"""
+Session state persisted between program invocations, for devices that use
+one session key for a long time.
+
+Message ids are reserved ahead: persisted file holds the highest send
+and receive message ids that could have been used, and is synced once
+per ``reservation_size`` messages. After a crash the state jumps past the
+reservation, so message ids are never reused, at the cost of skipping up
+to ``reservation_size`` ids.
+"""
+
+import fcntl
+import os
+import struct
+import threading
+import typing
+import zlib
+
+from . import exceptions
+from .api import (
+  ChannelConfiguration,
+  ChannelCryptoConfiguration,
+  CommunicationSide,
+  ExtendedKeys,
+  KeyExtensionFunction,
+  SessionStateLoader,
+)
+from .key_extension import DefaultKeyExtensionFunction
+from .session_state import DefaultSessionState
+
+STATE_RECORD = struct.Struct(">QQQI4x")
+"""Generation, reserved send id, reserved receive id, crc32 of the previous fields."""
+
+DEFAULT_RESERVATION_SIZE = 1024
+"""Default number of message ids reserved with a single sync."""
+
+Reservation = typing.NamedTuple(
+  "Reservation",
+  (
+    ("send_message_number", int),
+    ("recv_message_number", int),
+  ),
+)
+"""Highest message ids that might have been used."""
+
+
+def open_locked(path: str) -> int:
+  """
+  Opens file at ``path``, creating it if needed, and returns its descriptor
+  locked with exclusive ``fcntl.flock`` lock.
+
+  Flock locks belong to the open file, not to the process, so the file
+  can't be opened again until the descriptor is closed, even by the same
+  process. Raises ``SessionStateInUse`` if file is already open.
+  """
+  try:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+  except FileExistsError:
+    fd = os.open(path, os.O_RDWR)
+  else:
+    # Sync directory entry, so created file survives a crash.
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+      os.fsync(directory)
+    finally:
+      os.close(directory)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except OSError as error:
+    os.close(fd)
+    raise exceptions.SessionStateInUse() from error
+  return fd
+
+
+class SessionStateFile(object):
+  """
+  File holding ``Reservation``, every update is synced before it returns.
+
+  There are two slots written alternately, each with a generation number
+  and a checksum. Write torn by a crash leaves the other slot intact, and
+  the torn reservation was never used, as nothing is used before the
+  write is synced.
+
+  File is opened with ``open_locked``, so while it's open any other
+  attempt to use it, in this or another process, raises ``SessionStateInUse``.
+  """
+
+  def __init__(self, path: str):
+    self.__path = path
+    self.__fd = open_locked(path)
+    self.__generation = 0
+
+  @property
+  def path(self) -> str:
+    """Path of the file."""
+    return self.__path
+
+  def load(self) -> Reservation:
+    """
+    Reads the reservation, new file holds zeros.
+
+    Raises ``CorruptedSessionState`` if file is not empty but neither
+    slot is valid.
+    """
+    data = os.pread(self.__fd, 2 * STATE_RECORD.size, 0)
+    if not data:
+      return Reservation(0, 0)
+    best = None
+    for offset in (0, STATE_RECORD.size):
+      record = data[offset:offset + STATE_RECORD.size]
+      if len(record) < STATE_RECORD.size:
+        continue
+      generation, send, recv, checksum = STATE_RECORD.unpack(record)
+      if checksum != zlib.crc32(record[:24]):
+        continue
+      if best is None or generation > best[0]:
+        best = (generation, send, recv)
+    if best is None:
+      raise exceptions.CorruptedSessionState()
+    self.__generation = best[0]
+    return Reservation(best[1], best[2])
+
+  def store(self, reservation: Reservation):
+    """Writes and syncs the reservation."""
+    self.__generation += 1
+    record = bytearray(STATE_RECORD.pack(self.__generation, *reservation, 0))
+    STATE_RECORD.pack_into(record, 0, self.__generation, *reservation, zlib.crc32(record[:24]))
+    os.pwrite(self.__fd, record, (self.__generation % 2) * STATE_RECORD.size)
+    os.fsync(self.__fd)
+
+  def close(self):
+    """Close the file, can be called many times."""
+    if self.__fd is not None:
+      os.close(self.__fd)
+      self.__fd = None
+
+
+class PersistentSessionState(DefaultSessionState):
+  """
+  Session state that reserves message ids in ``SessionStateFile``.
+
+  Sending message id past the reservation first syncs a new reservation
+  of ``reservation_size`` more ids. Receiving message id past the
+  reservation syncs it too, so after a crash messages that might have been
+  received before are rejected. Messages peer sent just before the
+  crash may be rejected as well, up to ``reservation_size`` of them.
+  """
+
+  def __init__(
+      self,
+      configuration: ChannelConfiguration,
+      key: ExtendedKeys,
+      state_file: SessionStateFile,
+      reservation_size: int = DEFAULT_RESERVATION_SIZE,
+  ) -> None:
+    reservation = state_file.load()
+    super().__init__(
+      configuration,
+      key,
+      send_message_number=reservation.send_message_number,
+      recv_message_number=reservation.recv_message_number,
+    )
+    assert reservation_size > 0
+    self.__state_file = state_file
+    self.__reservation_size = reservation_size
+    self.__reservation = reservation
+    self.__lock = threading.Lock()
+
+  @property
+  def reservation(self) -> Reservation:
+    """Reservation stored in the file."""
+    return self.__reservation
+
+  @property
+  def state_file(self) -> SessionStateFile:
+    """File reservation is stored in."""
+    return self.__state_file
+
+  def __reserve(self, send_message_number: int = 0, recv_message_number: int = 0):
+    """Make sure reservation covers given message ids."""
+    with self.__lock:
+      current = self.__reservation
+      if (
+          send_message_number <= current.send_message_number and
+          recv_message_number <= current.recv_message_number
+      ):
+        return
+      limit = self.configuration.max_messages_in_session
+      if send_message_number > current.send_message_number:
+        current = current._replace(
+          send_message_number=min(send_message_number + self.__reservation_size, limit)
+        )
+      if recv_message_number > current.recv_message_number:
+        current = current._replace(
+          recv_message_number=min(recv_message_number + self.__reservation_size, limit)
+        )
+      self.__state_file.store(current)
+      self.__reservation = current
+
+  def _lease_send_message_numbers(self, count: int, exact: bool) -> range:
+    leased = super()._lease_send_message_numbers(count, exact)
+    if leased:
+      # Ids are returned only after they are persisted as used.
+      self.__reserve(send_message_number=leased[-1])
+    return leased
+
+  def verify_recv_message_number(self, message_number: int):
+    # Reserve before state is updated, failed verification after that
+    # only makes the reservation larger than needed.
+    self.precheck_recv_message_number(message_number)
+    self.__reserve(recv_message_number=message_number)
+    super().verify_recv_message_number(message_number)
+
+  def reset(self):
+    super().reset()
+    self.__state_file.close()
+
+
+class FileSessionStateLoader(SessionStateLoader):
+  """
+  Loads ``PersistentSessionState`` reserving message ids in file at ``path``.
+
+  Every session key needs its own file, and only one state may use it,
+  loading state that is already loaded, by this or another process,
+  raises ``SessionStateInUse``.
+  """
+
+  def __init__(
+      self,
+      path: str,
+      key: bytes,
+      side: CommunicationSide,
+      kef: KeyExtensionFunction = None,
+      reservation_size: int = DEFAULT_RESERVATION_SIZE,
+  ):
+    if kef is None:
+      kef = DefaultKeyExtensionFunction()
+    self.path = path
+    self.key = key
+    self.side = side
+    self.kef = kef
+    self.reservation_size = reservation_size
+
+  def create_session_state(
+      self,
+      configuration: ChannelConfiguration,
+      crypto_configuration: ChannelCryptoConfiguration,
+  ) -> PersistentSessionState:
+    state_file = SessionStateFile(self.path)
+    try:
+      return PersistentSessionState(
+        configuration,
+        self.kef.extend_keys(self.side, bytearray(self.key)),
+        state_file,
+        self.reservation_size,
+      )
+    except BaseException:
+      state_file.close()
+      raise
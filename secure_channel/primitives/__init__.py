@@ -24,8 +24,27 @@ My issues with ``cryptography`` package:
   can't be zeroed. (NOTE: the same can be said about pycrypto).
 """
 
-from .api import Direction, CipherMode, HMAC, Backend, DataBuffer
+import concurrent.futures
+import typing
 
-from .pycrypto_backend import PycryptoBackend
+from .api import Direction, CipherMode, CipherContext, AEAD, HMAC, Backend, DataBuffer
+
+from .pycrypto_backend import PycryptoBackend, PARALLEL_THRESHOLD_BYTES
 
 BACKEND = PycryptoBackend()
+
+
+def configure_parallel_encryption(
+    threshold_bytes: int = PARALLEL_THRESHOLD_BYTES,
+    executor: typing.Optional[concurrent.futures.Executor] = None
+):
+  """
+  Configure parallel CTR encryption of ``BACKEND``, used by channels:
+  updates at least ``threshold_bytes`` large are encrypted in segments on
+  ``executor`` (by default a thread pool shared by all contexts).
+
+  Applies to channels whose crypto context is created after the call,
+  call without arguments to restore defaults.
+  """
+  BACKEND.parallel_threshold_bytes = threshold_bytes
+  BACKEND.executor = executor
@@ -42,6 +42,16 @@ class HMAC(HashFunction, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError
 
+  @abc.abstractmethod
+  def copy(self) -> "HMAC":
+    """
+    Return independent copy of this hmac, including all data fed so far.
+
+    This allows keyed hmac to be prepared once and then cloned for each
+    message.
+    """
+    raise NotImplementedError
+
 
 class CipherMode(object, metaclass=abc.ABCMeta):
   """
@@ -61,6 +71,67 @@ class CipherMode(object, metaclass=abc.ABCMeta):
 
     raise NotImplementedError
 
+  def update_into(self, data: DataBuffer, output: DataBuffer) -> None:
+    """
+    Encrypt or decrypt the data into ``output``, which needs to be
+    writable buffer of the same length as ``data``.
+
+    ``output`` may be the same buffer as ``data``, in which case data is
+    encrypted in place. Default implementation copies result of ``update``.
+    """
+    output[:] = self.update(data)
+
+  @abc.abstractmethod
+  def pad(self, data) -> bytearray:
+    """Pads data to block size."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def unpad(self, data) -> bytearray:
+    """Removes padding from data."""
+    raise NotImplementedError
+
+
+class CipherContext(object, metaclass=abc.ABCMeta):
+  """
+  Cipher with key already set up.
+
+  Creating cipher modes from the context skips key setup, so a context
+  should be created once per key and reused for every message.
+  """
+
+  @abc.abstractmethod
+  def create_cipher_mode(self, ctr: int, direction: Direction) -> CipherMode:
+    """Create initialized instance of Cipher Mode for message ``ctr``."""
+    raise NotImplementedError
+
+  @property
+  def parallel_threshold_bytes(self) -> typing.Optional[int]:
+    """
+    Single updates of at least this many bytes are split between many
+    threads, ``None`` if context never does that.
+
+    Callers processing data in chunks should pass data this large in
+    one update.
+    """
+    return None
+
+  def update_many(
+      self,
+      messages: typing.Sequence[typing.Tuple[int, DataBuffer]],
+      direction: Direction
+  ) -> typing.List[bytes]:
+    """
+    Encrypt or decrypt many messages, each given as ``(ctr, data)`` pair.
+
+    Output is the same as calling ``update`` once on cipher mode created for
+    each message, implementations may process whole batch at once.
+    """
+    return [
+      self.create_cipher_mode(ctr, direction).update(data)
+      for ctr, data in messages
+    ]
+
   @abc.abstractmethod
   def pad(self, data) -> bytearray:
     """Pads data to block size."""
@@ -72,6 +143,48 @@ class CipherMode(object, metaclass=abc.ABCMeta):
     raise NotImplementedError
 
 
+class AEAD(object, metaclass=abc.ABCMeta):
+  """
+  Keyed authenticated encryption with associated data.
+
+  Nonce is given as an int of up to 96 bits, implementations build nonce
+  bytes from it, so caller needs to ensure it is never reused with the
+  same key.
+  """
+
+  @property
+  @abc.abstractmethod
+  def tag_size_bytes(self) -> int:
+    """Size of authentication tag."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def encrypt(
+      self,
+      nonce: int,
+      data: DataBuffer,
+      associated_data: DataBuffer
+  ) -> typing.Tuple[bytes, bytes]:
+    """Encrypt data, returns ciphertext and authentication tag."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def decrypt(
+      self,
+      nonce: int,
+      data: DataBuffer,
+      tag: DataBuffer,
+      associated_data: DataBuffer
+  ) -> bytes:
+    """
+    Verify tag and decrypt data.
+
+    Raises ``InvalidSignature`` if tag doesn't match, in which case no
+    plaintext is returned.
+    """
+    raise NotImplementedError
+
+
 class Backend(object):
 
   """
@@ -99,3 +212,13 @@ class Backend(object):
   ) -> CipherMode:
     """Create initialized instance of Cipher Mode."""
     raise NotImplementedError
+
+  @abc.abstractmethod
+  def create_cipher_context(self, key: bytearray, cipher: str) -> CipherContext:
+    """Create cipher context that can create many Cipher Modes for ``key``."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def create_aead(self, key: bytearray, cipher: str) -> AEAD:
+    """Create AEAD instance for ``key``."""
+    raise NotImplementedError
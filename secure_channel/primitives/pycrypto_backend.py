@@ -1,21 +1,71 @@
 """Pycrypto implementation of backend."""
 
-from Crypto.Cipher import AES
-from Crypto.Hash import SHA256, HMAC
+import concurrent.futures
+import os
+import threading
+import typing
+
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Hash import SHA256
 from Crypto.Util import Counter, Padding
+from Crypto.Util.strxor import strxor
 
 from . import api
-from .utils import constant_time_compare, format_counter
+from .utils import constant_time_compare, format_counter, ctr_blocks, xor_buffers
 from .. import exceptions
 
 
+KEYSTREAM_THRESHOLD_BYTES = 512
+"""
+Messages up to this size are encrypted by cipher modes created from
+``PyCryptoCipherContext`` using keystream generated by a single ECB call,
+which avoids running the AES key schedule for every message. Larger messages
+use native CTR mode, which is faster once the key schedule is amortized.
+"""
+
+
+PARALLEL_THRESHOLD_BYTES = 8 * 1024 * 1024
+"""
+Cipher modes created from ``PyCryptoCipherContext`` split updates at least
+this large into segments, which are encrypted at their own counter
+offsets in a thread pool (pycrypto releases the GIL).
+"""
+
+MIN_SEGMENT_BYTES = 1024 * 1024
+"""Parallel updates are never split into segments smaller than this."""
+
+_PARALLEL_EXECUTOR = None
+_PARALLEL_EXECUTOR_LOCK = threading.Lock()
+
+
+def parallel_executor() -> concurrent.futures.Executor:
+  """Thread pool shared by all cipher contexts, created on first use."""
+  global _PARALLEL_EXECUTOR  # pylint: disable=global-statement
+  with _PARALLEL_EXECUTOR_LOCK:
+    if _PARALLEL_EXECUTOR is None:
+      _PARALLEL_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+        thread_name_prefix="secure-channel-ctr"
+      )
+    return _PARALLEL_EXECUTOR
+
+
 class PyCryptoHMAC(api.HMAC):
-  """HMAC."""
+  """
+  HMAC (RFC 2104) built on pycrypto hashes.
+
+  We keep inner and outer hash states ourselves, so copying keyed hmac
+  is just copying two hash objects, pycrypto ``HMAC.copy`` runs key
+  setup again.
+  """
   def __init__(self, digestmod, key: bytearray):
-    self.hmac = HMAC.HMAC(
-      key=bytes(key),  # TODO: Storing key as bytes.
-      digestmod=digestmod
-    )
+    # TODO: Storing key as bytes.
+    key = bytes(key)
+    if len(key) > digestmod.block_size:
+      key = digestmod.new(key).digest()
+    key = key.ljust(digestmod.block_size, b'\0')
+
+    self.inner = digestmod.new(bytes(byte ^ 0x36 for byte in key))
+    self.outer = digestmod.new(bytes(byte ^ 0x5c for byte in key))
 
   def verify(self, signature: bytearray):
     hmac_result = self.finalize()
@@ -23,10 +73,18 @@ class PyCryptoHMAC(api.HMAC):
       raise exceptions.InvalidSignature()
 
   def update(self, data: bytearray):
-    return self.hmac.update(data)
+    self.inner.update(data)
 
   def finalize(self) -> bytearray:
-    return bytearray(self.hmac.digest())
+    outer = self.outer.copy()
+    outer.update(self.inner.digest())
+    return bytearray(outer.digest())
+
+  def copy(self) -> "PyCryptoHMAC":
+    result = object.__new__(type(self))
+    result.inner = self.inner.copy()
+    result.outer = self.outer
+    return result
 
 
 class PyCryptoHash(api.HashFunction):
@@ -43,7 +101,22 @@ class PyCryptoHash(api.HashFunction):
     self.hash_func.update(data)
 
 
-class PyCryptoCipherMode(api.CipherMode):
+class _PyCryptoPadding(object):
+  """Padding and block size shared by pycrypto cipher modes and contexts."""
+
+  @property
+  def block_size_bytes(self) -> int:
+    """Returns block size of underlying cipher."""
+    return AES.block_size
+
+  def pad(self, data) -> bytearray:
+    return Padding.pad(data, self.block_size_bytes)
+
+  def unpad(self, data) -> bytearray:
+    return Padding.unpad(data, self.block_size_bytes)
+
+
+class PyCryptoCipherMode(_PyCryptoPadding, api.CipherMode):
   """Pycrypto CTR mode."""
   def __init__(
       self,
@@ -81,9 +154,6 @@ class PyCryptoCipherMode(api.CipherMode):
   def update(self, data: api.DataBuffer) -> bytearray:
     assert len(data) % self.cipher.block_size == 0
 
-    if not isinstance(data, bytes):
-      data = bytes(data)
-
     if self.direction == api.Direction.ENCRYPT:
       response = self.mode.encrypt(data)
     else:
@@ -91,22 +161,284 @@ class PyCryptoCipherMode(api.CipherMode):
 
     return response
 
+  def update_into(self, data: api.DataBuffer, output: api.DataBuffer) -> None:
+    assert len(data) % self.cipher.block_size == 0
+
+    if self.direction == api.Direction.ENCRYPT:
+      self.mode.encrypt(data, output=output)
+    else:
+      self.mode.decrypt(data, output=output)
+
+
+class PyCryptoContextCipherMode(_PyCryptoPadding, api.CipherMode):
+  """
+  Pycrypto CTR mode created from ``PyCryptoCipherContext``.
+
+  Produces exactly the same output as ``PyCryptoCipherMode``, counter block
+  ``i`` is ``format_counter(message_id) + format_counter(i)``.
+  """
+
+  def __init__(
+      self,
+      context: "PyCryptoCipherContext",
+      message_id: int,
+      direction: api.Direction,
+  ):
+    self.context = context
+    self.message_id = message_id
+    self.direction = direction
+    self.block_index = 0
+    # Native CTR mode positioned at ``block_index``, reused by subsequent
+    # large updates (e.g. when message is processed in chunks).
+    self.ctr_mode = None
+
+  def __keystream(self, block_count: int) -> bytes:
+    self.ctr_mode = None
+    return self.context.keystream(self.message_id, self.block_index, block_count)
+
+  def __native_mode(self):
+    if self.ctr_mode is None:
+      self.ctr_mode = self.context.create_ctr_mode(self.message_id, self.block_index)
+    return self.ctr_mode
+
+  def update(self, data: api.DataBuffer) -> bytearray:
+    assert len(data) % self.block_size_bytes == 0
+
+    block_count = len(data) // self.block_size_bytes
+
+    # CTR encryption and decryption are the same operation.
+    if len(data) <= KEYSTREAM_THRESHOLD_BYTES:
+      response = xor_buffers(data, self.__keystream(block_count))
+    elif len(data) >= self.context.parallel_threshold_bytes:
+      response = bytearray(len(data))
+      self.context.parallel_update_into(self.message_id, self.block_index, data, response)
+      self.ctr_mode = None
+    else:
+      response = self.__native_mode().encrypt(data)
+
+    self.block_index += block_count
+    return response
+
+  def update_into(self, data: api.DataBuffer, output: api.DataBuffer) -> None:
+    assert len(data) % self.block_size_bytes == 0
+
+    block_count = len(data) // self.block_size_bytes
+
+    if len(data) <= KEYSTREAM_THRESHOLD_BYTES:
+      strxor(data, self.__keystream(block_count), output=output)
+    elif len(data) >= self.context.parallel_threshold_bytes:
+      self.context.parallel_update_into(self.message_id, self.block_index, data, output)
+      self.ctr_mode = None
+    else:
+      self.__native_mode().encrypt(data, output=output)
+
+    self.block_index += block_count
+
+
+class PyCryptoCipherContext(_PyCryptoPadding, api.CipherContext):
+  """Pycrypto cipher with expanded key, used to create CTR modes."""
+
+  def __init__(
+      self,
+      cipher,
+      key: bytearray,
+      parallel_threshold_bytes: int = PARALLEL_THRESHOLD_BYTES,
+      executor: typing.Optional[concurrent.futures.Executor] = None
+  ):
+    """
+    :param executor: Executor used for parallel updates, by default
+                     thread pool shared by all contexts.
+    """
+    if isinstance(key, bytearray):
+      # TODO: ensure keys can be securely removed from memory.
+      key = bytes(key)
+
+    self.cipher = cipher
+    self.key = key
+    self.ecb = cipher.new(key=key, mode=cipher.MODE_ECB)
+    self.__parallel_threshold_bytes = parallel_threshold_bytes
+    self.executor = executor
+
   @property
-  def block_size_bytes(self) -> int:
-    """Returns block size of underlying cipher."""
-    return AES.block_size
+  def parallel_threshold_bytes(self) -> int:
+    return self.__parallel_threshold_bytes
 
-  def pad(self, data) -> bytearray:
-    return Padding.pad(data, self.block_size_bytes)
+  def __segment_size(self, length: int) -> int:
+    workers = os.cpu_count() or 1
+    segment = max(MIN_SEGMENT_BYTES, -(-length // workers))
+    return -(-segment // self.block_size_bytes) * self.block_size_bytes
 
-  def unpad(self, data) -> bytearray:
-    return Padding.unpad(data, self.block_size_bytes)
+  def __update_segment(self, message_id: int, first_block: int, data, output):
+    self.create_ctr_mode(message_id, first_block).encrypt(data, output=output)
+
+  def parallel_update_into(
+      self,
+      message_id: int,
+      first_block: int,
+      data: api.DataBuffer,
+      output: api.DataBuffer
+  ):
+    """
+    CTR encrypt (or decrypt) ``data`` into ``output`` starting at block
+    ``first_block``, with block aligned segments processed in parallel.
+    """
+    executor = self.executor if self.executor is not None else parallel_executor()
+    segment = self.__segment_size(len(data))
+    with memoryview(data) as source_view, source_view.cast('B') as source, \
+        memoryview(output) as output_view, output_view.cast('B') as target:
+      futures = [
+        executor.submit(
+          self.__update_segment,
+          message_id,
+          first_block + start // self.block_size_bytes,
+          source[start:start + segment],
+          target[start:start + segment]
+        )
+        # Last segment is done by the calling thread.
+        for start in range(0, len(source) - segment, segment)
+      ]
+      last = len(futures) * segment
+      try:
+        self.__update_segment(
+          message_id, first_block + last // self.block_size_bytes, source[last:], target[last:]
+        )
+      finally:
+        for future in futures:
+          future.result()
+
+  def keystream(self, message_id: int, first_block: int, block_count: int) -> bytes:
+    """Return ``block_count`` blocks of keystream starting at ``first_block``."""
+    return self.ecb.encrypt(ctr_blocks(message_id, first_block, block_count))
+
+  def create_ctr_mode(self, message_id: int, first_block: int):
+    """Return native pycrypto CTR mode positioned at ``first_block``."""
+    return self.cipher.new(
+      key=self.key,
+      mode=self.cipher.MODE_CTR,
+      nonce=format_counter(message_id),
+      initial_value=first_block
+    )
+
+  def create_cipher_mode(
+      self,
+      ctr: int,
+      direction: api.Direction
+  ) -> PyCryptoContextCipherMode:
+    return PyCryptoContextCipherMode(self, message_id=ctr, direction=direction)
+
+  def update_many(
+      self,
+      messages: typing.Sequence[typing.Tuple[int, api.DataBuffer]],
+      direction: api.Direction
+  ) -> typing.List[bytes]:
+    """
+    Messages up to ``KEYSTREAM_THRESHOLD_BYTES`` are processed together:
+    counter blocks for all of them are encrypted with a single ECB call, and
+    the keystream is xored with all messages at once. Larger messages use
+    native CTR mode.
+    """
+    result = [None] * len(messages)
+    small = []
+    for index, (message_id, data) in enumerate(messages):
+      assert len(data) % self.block_size_bytes == 0
+      if len(data) <= KEYSTREAM_THRESHOLD_BYTES:
+        small.append(index)
+      else:
+        result[index] = self.create_ctr_mode(message_id, 0).encrypt(data)
+
+    if small:
+      counters = b''.join([
+        ctr_blocks(messages[index][0], 0, len(messages[index][1]) // self.block_size_bytes)
+        for index in small
+      ])
+      keystream = self.ecb.encrypt(counters)
+      output = xor_buffers(b''.join([messages[index][1] for index in small]), keystream)
+      position = 0
+      for index in small:
+        length = len(messages[index][1])
+        result[index] = output[position:position + length]
+        position += length
+
+    return result
+
+
+AEAD_NONCE_SIZE = 12
+"""Size of AEAD nonce in bytes, nonce ints can have up to 96 bits."""
+
+
+def aead_nonce(nonce: int) -> bytes:
+  """
+  96 bit AEAD nonce, message counters are formatted as in CTR mode,
+  after four zero bytes.
+  """
+  if nonce >= 1 << (8 * AEAD_NONCE_SIZE):
+    raise exceptions.CounterOverflowError()
+  return nonce.to_bytes(AEAD_NONCE_SIZE, "big")
+
+
+class PyCryptoAEAD(api.AEAD):
+  """Pycrypto AEAD, either AES-GCM or ChaCha20-Poly1305."""
+
+  def __init__(self, factory, key: bytearray):
+    """
+    :param factory: Callable taking key and nonce and returning
+                    new pycrypto AEAD cipher.
+    """
+    # TODO: ensure keys can be securely removed from memory.
+    self.factory = factory
+    self.key = bytes(key)
+
+  @property
+  def tag_size_bytes(self) -> int:
+    return 16
+
+  def encrypt(
+      self,
+      nonce: int,
+      data: api.DataBuffer,
+      associated_data: api.DataBuffer
+  ) -> typing.Tuple[bytes, bytes]:
+    cipher = self.factory(self.key, aead_nonce(nonce))
+    cipher.update(associated_data)
+    return cipher.encrypt_and_digest(data)
+
+  def decrypt(
+      self,
+      nonce: int,
+      data: api.DataBuffer,
+      tag: api.DataBuffer,
+      associated_data: api.DataBuffer
+  ) -> bytes:
+    cipher = self.factory(self.key, aead_nonce(nonce))
+    cipher.update(associated_data)
+    try:
+      return cipher.decrypt_and_verify(data, tag)
+    except ValueError as error:
+      raise exceptions.InvalidSignature() from error
+
+
+AEAD_FACTORIES = {
+  "AES-256-GCM": lambda key, nonce: AES.new(key=key, mode=AES.MODE_GCM, nonce=nonce),
+  "ChaCha20-Poly1305": lambda key, nonce: ChaCha20_Poly1305.new(key=key, nonce=nonce),
+}
 
 
 class PycryptoBackend(api.Backend):
 
   """Pycrypto backend."""
 
+  def __init__(
+      self,
+      parallel_threshold_bytes: int = PARALLEL_THRESHOLD_BYTES,
+      executor: typing.Optional[concurrent.futures.Executor] = None
+  ):
+    """
+    Parameters are passed to every ``PyCryptoCipherContext`` created
+    by this backend.
+    """
+    self.parallel_threshold_bytes = parallel_threshold_bytes
+    self.executor = executor
+
   def create_cipher_mode(
       self,
       key: bytearray,
@@ -120,7 +452,28 @@ class PycryptoBackend(api.Backend):
     return PyCryptoCipherMode(
       cipher=AES, message_id=ctr, key=key, direction=direction)
 
-  def create_hmac(self, key: bytearray, hash_func: str) -> HMAC:
+  def create_cipher_context(
+      self,
+      key: bytearray,
+      cipher: str
+  ) -> PyCryptoCipherContext:
+    assert cipher == "AES"
+    assert len(key) == (256 / 8)
+
+    return PyCryptoCipherContext(
+      cipher=AES,
+      key=key,
+      parallel_threshold_bytes=self.parallel_threshold_bytes,
+      executor=self.executor
+    )
+
+  def create_aead(self, key: bytearray, cipher: str) -> PyCryptoAEAD:
+    assert cipher in AEAD_FACTORIES
+    assert len(key) == (256 / 8)
+
+    return PyCryptoAEAD(AEAD_FACTORIES[cipher], key)
+
+  def create_hmac(self, key: bytearray, hash_func: str) -> PyCryptoHMAC:
     assert hash_func == "SHA-256"
     return PyCryptoHMAC(SHA256, key)
 
@@ -33,3 +33,31 @@ def format_counter(counter: int) -> bytes:
   return struct.pack(">Q", counter)
 
 
+_BLOCK_SUFFIXES = [struct.pack(">Q", block) for block in range(1024)]
+"""Precomputed block counter halves of counter blocks."""
+
+
+def ctr_blocks(message_id: int, first_block: int, block_count: int) -> bytes:
+  """
+  Concatenated CTR counter blocks ``first_block`` .. ``first_block + block_count``
+  for message ``message_id``, see ``doc/ctr-mode.md``.
+  """
+  if block_count == 0:
+    return b''
+  prefix = format_counter(message_id)
+  last_block = first_block + block_count
+  if last_block <= len(_BLOCK_SUFFIXES):
+    suffixes = _BLOCK_SUFFIXES[first_block:last_block]
+  else:
+    suffixes = [format_counter(block) for block in range(first_block, last_block)]
+  # Joining suffixes with prefix interleaves them, we only need to add
+  # prefix of the first block.
+  return prefix + prefix.join(suffixes)
+
+
+def xor_buffers(left: bytes, right: bytes) -> bytes:
+  """Xor two buffers of equal length."""
+  assert len(left) == len(right)
+  length = len(left)
+  result = int.from_bytes(left, byteorder='big') ^ int.from_bytes(right, byteorder='big')
+  return result.to_bytes(length, byteorder='big')
@@ -0,0 +1,318 @@
+"""
+Session state that rotates keys in band, without renegotiation.
+
+Session is split into epochs of ``max_messages_in_session - 1`` messages.
+Epoch is carried in the upper bits of message id, which is already sent
+and authenticated with every message. At the start of every epoch both
+sides hash keys of the previous epoch, so keys change without any extra
+messages, and keys of older epochs are destroyed.
+"""
+
+import itertools
+import threading
+import typing
+
+from . import exceptions, utils
+from .api import ChannelConfiguration, ChannelCryptoConfiguration, ExtendedKeys, Message
+from .api import DataBuffer, ReceivedMessage
+from .primitives import BACKEND
+from .secure_channel.crypto_context import ChannelCryptoContext
+from .session_state import DefaultSessionState
+
+EPOCH_SHIFT = 32
+"""Epoch is stored in bits of message id above this one."""
+
+MAX_EPOCH = (1 << (63 - EPOCH_SHIFT)) - 1
+"""Last epoch, message ids need to fit in a signed 64 bit counter."""
+
+RATCHET_LABEL = b'Ratchet key'
+
+
+def join_message_id(epoch: int, message_number: int) -> int:
+  """Message id of ``message_number`` in ``epoch``."""
+  return (epoch << EPOCH_SHIFT) | message_number
+
+
+def split_message_id(message_id: int) -> typing.Tuple[int, int]:
+  """Returns epoch and message number within epoch."""
+  return message_id >> EPOCH_SHIFT, message_id & ((1 << EPOCH_SHIFT) - 1)
+
+
+def ratchet_key(key: DataBuffer) -> bytearray:
+  """Returns key of the next epoch."""
+  hash_obj = BACKEND.create_hash("SHA-256")
+  hash_obj.update(RATCHET_LABEL)
+  hash_obj.update(bytes(key))
+  return bytearray(hash_obj.finalize())
+
+
+class KeyChain(object):
+  """
+  Encryption and sign keys of a single direction, ratcheted every epoch.
+
+  Keys of the current and the previous epoch are kept, for messages
+  sealed or opened around epoch boundary, keys of the next epoch are
+  derived on demand, older keys are destroyed.
+  """
+
+  def __init__(self, encryption_key: bytearray, sign_key: bytearray, epoch: int = 0):
+    self.__lock = threading.Lock()
+    self.__epoch = epoch
+    self.__keys = {epoch: (encryption_key, sign_key)}
+
+  @property
+  def epoch(self) -> int:
+    """Current epoch."""
+    return self.__epoch
+
+  def __derive(self, epoch: int) -> typing.Tuple[bytearray, bytearray]:
+    keys = self.__keys.get(epoch)
+    if keys is None:
+      keys = tuple(ratchet_key(key) for key in self.__derive(epoch - 1))
+      self.__keys[epoch] = keys
+    return keys
+
+  def keys(self, epoch: int) -> typing.Tuple[bytearray, bytearray]:
+    """
+    Returns encryption and sign key of ``epoch``, without advancing to it.
+
+    Raises ``KeyError`` if ``epoch`` is neither known nor the next one.
+    """
+    with self.__lock:
+      if self.__keys is None:
+        raise exceptions.AlreadyReseted()
+      if epoch not in self.__keys and epoch != self.__epoch + 1:
+        raise KeyError(epoch)
+      return self.__derive(epoch)
+
+  def advance(self, epoch: int):
+    """Make ``epoch`` current, and destroy keys older than the previous epoch."""
+    with self.__lock:
+      if self.__keys is None:
+        raise exceptions.AlreadyReseted()
+      self.__derive(epoch)
+      self.__epoch = epoch
+      for old in [old for old in self.__keys if old < epoch - 1]:
+        utils.destroy_key(self.__keys.pop(old))
+
+  def destroy(self):
+    """Destroy all keys."""
+    with self.__lock:
+      for keys in (self.__keys or {}).values():
+        utils.destroy_key(keys)
+      self.__keys = None
+
+
+class RatchetSessionState(DefaultSessionState):
+  """
+  Session state that moves to the next epoch, with new keys, instead of
+  raising ``NeedToRenegotiateKey`` when message numbers run out.
+
+  Message ids are ``join_message_id(epoch, number)``, where numbers go from
+  one to ``max_messages_in_session - 1`` in every epoch. ``key`` are keys
+  of epochs of ``send_message_number`` and ``recv_message_number``, as
+  returned by ``get_extended_keys``. Received message ids need to grow,
+  and peer can't skip an epoch, so ids are handed out one by one, in
+  order, never in per thread blocks.
+
+  Keys are destroyed when epoch changes, so channel needs crypto context
+  created by ``create_crypto_context``.
+  """
+
+  def __init__(
+      self,
+      configuration: ChannelConfiguration,
+      key: ExtendedKeys,
+      send_message_number: int = 0,
+      recv_message_number: int = 0,
+  ) -> None:
+    super().__init__(configuration, key)
+    assert 1 < configuration.max_messages_in_session <= 1 << EPOCH_SHIFT
+    self.__send_message_number = send_message_number
+    self.__recv_message_number = recv_message_number
+    self.__send_chain = KeyChain(
+      key.send_encryption_key, key.send_sign_key, split_message_id(send_message_number)[0]
+    )
+    self.__recv_chain = KeyChain(
+      key.recv_encryption_key, key.recv_sign_key, split_message_id(recv_message_number)[0]
+    )
+
+  @property
+  def send_chain(self) -> KeyChain:
+    """Keys of sent messages."""
+    return self.__send_chain
+
+  @property
+  def recv_chain(self) -> KeyChain:
+    """Keys of received messages."""
+    return self.__recv_chain
+
+  @property
+  def send_message_number(self) -> int:
+    return self.__send_message_number
+
+  @property
+  def recv_message_number(self) -> int:
+    return self.__recv_message_number
+
+  def _lease_send_message_numbers(self, count: int, exact: bool) -> range:
+    """
+    Ids of a single lease are always in the same epoch. Ids are never
+    leased in blocks, so ``exact`` is always True.
+    """
+    assert exact
+    limit = self.configuration.max_messages_in_session
+    with self._send_lock:
+      self._assert_ready()
+      epoch, number = split_message_id(self.__send_message_number)
+      first, last = number + 1, number + count
+      if last >= limit:
+        epoch, first, last = epoch + 1, 1, count
+        if last >= limit:
+          raise exceptions.NeedToRenegotiateKey()
+      if epoch > MAX_EPOCH:
+        raise exceptions.NeedToRenegotiateKey()
+      if epoch != self.__send_chain.epoch:
+        self.__send_chain.advance(epoch)
+      self.__send_message_number = join_message_id(epoch, last)
+      return range(join_message_id(epoch, first), join_message_id(epoch, last) + 1)
+
+  def __check(self, message_number: int):
+    self._assert_ready()
+    if message_number <= self.__recv_message_number:
+      raise exceptions.RecvMessageOutOfSequence()
+    epoch, number = split_message_id(message_number)
+    if number == 0 or number >= self.configuration.max_messages_in_session:
+      raise exceptions.NeedToRenegotiateKey()
+    if epoch > self.__recv_chain.epoch + 1:
+      raise exceptions.NeedToRenegotiateKey()
+
+  def precheck_recv_message_number(self, message_number: int):
+    self.__check(message_number)
+
+  def verify_recv_message_number(self, message_number: int):
+    with self._recv_lock:
+      self.__check(message_number)
+      epoch = split_message_id(message_number)[0]
+      if epoch != self.__recv_chain.epoch:
+        self.__recv_chain.advance(epoch)
+      self.__recv_message_number = message_number
+
+  def get_extended_keys(self) -> ExtendedKeys:
+    """Keys of the current epochs."""
+    self._assert_ready()
+    send_encryption_key, send_sign_key = self.__send_chain.keys(self.__send_chain.epoch)
+    recv_encryption_key, recv_sign_key = self.__recv_chain.keys(self.__recv_chain.epoch)
+    return ExtendedKeys(
+      send_encryption_key=send_encryption_key,
+      recv_encryption_key=recv_encryption_key,
+      send_sign_key=send_sign_key,
+      recv_sign_key=recv_sign_key,
+    )
+
+  def create_crypto_context(
+      self,
+      crypto_configuration: ChannelCryptoConfiguration,
+      factory: typing.Callable[[ChannelCryptoConfiguration, ExtendedKeys], ChannelCryptoContext]
+  ) -> "RatchetCryptoContext":
+    return RatchetCryptoContext(crypto_configuration, self, factory)
+
+  def reset(self):
+    super().reset()
+    self.__send_chain.destroy()
+    self.__recv_chain.destroy()
+
+
+class _EpochContexts(object):
+  """Crypto contexts of a single direction, by epoch."""
+
+  def __init__(
+      self,
+      chain: KeyChain,
+      crypto_configuration: ChannelCryptoConfiguration,
+      factory: typing.Callable[[ChannelCryptoConfiguration, ExtendedKeys], ChannelCryptoContext]
+  ):
+    self.chain = chain
+    self.crypto_configuration = crypto_configuration
+    self.factory = factory
+    self.contexts = {}
+    self.lock = threading.Lock()
+
+  def get(self, epoch: int) -> ChannelCryptoContext:
+    """Returns context of ``epoch``, raises ``KeyError`` if chain has no keys for it."""
+    context = self.contexts.get(epoch)
+    if context is not None:
+      return context
+    with self.lock:
+      context = self.contexts.get(epoch)
+      if context is None:
+        encryption_key, sign_key = self.chain.keys(epoch)
+        # Context is used in one direction only, so keys of other one are the same.
+        context = self.factory(
+          self.crypto_configuration,
+          ExtendedKeys(encryption_key, encryption_key, sign_key, sign_key)
+        )
+        # Readers don't take the lock, so dict is replaced, not updated.
+        contexts = {old: value for old, value in self.contexts.items() if old >= epoch - 1}
+        contexts[epoch] = context
+        self.contexts = contexts
+      return context
+
+
+class RatchetCryptoContext(ChannelCryptoContext):
+  """
+  Crypto context of ``RatchetSessionState``, seals and opens messages
+  with contexts created by ``factory`` from keys of epoch of message.
+  """
+
+  def __init__(
+      self,
+      crypto_configuration: ChannelCryptoConfiguration,
+      session_state: RatchetSessionState,
+      factory: typing.Callable[[ChannelCryptoConfiguration, ExtendedKeys], ChannelCryptoContext]
+  ):
+    super().__init__(crypto_configuration)
+    self.__send = _EpochContexts(session_state.send_chain, crypto_configuration, factory)
+    self.__recv = _EpochContexts(session_state.recv_chain, crypto_configuration, factory)
+
+  def __recv_context(self, message: Message) -> ChannelCryptoContext:
+    try:
+      return self.__recv.get(split_message_id(message.message_id)[0])
+    except KeyError:
+      # Keys of this epoch are gone or can't be derived yet.
+      raise exceptions.InvalidSignature()
+
+  def seal(self, message_id: int, data: DataBuffer) -> Message:
+    return self.__send.get(split_message_id(message_id)[0]).seal(message_id, data)
+
+  def seal_many(
+      self,
+      message_ids: typing.Sequence[int],
+      data: typing.Sequence[DataBuffer]
+  ) -> typing.List[Message]:
+    result = []
+    pairs = zip(message_ids, data)
+    for epoch, group in itertools.groupby(pairs, lambda pair: split_message_id(pair[0])[0]):
+      group_ids, group_data = zip(*group)
+      result.extend(self.__send.get(epoch).seal_many(group_ids, group_data))
+    return result
+
+  def open(self, message: Message) -> bytes:
+    return self.__recv_context(message).open(message)
+
+  def open_into(self, message: Message, output: DataBuffer) -> int:
+    return self.__recv_context(message).open_into(message, output)
+
+  def open_many(self, messages: typing.Sequence[Message]) -> typing.List[ReceivedMessage]:
+    result = []
+    for __, group in itertools.groupby(
+        messages, lambda message: split_message_id(message.message_id)[0]
+    ):
+      group = list(group)
+      try:
+        context = self.__recv_context(group[0])
+      except exceptions.InvalidSignature as error:
+        result.extend(ReceivedMessage(message.message_id, None, error) for message in group)
+      else:
+        result.extend(context.open_many(group))
+    return result
@@ -1,3 +1,4 @@
 """Implements a secure channel."""
 
 from .proper import SecureChannel
+from .asyncio_channel import AsyncSecureChannel
@@ -0,0 +1,65 @@
+"""Implements a secure channel for asyncio."""
+
+import asyncio
+import concurrent.futures
+import typing
+
+from secure_channel import api
+
+from .proper import BaseSecureChannel
+
+
+EXECUTOR_THRESHOLD_BYTES = 64 * 1024
+"""
+Crypto for messages larger than this is done in an executor, so it
+doesn't stall the event loop.
+"""
+
+
+class AsyncSecureChannel(BaseSecureChannel):
+
+  """
+  Secure channel for asyncio, it uses the same crypto as ``SecureChannel``.
+
+  Sends (and receives) are serialized, so message ids are written
+  in the same order they were assigned, even if crypto for some messages
+  runs in an executor.
+  """
+
+  def __init__(
+      self,
+      data_source: api.AsyncDataSource,
+      key_generator: api.SessionKeyNegotiator,
+      *,
+      executor: typing.Optional[concurrent.futures.Executor] = None,
+      executor_threshold_bytes: int = EXECUTOR_THRESHOLD_BYTES,
+      **kwargs
+  ):
+    super().__init__(data_source, key_generator, **kwargs)
+    self._executor = executor
+    self._executor_threshold_bytes = executor_threshold_bytes
+    self._send_lock = asyncio.Lock()
+    self._recv_lock = asyncio.Lock()
+
+  async def _run_crypto(self, func, data_length: int, *args):
+    if data_length <= self._executor_threshold_bytes:
+      return func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor, func, *args)
+
+  async def send_message(self, data: api.DataBuffer):
+    """Sends the message."""
+    async with self._send_lock:
+      message = await self._run_crypto(self._send_utils.create_message, len(data), data)
+      await self._data_source.write(message)
+
+  async def receive_message(self) -> bytearray:
+    """Reads the message."""
+    async with self._recv_lock:
+      message = await self._data_source.read()
+      while not self._recv_utils.accept(message):
+        message = await self._data_source.read()
+      message = await self._run_crypto(
+        self._recv_utils.decrypt_and_verify_message, len(message.data), message
+      )
+      return message.data
@@ -0,0 +1,446 @@
+"""
+Crypto contexts, these implement the actual protocol of SecureChannel.
+
+Every protocol version has its own context class. Contexts are created
+once per channel from extended keys, and hold all the prepared state
+needed to seal (sign and encrypt) and open (verify and decrypt)
+messages.
+"""
+
+import abc
+import pickle
+import typing
+
+from secure_channel import api, exceptions
+from secure_channel.primitives import BACKEND, HMAC, CipherContext, CipherMode, Direction
+from secure_channel.primitives.utils import format_counter
+from secure_channel.utils import clear_buffer
+
+from . import utils
+
+
+class ChannelCryptoContext(object, metaclass=abc.ABCMeta):
+  """
+  Crypto state of a channel for a single protocol version.
+
+  Contexts don't touch session state, callers assign message ids, and
+  verify message ids after message is opened.
+  """
+
+  def __init__(self, crypto_configuration: api.ChannelCryptoConfiguration):
+    self.crypto_configuration = crypto_configuration
+    self.serialized_details = pickle.dumps(
+      utils.CryptoDetailsSerializedForm(crypto_configuration)
+    )
+    self._details_header = format_counter(len(self.serialized_details)) + self.serialized_details
+
+  def message_header(self, message_id: int, data_length: int) -> bytes:
+    """
+    Authenticated data preceding message data: message id, serialized crypto
+    configuration and data length.
+    """
+    return b''.join((
+      format_counter(message_id),
+      self._details_header,
+      format_counter(data_length),
+    ))
+
+  @abc.abstractmethod
+  def seal(self, message_id: int, data: api.DataBuffer) -> api.Message:
+    """Sign and encrypt data."""
+    raise NotImplementedError
+
+  @abc.abstractmethod
+  def open(self, message: api.Message) -> bytes:
+    """
+    Verify and decrypt message, returns plaintext.
+
+    Raises ``InvalidSignature`` if message is invalid.
+    """
+    raise NotImplementedError
+
+  def seal_many(
+      self,
+      message_ids: typing.Sequence[int],
+      data: typing.Sequence[api.DataBuffer]
+  ) -> typing.List[api.Message]:
+    """Sign and encrypt many messages."""
+    return [
+      self.seal(message_id, message_data)
+      for message_id, message_data in zip(message_ids, data)
+    ]
+
+  def open_into(self, message: api.Message, output: api.DataBuffer) -> int:
+    """
+    Verify and decrypt message into ``output``, returns plaintext length.
+
+    ``output`` needs to hold at least ``len(message.data)`` bytes. If
+    message is invalid, ``InvalidSignature`` is raised and ``output``
+    doesn't contain any plaintext.
+    """
+    data = self.open(message)
+    output[:len(data)] = data
+    return len(data)
+
+  def open_many(self, messages: typing.Sequence[api.Message]) -> typing.List[api.ReceivedMessage]:
+    """
+    Verify and decrypt many messages, invalid ones are returned
+    with ``error`` set.
+    """
+    result = []
+    for message in messages:
+      try:
+        data = self.open(message)
+      except exceptions.BaseCryptoException as error:
+        result.append(api.ReceivedMessage(message.message_id, None, error))
+      else:
+        result.append(api.ReceivedMessage(message.message_id, data, None))
+    return result
+
+
+FUSED_CHUNK_SIZE = 1024 * 1024
+"""
+Large messages are signed and encrypted (or decrypted and verified) in
+chunks of this size, each chunk is fed to hmac and cipher while it is
+still in cache, so message is read from memory once. Chunk should fit in
+L2 cache, but smaller chunks make per call overhead of pycrypto noticeable.
+"""
+
+
+def _chunks(length: int, cipher_context: CipherContext) -> typing.Iterator[slice]:
+  """
+  Slices covering ``length`` bytes in ``FUSED_CHUNK_SIZE`` chunks.
+
+  If ``cipher_context`` encrypts data this large in parallel, whole data is
+  a single chunk, multiple cores are faster than cache-friendly single pass.
+  """
+  chunk_size = FUSED_CHUNK_SIZE
+  parallel_threshold = cipher_context.parallel_threshold_bytes
+  if parallel_threshold is not None and length >= parallel_threshold:
+    chunk_size = length
+  return (
+    slice(start, min(start + chunk_size, length))
+    for start in range(0, length, chunk_size)
+  )
+
+
+class HmacCtrCryptoContext(ChannelCryptoContext):
+  """
+  Protocol version 1: HMAC of the plaintext, then message and padded hmac
+  are encrypted in CTR mode.
+
+  Holds keyed cipher contexts and hmacs for both directions, so that
+  per message we only clone prepared state.
+  """
+
+  def __init__(
+      self,
+      crypto_configuration: api.ChannelCryptoConfiguration,
+      extended_keys: api.ExtendedKeys
+  ):
+    super().__init__(crypto_configuration)
+    self.send_cipher = BACKEND.create_cipher_context(
+      extended_keys.send_encryption_key, crypto_configuration.block_cipher
+    )
+    self.recv_cipher = BACKEND.create_cipher_context(
+      extended_keys.recv_encryption_key, crypto_configuration.block_cipher
+    )
+    self.send_hmac = BACKEND.create_hmac(
+      extended_keys.send_sign_key, crypto_configuration.hash_algo
+    )
+    self.recv_hmac = BACKEND.create_hmac(
+      extended_keys.recv_sign_key, crypto_configuration.hash_algo
+    )
+    self.hmac_size_bytes = len(self.recv_hmac.copy().finalize())
+    self.padded_hmac_size_bytes = len(self.send_cipher.pad(bytes(self.hmac_size_bytes)))
+
+  def _data_hmac(self, keyed_hmac: HMAC, message_id: int, data_length: int) -> HMAC:
+    hmac = keyed_hmac.copy()
+    hmac.update(self.message_header(message_id, data_length))
+    return hmac
+
+  def create_send_hmac(self, message_id: int, data_length: int) -> HMAC:
+    """
+    Create hmac for sent message, with everything but the data itself
+    already fed to it.
+    """
+    return self._data_hmac(self.send_hmac, message_id, data_length)
+
+  def create_recv_hmac(self, message_id: int, data_length: int) -> HMAC:
+    """
+    Create hmac for received message, with everything but the data itself
+    already fed to it.
+    """
+    return self._data_hmac(self.recv_hmac, message_id, data_length)
+
+  def create_send_cipher(self, message_id: int) -> CipherMode:
+    """Create cipher mode encrypting sent message."""
+    return self.send_cipher.create_cipher_mode(message_id, Direction.ENCRYPT)
+
+  def create_recv_cipher(self, message_id: int) -> CipherMode:
+    """Create cipher mode decrypting received message."""
+    return self.recv_cipher.create_cipher_mode(message_id, Direction.DECRYPT)
+
+  def _sent_message_hmac(self, message_id: int, data: api.DataBuffer) -> bytearray:
+    hmac = self.create_send_hmac(message_id, len(data))
+    hmac.update(data)
+    return hmac.finalize()
+
+  def _check_block_lengths(self, message: api.Message):
+    block_size = self.recv_cipher.block_size_bytes
+    if len(message.data) % block_size != 0 or len(message.hmac) % block_size != 0:
+      raise exceptions.InvalidSignature()
+
+  def _unpad_hmac(self, padded_hmac: bytes) -> bytes:
+    try:
+      return self.recv_cipher.unpad(padded_hmac)
+    except ValueError as error:
+      # Invalid padding of encrypted hmac means message was tampered with.
+      raise exceptions.InvalidSignature() from error
+
+  def _verify_hmac(self, message_id: int, data: api.DataBuffer, hmac: bytes):
+    hmac_obj = self.create_recv_hmac(message_id, len(data))
+    hmac_obj.update(data)
+    hmac_obj.verify(hmac)
+
+  def seal(self, message_id: int, data: api.DataBuffer) -> api.Message:
+    """
+    Signs and encrypts data in a single pass, see ``FUSED_CHUNK_SIZE``.
+    Data and hmac are encrypted into a single buffer.
+    """
+    data_length = len(data)
+    hmac = self.create_send_hmac(message_id, data_length)
+    cipher = self.create_send_cipher(message_id)
+    output = memoryview(bytearray(data_length + self.padded_hmac_size_bytes))
+    with memoryview(data) as view, view.cast('B') as source:
+      for chunk in _chunks(data_length, self.send_cipher):
+        hmac.update(source[chunk])
+        cipher.update_into(source[chunk], output[chunk])
+    cipher.update_into(cipher.pad(hmac.finalize()), output[data_length:])
+    return api.Message(
+      message_id=message_id,
+      data=output[:data_length],
+      hmac=output[data_length:]
+    )
+
+  def open(self, message: api.Message) -> bytearray:
+    data = bytearray(len(message.data))
+    self.open_into(message, data)
+    return data
+
+  def open_into(self, message: api.Message, output: api.DataBuffer) -> int:
+    """
+    Decrypts directly into ``output`` and verifies it in a single pass,
+    see ``FUSED_CHUNK_SIZE``. Output is zeroed again if hmac doesn't match.
+    """
+    self._check_block_lengths(message)
+    data_length = len(message.data)
+    cipher = self.create_recv_cipher(message.message_id)
+    hmac = self.create_recv_hmac(message.message_id, data_length)
+    with memoryview(output) as view, view.cast('B') as target, \
+        memoryview(message.data) as source:
+      for chunk in _chunks(data_length, self.recv_cipher):
+        cipher.update_into(source[chunk], target[chunk])
+        hmac.update(target[chunk])
+      try:
+        hmac.verify(self._unpad_hmac(cipher.update(message.hmac)))
+      except exceptions.InvalidSignature:
+        clear_buffer(target[:data_length])
+        raise
+    return data_length
+
+  def seal_many(
+      self,
+      message_ids: typing.Sequence[int],
+      data: typing.Sequence[api.DataBuffer]
+  ) -> typing.List[api.Message]:
+    """Encrypts whole batch at once, see ``CipherContext.update_many``."""
+    pad = self.send_cipher.pad
+    ciphertexts = self.send_cipher.update_many([
+      (message_id, b''.join((message_data, pad(self._sent_message_hmac(message_id, message_data)))))
+      for message_id, message_data in zip(message_ids, data)
+    ], Direction.ENCRYPT)
+    return [
+      api.Message(
+        message_id=message_id,
+        data=ciphertext[:len(message_data)],
+        hmac=ciphertext[len(message_data):]
+      )
+      for message_id, message_data, ciphertext in zip(message_ids, data, ciphertexts)
+    ]
+
+  def open_many(self, messages: typing.Sequence[api.Message]) -> typing.List[api.ReceivedMessage]:
+    """Decrypts whole batch at once, see ``CipherContext.update_many``."""
+    errors = {}
+    for index, message in enumerate(messages):
+      try:
+        self._check_block_lengths(message)
+      except exceptions.InvalidSignature as error:
+        errors[index] = error
+
+    valid = [index for index in range(len(messages)) if index not in errors]
+    plaintexts = dict(zip(valid, self.recv_cipher.update_many([
+      (messages[index].message_id, b''.join((messages[index].data, messages[index].hmac)))
+      for index in valid
+    ], Direction.DECRYPT)))
+
+    return [
+      api.ReceivedMessage(message.message_id, None, errors[index])
+      if index in errors else
+      self._open_decrypted(message, plaintexts[index])
+      for index, message in enumerate(messages)
+    ]
+
+  def _open_decrypted(self, message: api.Message, plaintext: bytes) -> api.ReceivedMessage:
+    data_length = len(message.data)
+    data = plaintext[:data_length]
+    try:
+      self._verify_hmac(message.message_id, data, self._unpad_hmac(plaintext[data_length:]))
+    except exceptions.InvalidSignature as error:
+      return api.ReceivedMessage(message.message_id, None, error)
+    return api.ReceivedMessage(message.message_id, data, None)
+
+
+class EncryptThenMacCryptoContext(HmacCtrCryptoContext):
+  """
+  Protocol version 4: message is encrypted in CTR mode, then hmac of the
+  ciphertext is sent in clear.
+
+  Receiver verifies hmac before decrypting anything, so forged messages
+  cost a single hmac pass.
+  """
+
+  def _check_lengths(self, message: api.Message):
+    block_size = self.recv_cipher.block_size_bytes
+    if len(message.data) % block_size != 0 or len(message.hmac) != self.hmac_size_bytes:
+      raise exceptions.InvalidSignature()
+
+  def _ciphertext_hmac(self, message_id: int, ciphertext: api.DataBuffer) -> bytearray:
+    hmac = self.create_send_hmac(message_id, len(ciphertext))
+    hmac.update(ciphertext)
+    return hmac.finalize()
+
+  def _verify_message(self, message: api.Message):
+    self._check_lengths(message)
+    self._verify_hmac(message.message_id, message.data, message.hmac)
+
+  def seal(self, message_id: int, data: api.DataBuffer) -> api.Message:
+    """Encrypts and signs data in a single pass, see ``FUSED_CHUNK_SIZE``."""
+    data_length = len(data)
+    hmac = self.create_send_hmac(message_id, data_length)
+    cipher = self.create_send_cipher(message_id)
+    ciphertext = bytearray(data_length)
+    with memoryview(ciphertext) as output, memoryview(data) as view, view.cast('B') as source:
+      for chunk in _chunks(data_length, self.send_cipher):
+        cipher.update_into(source[chunk], output[chunk])
+        hmac.update(output[chunk])
+    return api.Message(
+      message_id=message_id,
+      data=ciphertext,
+      hmac=hmac.finalize()
+    )
+
+  def open(self, message: api.Message) -> bytearray:
+    self._verify_message(message)
+    data = bytearray(len(message.data))
+    self.create_recv_cipher(message.message_id).update_into(message.data, data)
+    return data
+
+  def open_into(self, message: api.Message, output: api.DataBuffer) -> int:
+    self._verify_message(message)
+    data_length = len(message.data)
+    with memoryview(output) as view, view[:data_length] as data:
+      self.create_recv_cipher(message.message_id).update_into(message.data, data)
+    return data_length
+
+  def seal_many(
+      self,
+      message_ids: typing.Sequence[int],
+      data: typing.Sequence[api.DataBuffer]
+  ) -> typing.List[api.Message]:
+    ciphertexts = self.send_cipher.update_many(list(zip(message_ids, data)), Direction.ENCRYPT)
+    return [
+      api.Message(
+        message_id=message_id,
+        data=ciphertext,
+        hmac=self._ciphertext_hmac(message_id, ciphertext)
+      )
+      for message_id, ciphertext in zip(message_ids, ciphertexts)
+    ]
+
+  def open_many(self, messages: typing.Sequence[api.Message]) -> typing.List[api.ReceivedMessage]:
+    """Verifies every message, and then decrypts valid ones at once."""
+    result = []
+    valid = []
+    for message in messages:
+      try:
+        self._verify_message(message)
+      except exceptions.InvalidSignature as error:
+        result.append(api.ReceivedMessage(message.message_id, None, error))
+      else:
+        valid.append(len(result))
+        result.append(None)
+
+    plaintexts = self.recv_cipher.update_many([
+      (messages[index].message_id, messages[index].data) for index in valid
+    ], Direction.DECRYPT)
+    for index, plaintext in zip(valid, plaintexts):
+      result[index] = api.ReceivedMessage(messages[index].message_id, plaintext, None)
+    return result
+
+
+class AeadCryptoContext(ChannelCryptoContext):
+  """
+  Protocols version 2 and 3: single pass AEAD.
+
+  Nonce is built from message id, associated data is the message header
+  (the same data protocol version 1 feeds to hmac before the message).
+  ``Message.hmac`` holds the authentication tag.
+  """
+
+  def __init__(
+      self,
+      crypto_configuration: api.ChannelCryptoConfiguration,
+      extended_keys: api.ExtendedKeys
+  ):
+    super().__init__(crypto_configuration)
+    self.send_aead = BACKEND.create_aead(
+      extended_keys.send_encryption_key, crypto_configuration.block_cipher
+    )
+    self.recv_aead = BACKEND.create_aead(
+      extended_keys.recv_encryption_key, crypto_configuration.block_cipher
+    )
+
+  def seal(self, message_id: int, data: api.DataBuffer) -> api.Message:
+    ciphertext, tag = self.send_aead.encrypt(
+      message_id, data, self.message_header(message_id, len(data))
+    )
+    return api.Message(message_id=message_id, data=ciphertext, hmac=tag)
+
+  def open(self, message: api.Message) -> bytes:
+    if len(message.hmac) != self.recv_aead.tag_size_bytes:
+      raise exceptions.InvalidSignature()
+    return self.recv_aead.decrypt(
+      message.message_id,
+      message.data,
+      message.hmac,
+      self.message_header(message.message_id, len(message.data))
+    )
+
+
+CRYPTO_CONTEXTS = {
+  utils.CRYPTO_CONFIGURATION.protocol_version: HmacCtrCryptoContext,
+  utils.AES_GCM_CRYPTO_CONFIGURATION.protocol_version: AeadCryptoContext,
+  utils.CHACHA20_POLY1305_CRYPTO_CONFIGURATION.protocol_version: AeadCryptoContext,
+  utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION.protocol_version: EncryptThenMacCryptoContext,
+}
+"""Crypto context class for each supported protocol version."""
+
+
+def create_crypto_context(
+    crypto_configuration: api.ChannelCryptoConfiguration,
+    extended_keys: api.ExtendedKeys
+) -> ChannelCryptoContext:
+  """Create crypto context implementing protocol version of ``crypto_configuration``."""
+  context_class = CRYPTO_CONTEXTS[crypto_configuration.protocol_version]
+  return context_class(crypto_configuration, extended_keys)
@@ -0,0 +1,306 @@
+"""
+Concurrent sending and receiving: messages are signed, encrypted, verified
+and decrypted in parallel, while keeping the order of message ids.
+"""
+
+# pylint: disable=protected-access
+
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import typing
+
+from secure_channel import api
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+  # pylint: disable=unused-import
+  from .proper import SecureChannel
+
+
+DEFAULT_MAX_PENDING = 64
+"""
+Default number of messages submitted to ``SendPipeline`` but not yet
+written, and of messages read by ``ReceivePipeline`` but not yet delivered.
+"""
+
+
+def _create_executor(name: str) -> concurrent.futures.ThreadPoolExecutor:
+  return concurrent.futures.ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix=name
+  )
+
+
+class _SendTicket(object):
+  """Message ids reserved for one send, and its result."""
+
+  __slots__ = ("message_ids", "messages", "error", "done", "future")
+
+  def __init__(self, message_ids: typing.Sequence[int]):
+    self.message_ids = message_ids
+    self.messages = None
+    self.error = None
+    self.done = False
+    self.future = concurrent.futures.Future()
+
+
+class SendSequencer(object):
+  """
+  Writes sealed messages in the order their message ids were reserved.
+
+  Reserving ids and queuing them is atomic, sealing runs in the calling
+  threads without any lock, and whichever thread completes the oldest
+  pending send writes it, together with all later sends that are ready.
+  So receivers always see strictly increasing ids, while many threads
+  sign and encrypt at the same time.
+  """
+
+  def __init__(self, channel: "SecureChannel"):
+    self.__channel = channel
+    self.__lock = threading.Lock()
+    self.__queue = collections.deque()
+    self.__writing = False
+
+  def reserve(self, count: int) -> _SendTicket:
+    """Reserve ``count`` consecutive message ids and queue them for writing."""
+    session_state = self.__channel._session_state
+    with self.__lock:
+      if count == 1:
+        message_id = session_state.get_send_message_number()
+        ticket = _SendTicket(range(message_id, message_id + 1))
+      else:
+        ticket = _SendTicket(session_state.get_send_message_numbers(count))
+      self.__queue.append(ticket)
+    return ticket
+
+  def seal(self, ticket: _SendTicket, data: typing.Sequence[api.DataBuffer]):
+    """Sign and encrypt ``data`` using ids of ``ticket``, and queue them for writing."""
+    context = self.__channel._crypto_context
+    try:
+      if len(data) == 1:
+        messages = [context.seal(ticket.message_ids[0], data[0])]
+      else:
+        messages = context.seal_many(ticket.message_ids, data)
+    except BaseException as error:  # pylint: disable=broad-except
+      self.complete(ticket, error=error)
+    else:
+      self.complete(ticket, messages=messages)
+
+  def send(self, data: typing.Sequence[api.DataBuffer]):
+    """Seal ``data`` in the calling thread, and wait until it is written."""
+    ticket = self.reserve(len(data))
+    self.seal(ticket, data)
+    ticket.future.result()
+
+  def complete(
+      self,
+      ticket: _SendTicket,
+      messages: typing.Optional[typing.List[api.Message]] = None,
+      error: typing.Optional[BaseException] = None
+  ):
+    """Mark ticket as sealed (or failed), and write everything that is ready."""
+    with self.__lock:
+      ticket.messages = messages
+      ticket.error = error
+      ticket.done = True
+      if self.__writing:
+        # Thread that is writing now will write this ticket too.
+        return
+      self.__writing = True
+    self.__write_ready()
+
+  def __write_ready(self):
+    while True:
+      with self.__lock:
+        ready = []
+        while self.__queue and self.__queue[0].done:
+          ready.append(self.__queue.popleft())
+        if not ready:
+          self.__writing = False
+          return
+      messages = [
+        message for ticket in ready if ticket.error is None for message in ticket.messages
+      ]
+      write_error = None
+      try:
+        if messages:
+          self.__channel._data_source.write_many(messages)
+      except BaseException as error:  # pylint: disable=broad-except
+        write_error = error
+      for ticket in ready:
+        error = ticket.error if ticket.error is not None else write_error
+        if error is None:
+          ticket.future.set_result(None)
+        else:
+          ticket.future.set_exception(error)
+
+
+class SendPipeline(object):
+  """
+  Asynchronous sending, messages are signed and encrypted on ``executor``.
+
+  Message id is assigned when message is submitted, so messages are
+  written in submission order. At most ``max_pending`` messages can be
+  submitted and not yet written, ``submit`` blocks after that.
+
+  If no executor is given pipeline creates one, with a thread per CPU, and
+  shuts it down on ``close``. Executor given by the caller belongs to the
+  caller, and is left running. Pipeline is a context manager closing it on exit.
+  """
+
+  def __init__(
+      self,
+      channel: "SecureChannel",
+      executor: typing.Optional[concurrent.futures.Executor] = None,
+      max_pending: int = DEFAULT_MAX_PENDING
+  ):
+    assert max_pending > 0
+    self.__sequencer = channel._send_utils.sequencer
+    self.__own_executor = executor is None
+    if executor is None:
+      executor = _create_executor("secure-channel-send")
+    self.__executor = executor
+    self.__pending = threading.BoundedSemaphore(max_pending)
+    self.__lock = threading.Lock()
+    self.__in_flight = set()
+    self.__closed = False
+
+  def submit(self, data: api.DataBuffer) -> concurrent.futures.Future:
+    """
+    Submit message for sending, returned future is done when message
+    was written. Raises ``ValueError`` if pipeline is closed.
+    """
+    self.__pending.acquire()  # pylint: disable=consider-using-with
+    try:
+      with self.__lock:
+        if self.__closed:
+          raise ValueError("send pipeline is closed")
+        ticket = self.__sequencer.reserve(1)
+        self.__in_flight.add(ticket.future)
+    except BaseException:
+      self.__pending.release()
+      raise
+    ticket.future.add_done_callback(self.__done)
+    try:
+      self.__executor.submit(self.__sequencer.seal, ticket, [data])
+    except BaseException as error:
+      # Ticket is already queued, complete it so later sends aren't blocked.
+      self.__sequencer.complete(ticket, error=error)
+      raise
+    return ticket.future
+
+  def __done(self, future: concurrent.futures.Future):
+    with self.__lock:
+      self.__in_flight.discard(future)
+    self.__pending.release()
+
+  def send_message(self, data: api.DataBuffer):
+    """Submit message and wait until it is written."""
+    self.submit(data).result()
+
+  def close(self):
+    """
+    Stop accepting messages, wait until all submitted messages are written
+    (or failed), and shut down executor created by pipeline.
+    """
+    with self.__lock:
+      self.__closed = True
+      in_flight = list(self.__in_flight)
+    concurrent.futures.wait(in_flight)
+    if self.__own_executor:
+      self.__executor.shutdown(wait=True)
+
+  def __enter__(self) -> "SendPipeline":
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class ReceivePipeline(object):
+  """
+  Pipelined receiving: a reader thread reads messages from the data source,
+  messages are verified and decrypted on ``executor``, and
+  ``receive_message`` returns them in the order they were read.
+
+  Session state is updated in ``receive_message``, only after message
+  was verified, so replayed or forged messages are rejected the same as
+  by ``SecureChannel.receive_message``. At most ``max_pending`` messages
+  are read ahead, reader waits after that.
+
+  Error raised by data source stops the reader, and is raised by
+  ``receive_message`` after all messages read before it were received.
+  ``close`` stops the pipeline, reader blocked in ``read`` stops only when
+  data source is closed or read fails.
+  """
+
+  __STOP = object()
+
+  def __init__(
+      self,
+      channel: "SecureChannel",
+      executor: typing.Optional[concurrent.futures.Executor] = None,
+      max_pending: int = DEFAULT_MAX_PENDING
+  ):
+    assert max_pending > 0
+    self.__channel = channel
+    self.__own_executor = executor is None
+    if executor is None:
+      executor = _create_executor("secure-channel-recv")
+    self.__executor = executor
+    self.__queue = queue.Queue(max_pending)
+    self.__error = None
+    self.__closed = False
+    self.__reader = threading.Thread(
+      target=self.__read_messages, name="secure-channel-reader", daemon=True
+    )
+    self.__reader.start()
+
+  def __read_messages(self):
+    recv_utils = self.__channel._recv_utils
+    context = self.__channel._crypto_context
+    data_source = self.__channel._data_source
+    try:
+      while not self.__closed:
+        message = data_source.read()
+        if not recv_utils.accept(message):
+          continue
+        # Data sources may return views, that are valid only until next read.
+        message = message._replace(data=bytes(message.data), hmac=bytes(message.hmac))
+        self.__queue.put((message, self.__executor.submit(context.open, message)))
+    except BaseException as error:  # pylint: disable=broad-except
+      self.__queue.put((self.__STOP, error))
+
+  def receive_message(self) -> bytearray:
+    """Returns next verified message."""
+    if self.__error is not None:
+      raise self.__error
+    message, result = self.__queue.get()
+    if message is self.__STOP:
+      self.__error = result
+      raise result
+    data = result.result()
+    # Note: this needs to be called after we verified the hmac
+    self.__channel._recv_utils._verify_message_id(message)
+    return data
+
+  def close(self):
+    """Stop reading, and shut down executor created by pipeline."""
+    self.__closed = True
+    if self.__error is None:
+      self.__error = ValueError("receive pipeline is closed")
+    # Unblock reader waiting for space in the queue.
+    while True:
+      try:
+        self.__queue.get_nowait()
+      except queue.Empty:
+        break
+    if self.__own_executor:
+      self.__executor.shutdown(wait=True)
+
+  def __enter__(self) -> "ReceivePipeline":
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -0,0 +1,53 @@
+"""Cheap filtering of received messages, done before any crypto."""
+
+import enum
+import typing
+
+from secure_channel import api, exceptions
+
+
+class DropReason(enum.Enum):
+  """Why a received message was dropped."""
+
+  TOO_LARGE = 1
+  """Message is larger than ``max_message_size_bytes``."""
+
+  REPLAYED = 2
+  """Message id is not greater than id of the last verified message."""
+
+  BEYOND_SESSION = 3
+  """Message id is past ``max_messages_in_session``."""
+
+
+class RecvMessagePrecheck(object):
+  """
+  Drops received messages that can't be valid, before they are verified.
+
+  This never updates session state, so an attacker can't influence it,
+  and valid messages still go through the full check after verification.
+  """
+
+  def __init__(self, session_state: api.SessionState, configuration: api.ChannelConfiguration):
+    self.session_state = session_state
+    self.configuration = configuration
+    self.drop_counts = {reason: 0 for reason in DropReason}
+
+  def drop_reason(self, message: api.Message) -> typing.Optional[DropReason]:
+    """Return why message needs to be dropped, or None if it should be verified."""
+    if len(message.data) > self.configuration.max_message_size_bytes:
+      return DropReason.TOO_LARGE
+    try:
+      self.session_state.precheck_recv_message_number(message.message_id)
+    except exceptions.RecvMessageOutOfSequence:
+      return DropReason.REPLAYED
+    except exceptions.NeedToRenegotiateKey:
+      return DropReason.BEYOND_SESSION
+    return None
+
+  def accept(self, message: api.Message) -> bool:
+    """Return whether message should be verified, counts dropped messages."""
+    reason = self.drop_reason(message)
+    if reason is None:
+      return True
+    self.drop_counts[reason] += 1
+    return False
@@ -1,13 +1,16 @@
 """Implements a secure channel."""
 
-from secure_channel import api
+import concurrent.futures
+import typing
 
-from . import utils
+from secure_channel import api, buffer_pool
 
+from . import crypto_context, pipeline, precheck, streaming, utils
 
-class SecureChannel(object):
 
-  """Implementation of secure channel."""
+class BaseSecureChannel(object):
+
+  """State shared by blocking and asyncio secure channels."""
 
   @property
   def block_size_bytes(self):
@@ -17,12 +20,22 @@ class SecureChannel(object):
 
   def __init__(
       self,
-      data_source: api.DataSource,
+      data_source: typing.Union[api.DataSource, api.AsyncDataSource],
       key_generator: api.SessionKeyNegotiator,
       *,
       crypto_configration: api.ChannelCryptoConfiguration = utils.CRYPTO_CONFIGURATION,
-      configuration: api.ChannelConfiguration = api.DEFAULT_CONFIGURATION
+      configuration: api.ChannelConfiguration = api.DEFAULT_CONFIGURATION,
+      recv_precheck: bool = False,
+      pool: typing.Optional[buffer_pool.BufferPool] = None
   ):
+    """
+    :param recv_precheck: If true received messages that can't be valid
+                          (too large, replayed or past end of session) are
+                          dropped before any crypto is done, see
+                          ``dropped_messages``.
+    :param pool: Pool of buffers for received messages, by default
+                 every channel has its own.
+    """
     self._data_source = data_source
     self._configuration = configuration
     self._crypto_config = crypto_configration
@@ -33,16 +46,150 @@ class SecureChannel(object):
       configuration
     )
 
+    self._recv_precheck = None
+    if recv_precheck:
+      self._recv_precheck = precheck.RecvMessagePrecheck(self._session_state, configuration)
+
+    self.__crypto_context = None
+    self.buffer_pool = pool if pool is not None else buffer_pool.BufferPool()
+    self._send_utils = utils.SendMessageUtils(self)
+    self._recv_utils = utils.RecvMessageUtils(self)
+
+  @property
+  def _crypto_context(self) -> crypto_context.ChannelCryptoContext:
+    """
+    Crypto state prepared from session keys, created on first use
+    and then reused for every message.
+    """
+    if self.__crypto_context is None:
+      self.__crypto_context = self._session_state.create_crypto_context(
+        self._crypto_config,
+        crypto_context.create_crypto_context
+      )
+    return self.__crypto_context
+
+  def destroy_session(self):
+    """
+    Reset session state, destroying its keys, and drop crypto state
+    derived from them, channel can't be used after that.
+    """
+    self._session_state.reset()
+    self.__crypto_context = None
+
+  @property
+  def dropped_messages(self) -> typing.Dict[precheck.DropReason, int]:
+    """Number of received messages dropped by pre-check, by reason."""
+    if self._recv_precheck is None:
+      return {reason: 0 for reason in precheck.DropReason}
+    return dict(self._recv_precheck.drop_counts)
+
+
+class SecureChannel(BaseSecureChannel):
+
+  """Implementation of secure channel."""
+
   def send_message(self, data: api.DataBuffer):
     """Sends the message."""
-    send_utils = utils.SendMessageUtils(self)
-    send_utils.send_message(data)
+    self._send_utils.send_message(data)
 
   def receive_message(self) -> bytearray:
     """Reads the message."""
-    recv_message = utils.RecvMessageUtils(self)
-    return recv_message.recv_message().data
+    return self._recv_utils.recv_message().data
+
+  def receive_message_into(self, buffer: api.DataBuffer) -> int:
+    """
+    Reads the message into ``buffer``, and returns its size.
+
+    Buffer needs to be large enough for the message, otherwise message is
+    discarded and ``ValueError`` is raised. Nothing but verified plaintext
+    is left in the buffer.
+    """
+    return self._recv_utils.recv_message_into(buffer)
 
+  def receive_message_lease(self) -> buffer_pool.BufferLease:
+    """
+    Reads the message into buffer leased from ``buffer_pool``.
 
+    Release the lease (or use it as a context manager) when done with
+    the message, its data is then zeroed and buffer is reused.
+    """
+    return self._recv_utils.recv_message_lease(self.buffer_pool)
 
+  def open_send_pipeline(
+      self,
+      executor: typing.Optional[concurrent.futures.Executor] = None,
+      max_pending: int = pipeline.DEFAULT_MAX_PENDING
+  ) -> pipeline.SendPipeline:
+    """
+    Returns pipeline that signs and encrypts messages on ``executor``,
+    and writes them in the order they were submitted.
+
+    ``send_message`` is safe to call from many threads too, but it does
+    the crypto in the calling thread.
+    """
+    return pipeline.SendPipeline(self, executor, max_pending)
+
+  def open_receive_pipeline(
+      self,
+      executor: typing.Optional[concurrent.futures.Executor] = None,
+      max_pending: int = pipeline.DEFAULT_MAX_PENDING
+  ) -> pipeline.ReceivePipeline:
+    """
+    Returns pipeline that reads messages in a background thread, and
+    verifies and decrypts them on ``executor``, so reading overlaps
+    with crypto.
+
+    Pipeline owns reading from the data source, don't receive messages
+    from the channel while it's open.
+    """
+    return pipeline.ReceivePipeline(self, executor, max_pending)
+
+  def send_messages(self, data: typing.Iterable[api.DataBuffer]):
+    """
+    Sends many messages at once.
+
+    Message ids for whole batch are reserved at once, and batch is passed
+    to ``DataSource.write_many``.
+    """
+    self._send_utils.send_messages(data)
+
+  def receive_messages(self, max_messages: int) -> typing.List[api.ReceivedMessage]:
+    """
+    Reads at least one and up to ``max_messages`` messages.
+
+    Each message is verified separately, invalid messages are returned
+    with ``error`` set and ``data`` set to ``None``. Messages dropped by
+    pre-check are not returned, so result might be empty.
+    """
+    return self._recv_utils.recv_messages(max_messages)
+
+  def open_send_stream(
+      self,
+      chunk_size: int = streaming.DEFAULT_CHUNK_SIZE
+  ) -> streaming.SendStream:
+    """
+    Returns file-like object that sends everything written to it as a
+    stream of records, each carrying up to ``chunk_size`` bytes.
+
+    Stream has no size limit, finish (or close) it to end the stream.
+    """
+    return streaming.SendStream(self, chunk_size)
+
+  def open_receive_stream(self) -> streaming.ReceiveStream:
+    """Returns file-like object reading stream sent by ``open_send_stream``."""
+    return streaming.ReceiveStream(self)
+
+  def receive_staged_stream(
+      self,
+      spill_threshold: int = streaming.DEFAULT_SPILL_THRESHOLD,
+      directory: typing.Optional[str] = None
+  ) -> streaming.StagedStream:
+    """
+    Receives whole stream sent by ``open_send_stream``, and returns it only
+    after all of it was verified, so no unverified data is ever released.
 
+    Streams larger than ``spill_threshold`` bytes are staged in a temporary
+    file in ``directory``, and returned as read only memory map, so size
+    of the stream is limited by disk space, not memory.
+    """
+    return streaming.receive_staged(self, spill_threshold, directory)
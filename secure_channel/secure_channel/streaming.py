@@ -0,0 +1,393 @@
+"""
+Streams larger than ``max_message_size_bytes``, sent as a sequence of records.
+
+Each record is an ordinary channel message, so it is signed, encrypted and
+replay protected on its own. Plaintext of every record starts with a header::
+
+  +------+---------+-----------+-------+--------+
+  | type | padding | stream_id | index | length |
+  | 1 B  | 7 B     | uint64    | uint64| uint64 |
+  +------+---------+-----------+-------+--------+
+
+``stream_id`` is message id of the first record, ``index`` counts records
+from zero. For ``CHUNK`` records ``length`` is number of payload bytes that
+follow the header (payload is zero padded to block size), the stream ends
+with a single ``END`` record, whose ``length`` is the total number of bytes
+in the stream. So receiver detects records that were dropped, reordered,
+taken from another stream, and streams that were truncated.
+"""
+
+# pylint: disable=protected-access
+
+import io
+import mmap
+import os
+import struct
+import tempfile
+import typing
+
+from secure_channel import exceptions
+from secure_channel.utils import clear_buffer
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+  # pylint: disable=unused-import
+  from .proper import SecureChannel
+
+
+RECORD_HEADER = struct.Struct(">B7xQQQ")
+"""Record header: type, stream id, record index and length."""
+
+RECORD_CHUNK = 0
+RECORD_END = 1
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+"""Default number of stream bytes sent in a single record."""
+
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+"""Staged streams larger than this are moved from memory to a temporary file."""
+
+
+def _round_up(size: int, block_size: int) -> int:
+  return -(-size // block_size) * block_size
+
+
+class SendStream(io.RawIOBase):
+  """
+  Write only file-like object sending written data as stream records.
+
+  Data is buffered until there is ``chunk_size`` bytes, so memory use
+  doesn't depend on stream size. ``finish`` sends the last chunk and the
+  end of stream record, stream is not complete until it is finished.
+
+  Stream that fails or is abandoned must not look complete to the receiver,
+  so end of stream record is never sent when a write fails, when ``with``
+  block exits with an exception, or when stream is garbage collected, the
+  stream is aborted instead. ``close`` always finishes the stream, call
+  ``abort`` to end it without the end of stream record.
+
+  No other messages should be sent over the channel until the stream is closed.
+  """
+
+  def __init__(self, channel: "SecureChannel", chunk_size: int = DEFAULT_CHUNK_SIZE):
+    super().__init__()
+    assert chunk_size > 0
+    assert chunk_size % channel.block_size_bytes == 0
+    assert RECORD_HEADER.size + chunk_size <= channel._configuration.max_message_size_bytes
+    self.__channel = channel
+    self.__chunk_size = chunk_size
+    # Records are assembled in place, header first and then written data.
+    self.__record = bytearray(RECORD_HEADER.size + chunk_size)
+    self.__filled = 0
+    self.__stream_id = None
+    self.__index = 0
+    self.__total = 0
+
+  @property
+  def chunk_size(self) -> int:
+    """Maximal number of stream bytes in a single record."""
+    return self.__chunk_size
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:  # pylint: disable=arguments-differ
+    if self.closed:
+      raise ValueError("write to closed stream")
+    try:
+      return self.__write(data)
+    except BaseException:
+      # Some of the data might be lost, so the stream can't be finished.
+      self.abort()
+      raise
+
+  def __write(self, data) -> int:
+    with memoryview(data) as view, view.cast('B') as source:
+      position = 0
+      while position < len(source):
+        size = min(len(source) - position, self.__chunk_size - self.__filled)
+        start = RECORD_HEADER.size + self.__filled
+        self.__record[start:start + size] = source[position:position + size]
+        self.__filled += size
+        position += size
+        if self.__filled == self.__chunk_size:
+          self.__send_chunk()
+      self.__total += len(source)
+      return len(source)
+
+  def __send_record(self, record_type: int, length: int, record: memoryview):
+    sequencer = self.__channel._send_utils.sequencer
+    ticket = sequencer.reserve(1)
+    try:
+      if self.__stream_id is None:
+        self.__stream_id = ticket.message_ids[0]
+      RECORD_HEADER.pack_into(record, 0, record_type, self.__stream_id, self.__index, length)
+    except BaseException as error:
+      # Ticket is already queued, complete it so later sends aren't blocked.
+      sequencer.complete(ticket, error=error)
+      raise
+    sequencer.seal(ticket, [record])
+    ticket.future.result()
+    self.__index += 1
+
+  def __send_chunk(self):
+    record_size = RECORD_HEADER.size + _round_up(self.__filled, self.__channel.block_size_bytes)
+    # Zero the padding, buffer still contains data of the previous chunk.
+    self.__record[RECORD_HEADER.size + self.__filled:record_size] = bytes(
+      record_size - RECORD_HEADER.size - self.__filled
+    )
+    with memoryview(self.__record) as view, view[:record_size] as record:
+      self.__send_record(RECORD_CHUNK, self.__filled, record)
+    self.__filled = 0
+
+  def finish(self):
+    """Send buffered data and end of stream record, and close the stream."""
+    if self.closed:
+      return
+    try:
+      if self.__filled:
+        self.__send_chunk()
+      with memoryview(self.__record) as view, view[:RECORD_HEADER.size] as record:
+        self.__send_record(RECORD_END, self.__total, record)
+    except BaseException:
+      self.abort()
+      raise
+    super().close()
+
+  def abort(self):
+    """
+    Close the stream without sending buffered data and end of stream
+    record, so receiver never reports the stream as complete.
+    """
+    clear_buffer(self.__record)
+    self.__filled = 0
+    super().close()
+
+  def close(self):
+    """Finish the stream, same as ``finish``."""
+    self.finish()
+
+  def __exit__(self, exc_type, *args):
+    if exc_type is None:
+      self.finish()
+    else:
+      self.abort()
+
+  def __del__(self):
+    # Never send anything from the garbage collector, just mark stream closed.
+    if not self.closed:
+      super().close()
+
+
+class ReceiveStream(io.RawIOBase):
+  """
+  Read only file-like object returning data of a stream sent by ``SendStream``.
+
+  Every record is verified before any of its data is returned, but data is
+  returned before the whole stream is received. Reads raise ``MalformedStream``
+  if records are missing, reordered or belong to another stream, end of file
+  is reported only after the end of stream record was verified.
+  """
+
+  def __init__(self, channel: "SecureChannel"):
+    super().__init__()
+    self.__channel = channel
+    self.__stream_id = None
+    self.__index = 0
+    self.__total = 0
+    self.__chunk = memoryview(b'')
+    self.__finished = False
+
+  @property
+  def finished(self) -> bool:
+    """True after end of stream record was received."""
+    return self.__finished
+
+  def readable(self) -> bool:
+    return True
+
+  def __receive_record(self):
+    message = self.__channel._recv_utils.recv_message()
+    data = memoryview(message.data)
+    if len(data) < RECORD_HEADER.size:
+      raise exceptions.MalformedStream()
+    record_type, stream_id, index, length = RECORD_HEADER.unpack_from(data)
+    if self.__stream_id is None:
+      if stream_id != message.message_id:
+        raise exceptions.MalformedStream()
+      self.__stream_id = stream_id
+    if stream_id != self.__stream_id or index != self.__index:
+      raise exceptions.MalformedStream()
+    self.__index += 1
+    if record_type == RECORD_CHUNK:
+      if length > len(data) - RECORD_HEADER.size:
+        raise exceptions.MalformedStream()
+      self.__total += length
+      self.__chunk = data[RECORD_HEADER.size:RECORD_HEADER.size + length]
+    elif record_type == RECORD_END and length == self.__total:
+      self.__finished = True
+    else:
+      raise exceptions.MalformedStream()
+
+  def read_chunk(self) -> memoryview:
+    """
+    Return not yet read data of the current record, or of the next one.
+
+    Returned view is valid until next read, it is empty at end of stream.
+    """
+    while not self.__chunk and not self.__finished:
+      self.__receive_record()
+    chunk = self.__chunk
+    self.__chunk = memoryview(b'')
+    return chunk
+
+  def readinto(self, buffer) -> int:  # pylint: disable=arguments-differ
+    while not self.__chunk and not self.__finished:
+      self.__receive_record()
+    size = min(len(buffer), len(self.__chunk))
+    with memoryview(buffer) as view, view.cast('B') as target:
+      target[:size] = self.__chunk[:size]
+    self.__chunk = self.__chunk[size:]
+    return size
+
+
+class StagedStream(io.RawIOBase):
+  """
+  Read only, seekable file-like object with data of a verified stream.
+
+  Data is either kept in memory or in a memory mapped temporary file,
+  ``view`` returns it without copying. Release all views before closing.
+  """
+
+  def __init__(self, data: typing.Union[bytearray, mmap.mmap], file=None):
+    super().__init__()
+    self.__data = data
+    self.__file = file
+    self.__view = memoryview(data).toreadonly()
+    self.__position = 0
+
+  @property
+  def size(self) -> int:
+    """Number of bytes in the stream."""
+    return len(self.__view)
+
+  @property
+  def in_memory(self) -> bool:
+    """False if data was spilled to a temporary file."""
+    return self.__file is None
+
+  def view(self) -> memoryview:
+    """
+    Read only view of the whole stream, every call returns a new view,
+    so releasing it doesn't affect the stream.
+    """
+    return self.__view[:]
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def readinto(self, buffer) -> int:  # pylint: disable=arguments-differ
+    size = max(0, min(len(buffer), self.size - self.__position))
+    with memoryview(buffer) as view, view.cast('B') as target:
+      target[:size] = self.__view[self.__position:self.__position + size]
+    self.__position += size
+    return size
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_SET:
+      position = offset
+    elif whence == io.SEEK_CUR:
+      position = self.__position + offset
+    elif whence == io.SEEK_END:
+      position = self.size + offset
+    else:
+      raise ValueError("invalid whence")
+    if position < 0:
+      raise ValueError("negative seek position")
+    self.__position = position
+    return position
+
+  def close(self):
+    if self.closed:
+      return
+    self.__view.release()
+    if self.__file is not None:
+      self.__data.close()
+      self.__file.close()
+    super().close()
+
+
+class _Staging(object):
+  """
+  Verified stream data, kept in memory until it grows over
+  ``spill_threshold`` bytes and in a temporary file after that.
+  """
+
+  def __init__(self, spill_threshold: int, directory: typing.Optional[str]):
+    self.spill_threshold = spill_threshold
+    self.directory = directory
+    self.buffer = bytearray()
+    self.file = None
+    self.size = 0
+
+  def write(self, data: memoryview):
+    if self.file is None and self.size + len(data) > self.spill_threshold:
+      self.file = tempfile.TemporaryFile(dir=self.directory)
+      self.file.write(self.buffer)
+      clear_buffer(self.buffer)
+      self.buffer = None
+    if self.file is None:
+      self.buffer += data
+    else:
+      self.file.write(data)
+    self.size += len(data)
+
+  def release(self) -> StagedStream:
+    """Return staged data, must be called only after whole stream was verified."""
+    if self.file is None:
+      return StagedStream(self.buffer)
+    self.file.flush()
+    return StagedStream(
+      mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ), self.file
+    )
+
+  def discard(self):
+    """Overwrite staged data with zeros and remove it."""
+    if self.file is None:
+      clear_buffer(self.buffer)
+      return
+    zeros = bytes(DEFAULT_CHUNK_SIZE)
+    self.file.seek(0)
+    for position in range(0, self.size, len(zeros)):
+      self.file.write(zeros[:self.size - position])
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    self.file.truncate(0)
+    self.file.close()
+
+
+def receive_staged(
+    channel: "SecureChannel",
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    directory: typing.Optional[str] = None
+) -> StagedStream:
+  """
+  Receive whole stream, returning its data only after every record and
+  the end of stream record were verified.
+
+  If anything fails, data received so far is overwritten and removed
+  before the exception propagates.
+  """
+  stream = ReceiveStream(channel)
+  staging = _Staging(spill_threshold, directory)
+  try:
+    chunk = stream.read_chunk()
+    while chunk:
+      staging.write(chunk)
+      chunk = stream.read_chunk()
+  except BaseException:
+    staging.discard()
+    raise
+  return staging.release()
@@ -9,15 +9,18 @@ and receive_message.
 
 # pylint: disable=protected-access
 
-import pickle
 import typing
 
-from secure_channel import api
-from secure_channel.primitives import BACKEND, HMAC, Direction
-from secure_channel.primitives.utils import format_counter
+from secure_channel import api, exceptions
+from secure_channel.buffer_pool import BufferLease, BufferPool
+from secure_channel.utils import clear_buffer
+
+from .pipeline import SendSequencer
 
 if typing.TYPE_CHECKING:  # pragma: no cover
-  from .proper import SecureChannel  # pylint: disable=unused-import
+  # pylint: disable=unused-import
+  from .proper import SecureChannel
+  from .crypto_context import ChannelCryptoContext
 
 
 CRYPTO_CONFIGURATION = api.ChannelCryptoConfiguration(
@@ -27,6 +30,29 @@ CRYPTO_CONFIGURATION = api.ChannelCryptoConfiguration(
   hash_algo="SHA-256"
 )
 
+AES_GCM_CRYPTO_CONFIGURATION = api.ChannelCryptoConfiguration(
+  protocol_version=2,
+  session_key_length_bytes=16,
+  block_cipher="AES-256-GCM",
+  # Authenticator built into the AEAD
+  hash_algo="GHASH"
+)
+
+CHACHA20_POLY1305_CRYPTO_CONFIGURATION = api.ChannelCryptoConfiguration(
+  protocol_version=3,
+  session_key_length_bytes=16,
+  block_cipher="ChaCha20-Poly1305",
+  # Authenticator built into the AEAD
+  hash_algo="Poly1305"
+)
+
+ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION = api.ChannelCryptoConfiguration(
+  protocol_version=4,
+  session_key_length_bytes=16,
+  block_cipher="AES",
+  hash_algo="SHA-256"
+)
+
 
 class CryptoDetailsSerializedForm(object):
   """
@@ -36,7 +62,10 @@ class CryptoDetailsSerializedForm(object):
 
   def __init__(self, crypto_configuration: api.ChannelCryptoConfiguration):
     self.field_names = crypto_configuration._fields
-    self.field_types = crypto_configuration._field_types
+    # ``_field_types`` was removed from named tuples in python 3.9.
+    self.field_types = getattr(
+      crypto_configuration, "_field_types", crypto_configuration.__annotations__
+    )
     self.data = tuple(crypto_configuration)
 
 
@@ -48,96 +77,142 @@ class SecureChannelUtils(object):
   def __init__(self, channel: "SecureChannel"):
     self.channel = channel
 
-  def _update_hmac_with_crypto_details(self, hmac: HMAC):
-    serialized_details = pickle.dumps(
-      CryptoDetailsSerializedForm(self.channel._crypto_config)
-    )
-    hmac.update(format_counter(len(serialized_details)))
-    hmac.update(serialized_details)
-
-  def _get_data_hmac(self, message_id, data, key) -> HMAC:
-    hmac = BACKEND.create_hmac(key, self.channel._crypto_config.hash_algo)
-    hmac.update(format_counter(message_id))
-    self._update_hmac_with_crypto_details(hmac)
-    hmac.update(format_counter(len(data)))
-    hmac.update(data)
-    return hmac
-
   @property
-  def _extended_keys(self):
-    return self.channel._session_state.get_extended_keys()
+  def _crypto_context(self) -> "ChannelCryptoContext":
+    return self.channel._crypto_context
 
 
 class SendMessageUtils(SecureChannelUtils):
   """
   Helper to send the message.
+
+  Blocking sends go through ``sequencer``, so they can be called from
+  many threads at once.
   """
 
+  def __init__(self, channel: "SecureChannel"):
+    super().__init__(channel)
+    self.sequencer = SendSequencer(channel)
+
   def send_message(self, data: api.DataBuffer):
     """Sends the message synchronously."""
+    self.sequencer.send([data])
+
+  def create_message(self, data: api.DataBuffer) -> api.Message:
+    """Assigns message id, signs and encrypts the data, doesn't do any I/O."""
     message_id = self.channel._session_state.get_send_message_number()
-    hmac = self._get_sent_message_hmac(message_id, data)
-    message = self._encrypt_message(message_id, data, hmac)
-    self.channel._data_source.write(message)
-
-  def _get_sent_message_hmac(
-      self,
-      message_id: int,
-      data: api.DataBuffer
-  ) -> bytearray:
-    key = self._extended_keys.send_sign_key
-    hmac = self._get_data_hmac(message_id, data, key)
-    return hmac.finalize()
-
-  def _encrypt_message(self, message_id, data, hmac):
-    cipher = BACKEND.create_cipher_mode(
-      key=self._extended_keys.send_encryption_key,
-      ctr=message_id,
-      cipher=self.channel._crypto_config.block_cipher,
-      direction=Direction.ENCRYPT
-    )
+    return self._crypto_context.seal(message_id, data)
 
-    return api.Message(
-      message_id=message_id,
-      data=cipher.update(data),
-      hmac=cipher.update(cipher.pad(hmac))
-    )
+  def send_messages(self, data: typing.Iterable[api.DataBuffer]):
+    """Sends many messages synchronously, using one write."""
+    self.sequencer.send(list(data))
+
+  def create_messages(self, data: typing.Iterable[api.DataBuffer]) -> typing.List[api.Message]:
+    """
+    Reserves consecutive message ids for all messages at once,
+    and then signs and encrypts them.
+    """
+    data = list(data)
+    message_ids = self.channel._session_state.get_send_message_numbers(len(data))
+    return self._crypto_context.seal_many(message_ids, data)
 
 
 class RecvMessageUtils(SecureChannelUtils):
 
   """Helper to receive the message."""
 
+  def accept(self, message: api.Message) -> bool:
+    """
+    Returns False if channel pre-check drops the message, in which case
+    message should be ignored.
+    """
+    precheck = self.channel._recv_precheck
+    return precheck is None or precheck.accept(message)
+
   def recv_message(self) -> api.Message:
-    """Receives the message synchronously, verifies and decrypts the message."""
-    message = self.channel._data_source.read()
-    return self._decrypt_and_verify_message(message)
+    """
+    Receives the message synchronously, verifies and decrypts the message.
 
-  def _verify_message_id(self, message: api.Message):
-    self.channel._session_state.verify_recv_message_number(message.message_id)
+    Messages dropped by pre-check are skipped.
+    """
+    return self.decrypt_and_verify_message(self._read_accepted())
 
-  def _decrypt_message(self, message: api.Message):
-    cipher = BACKEND.create_cipher_mode(
-      key=self._extended_keys.recv_encryption_key,
-      ctr=message.message_id,
-      cipher=self.channel._crypto_config.block_cipher,
-      direction=Direction.DECRYPT
-    )
+  def _read_accepted(self) -> api.Message:
+    """Reads first message that is not dropped by pre-check."""
+    message = self.channel._data_source.read()
+    while not self.accept(message):
+      message = self.channel._data_source.read()
+    return message
 
-    return message._replace(
-      data=cipher.update(message.data),
-      hmac=cipher.unpad(cipher.update(message.hmac))
-    )
+  def recv_messages(self, max_messages: int) -> typing.List[api.ReceivedMessage]:
+    """
+    Receives up to ``max_messages`` messages with a single read, and
+    verifies and decrypts each of them.
+
+    Invalid messages don't stop processing of the rest of the batch, they
+    are returned with ``error`` set. Messages dropped by pre-check are
+    not returned at all.
+    """
+    messages = [
+      message for message in self.channel._data_source.read_many(max_messages)
+      if self.accept(message)
+    ]
+    return [
+      self._verify_batch_message_id(received)
+      for received in self._crypto_context.open_many(messages)
+    ]
+
+  def recv_message_into(self, buffer: api.DataBuffer) -> int:
+    """
+    Receives the message, verifies and decrypts it into ``buffer``.
+
+    Returns size of the message. Buffer is zeroed if message is invalid.
+    """
+    message = self._read_accepted()
+    if len(message.data) > len(buffer):
+      raise ValueError("buffer is smaller than received message")
+    size = self._crypto_context.open_into(message, buffer)
+    try:
+      self._verify_message_id(message)
+    except BaseException:
+      clear_buffer(memoryview(buffer)[:size])
+      raise
+    return size
+
+  def recv_message_lease(self, pool: BufferPool) -> BufferLease:
+    """
+    Receives the message, verifies and decrypts it into buffer leased
+    from ``pool``.
+    """
+    message = self._read_accepted()
+    lease = pool.lease(len(message.data))
+    try:
+      self._crypto_context.open_into(message, lease.view)
+      self._verify_message_id(message)
+    except BaseException:
+      lease.release()
+      raise
+    return lease
+
+  def _verify_batch_message_id(self, received: api.ReceivedMessage) -> api.ReceivedMessage:
+    if received.error is not None:
+      return received
+    try:
+      self._verify_message_id(received)
+    except (exceptions.BaseCryptoException, exceptions.FatalException) as error:
+      return received._replace(data=None, error=error)
+    return received
+
+  def _verify_message_id(self, message: typing.Union[api.Message, api.ReceivedMessage]):
+    self.channel._session_state.verify_recv_message_number(message.message_id)
 
-  def _verify_message_hmac(self, message: api.Message):
-    key = self._extended_keys.recv_sign_key
-    hmac = self._get_data_hmac(message.message_id, message.data, key)
-    hmac.verify(message.hmac)
+  def decrypt_and_verify_message(self, message: api.Message) -> api.Message:
+    """
+    Verifies and decrypts message that was already read, doesn't do any I/O.
 
-  def _decrypt_and_verify_message(self, message):
-    message = self._decrypt_message(message)
-    self._verify_message_hmac(message)
+    Returns message with decrypted data.
+    """
+    data = self._crypto_context.open(message)
     # Note: this needs to be called after we verified the hmac
     self._verify_message_id(message)
-    return message
-
+    return message._replace(data=data)
@@ -0,0 +1,269 @@
+"""
+Registry of channels keyed by peer id, for gateways with a long tail of
+rarely active peers.
+
+Only recently used channels are kept in memory, least recently used and
+idle ones are evicted to ``api.SessionColdStore``, with keys wrapped, and
+rehydrated when they are needed again.
+"""
+
+import collections
+import os
+import struct
+import threading
+import time
+import typing
+
+from . import api, exceptions, utils
+from .primitives import BACKEND
+from .session_state import DefaultSessionState
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+  # pylint: disable=unused-import
+  from .secure_channel import SecureChannel
+
+WRAPPED_RECORD = struct.Struct(">12sQQ")
+"""96 bit nonce, send and receive message numbers, followed by wrapped keys and tag."""
+
+KEY_WRAP_CIPHER = "AES-256-GCM"
+
+DEFAULT_MAX_CHANNELS = 10000
+"""Default number of channels kept in memory."""
+
+
+class KeyWrapper(object):
+  """
+  Serializes session counters and keys, keys are encrypted and everything
+  is authenticated with 32 bytes long ``wrapping_key``, bound to peer id.
+
+  Nonces are random 96 bit numbers, repeated nonce reveals wrapped keys,
+  so don't wrap more than about 2^32 records with the same key, that
+  keeps probability of any repeated nonce below 2^-32.
+  """
+
+  def __init__(self, wrapping_key: bytearray):
+    self.__aead = BACKEND.create_aead(wrapping_key, KEY_WRAP_CIPHER)
+
+  def wrap(self, peer_id: str, send: int, recv: int, keys: api.ExtendedKeys) -> bytes:
+    """Returns record holding counters and wrapped keys."""
+    nonce = os.urandom(12)
+    header = WRAPPED_RECORD.pack(nonce, send, recv)
+    plaintext = bytearray().join(keys)
+    try:
+      ciphertext, tag = self.__aead.encrypt(
+        int.from_bytes(nonce, "big"), plaintext, header + peer_id.encode()
+      )
+    finally:
+      utils.clear_buffer(plaintext)
+    return header + ciphertext + tag
+
+  def unwrap(self, peer_id: str, record: bytes) -> typing.Tuple[int, int, api.ExtendedKeys]:
+    """
+    Returns send and receive message numbers and keys from record.
+
+    Raises ``InvalidSignature`` if record was modified or belongs to
+    other peer.
+    """
+    tag_size = self.__aead.tag_size_bytes
+    if len(record) < WRAPPED_RECORD.size + tag_size:
+      raise exceptions.InvalidSignature()
+    header = record[:WRAPPED_RECORD.size]
+    nonce, send, recv = WRAPPED_RECORD.unpack(header)
+    data = bytearray(self.__aead.decrypt(
+      int.from_bytes(nonce, "big"), record[WRAPPED_RECORD.size:-tag_size], record[-tag_size:],
+      header + peer_id.encode()
+    ))
+    key_size = len(data) // len(api.ExtendedKeys._fields)
+    keys = api.ExtendedKeys(*(
+      data[ii * key_size:(ii + 1) * key_size] for ii in range(len(api.ExtendedKeys._fields))
+    ))
+    utils.clear_buffer(data)
+    return send, recv, keys
+
+
+class MemoryColdStore(api.SessionColdStore):
+  """Cold store keeping records in a dict."""
+
+  def __init__(self):
+    self.records = {}
+
+  def put(self, peer_id: str, record: bytes):
+    self.records[peer_id] = record
+
+  def pop(self, peer_id: str) -> typing.Optional[bytes]:
+    return self.records.pop(peer_id, None)
+
+
+class DirectoryColdStore(api.SessionColdStore):
+  """Cold store keeping record of every peer in a file in ``directory``."""
+
+  def __init__(self, directory: str):
+    self.directory = directory
+
+  def __path(self, peer_id: str) -> str:
+    return os.path.join(self.directory, peer_id.encode().hex())
+
+  def put(self, peer_id: str, record: bytes):
+    path = self.__path(peer_id)
+    with open(path + ".tmp", "wb") as file:
+      file.write(record)
+      file.flush()
+      os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+  def pop(self, peer_id: str) -> typing.Optional[bytes]:
+    path = self.__path(peer_id)
+    try:
+      with open(path, "rb") as file:
+        record = file.read()
+    except FileNotFoundError:
+      return None
+    os.unlink(path)
+    return record
+
+
+class _RegisteredNegotiator(api.SessionKeyNegotiator):
+  """Creates session state with keys and counters given by the registry."""
+
+  def __init__(self, keys: api.ExtendedKeys, send: int, recv: int):
+    self.keys = keys
+    self.send = send
+    self.recv = recv
+
+  def create_session_state(
+      self,
+      data_source: api.DataSource,
+      configuration: api.ChannelConfiguration
+  ) -> DefaultSessionState:
+    return DefaultSessionState(configuration, self.keys, self.send, self.recv)
+
+
+class ChannelRegistry(object):
+  """
+  Keeps at most ``max_channels`` channels in memory, channels not used
+  for ``idle_timeout`` seconds are evicted too.
+
+  Evicted channel is written to ``cold_store``, with keys wrapped by
+  ``key_wrapper``, and then destroyed, its keys are zeroed with
+  ``utils.destroy_key``. ``get`` transparently rehydrates it as a new
+  channel, created by ``channel_factory`` from peer id and key negotiator.
+
+  Don't keep references to channels returned by ``get``, evicted channel
+  can't be used.
+  """
+
+  def __init__(
+      self,
+      channel_factory: typing.Callable[[str, api.SessionKeyNegotiator], "SecureChannel"],
+      cold_store: api.SessionColdStore,
+      key_wrapper: KeyWrapper,
+      max_channels: int = DEFAULT_MAX_CHANNELS,
+      idle_timeout: typing.Optional[float] = None,
+      clock: typing.Callable[[], float] = time.monotonic,
+  ):
+    assert max_channels > 0
+    assert idle_timeout is None or idle_timeout > 0
+    self.__channel_factory = channel_factory
+    self.__cold_store = cold_store
+    self.__key_wrapper = key_wrapper
+    self.__max_channels = max_channels
+    self.__idle_timeout = idle_timeout
+    self.__clock = clock
+    # Peer id -> (channel, time of last use), least recently used first.
+    self.__channels = collections.OrderedDict()
+    self.__lock = threading.RLock()
+
+  def __len__(self) -> int:
+    """Number of channels in memory."""
+    return len(self.__channels)
+
+  def __contains__(self, peer_id: str) -> bool:
+    """True if channel of peer is in memory."""
+    return peer_id in self.__channels
+
+  def add(
+      self,
+      peer_id: str,
+      keys: api.ExtendedKeys,
+      send_message_number: int = 0,
+      recv_message_number: int = 0
+  ) -> "SecureChannel":
+    """Create channel for a new session of peer."""
+    with self.__lock:
+      self.remove(peer_id)
+      return self.__insert(
+        peer_id, self.__create(peer_id, keys, send_message_number, recv_message_number)
+      )
+
+  def get(self, peer_id: str) -> "SecureChannel":
+    """
+    Return channel of peer, rehydrating it if it was evicted, raises
+    ``KeyError`` for unknown peers.
+    """
+    with self.__lock:
+      entry = self.__channels.get(peer_id)
+      if entry is not None:
+        self.__channels[peer_id] = (entry[0], self.__clock())
+        self.__channels.move_to_end(peer_id)
+        self.evict_idle()
+        return entry[0]
+      record = self.__cold_store.pop(peer_id)
+      if record is None:
+        raise KeyError(peer_id)
+      try:
+        send, recv, keys = self.__key_wrapper.unwrap(peer_id, record)
+        channel = self.__create(peer_id, keys, send, recv)
+      except BaseException:
+        # Don't lose the session, so it can be rehydrated later.
+        self.__cold_store.put(peer_id, record)
+        raise
+      return self.__insert(peer_id, channel)
+
+  def __create(self, peer_id: str, keys: api.ExtendedKeys, send: int, recv: int):
+    return self.__channel_factory(peer_id, _RegisteredNegotiator(keys, send, recv))
+
+  def __insert(self, peer_id: str, channel: "SecureChannel") -> "SecureChannel":
+    self.__channels[peer_id] = (channel, self.__clock())
+    while len(self.__channels) > self.__max_channels:
+      self.evict(next(iter(self.__channels)))
+    self.evict_idle()
+    return channel
+
+  def evict(self, peer_id: str):
+    """Move channel of peer to the cold store, and destroy it."""
+    with self.__lock:
+      channel, __ = self.__channels.pop(peer_id)
+      state = channel._session_state  # pylint: disable=protected-access
+      try:
+        record = self.__key_wrapper.wrap(
+          peer_id, state.send_message_number, state.recv_message_number,
+          state.get_extended_keys()
+        )
+      except exceptions.AlreadyReseted:
+        record = None
+      if record is not None:
+        self.__cold_store.put(peer_id, record)
+      channel.destroy_session()
+
+  def evict_idle(self) -> int:
+    """Evict channels idle for longer than ``idle_timeout``, returns their number."""
+    if self.__idle_timeout is None:
+      return 0
+    with self.__lock:
+      deadline = self.__clock() - self.__idle_timeout
+      idle = []
+      for peer_id, (__, last_used) in self.__channels.items():
+        if last_used > deadline:
+          break
+        idle.append(peer_id)
+      for peer_id in idle:
+        self.evict(peer_id)
+      return len(idle)
+
+  def remove(self, peer_id: str):
+    """Forget session of peer, both in memory and in the cold store."""
+    with self.__lock:
+      entry = self.__channels.pop(peer_id, None)
+      if entry is not None:
+        entry[0].destroy_session()
+      self.__cold_store.pop(peer_id)
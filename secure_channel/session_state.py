@@ -6,8 +6,30 @@ from . import exceptions, utils
 from .api import SessionState, ChannelConfiguration, ExtendedKeys
 
 
+DEFAULT_ID_BLOCK_SIZE = 1
+"""Default number of send message ids leased by a thread at once."""
+
+DEFAULT_REPLAY_WINDOW = 1024
+"""Default number of message ids tracked by ``WindowedSessionState``."""
+
+
 class DefaultSessionState(SessionState):
-  """Default session state with non-persistent session ids."""
+  """
+  Default session state with non-persistent session ids.
+
+  Send counter and received message number are guarded by separate locks,
+  so senders never wait for receivers, and keys are read without any
+  lock, as they don't change until the session is reset.
+
+  If ``id_block_size`` is larger than one, every thread leases blocks
+  of that many ids from the send counter, and takes ids from its block
+  without locking. Ids are then sent out of order, so peer needs to
+  accept reordered messages (see ``WindowedSessionState``), with window
+  of ``peer_window_size`` ids, which should be at least the number of
+  sending threads times ``id_block_size``. Block of a thread that was
+  idle while others sent is dropped, once its ids would fall out of
+  the peer's window, so ids left in dropped blocks are never used.
+  """
 
   def __init__(
       self,
@@ -15,27 +37,80 @@ class DefaultSessionState(SessionState):
       key: ExtendedKeys,
       send_message_number: int = 0,
       recv_message_number: int = 0,
+      id_block_size: int = DEFAULT_ID_BLOCK_SIZE,
+      peer_window_size: int = DEFAULT_REPLAY_WINDOW,
   ) -> None:
     super().__init__(configuration)
-    self.__lock = threading.Lock()
+    assert 0 < id_block_size < peer_window_size
+    self._send_lock = threading.Lock()
+    self._recv_lock = threading.Lock()
     self.__send_message_number = send_message_number
     self.__recv_message_number = recv_message_number
     self.__extended_keys = key
+    self.__id_block_size = id_block_size
+    self.__max_block_lag = peer_window_size - id_block_size
+    self.__id_blocks = threading.local()
+
+  @property
+  def id_block_size(self) -> int:
+    """Number of send message ids leased by a thread at once."""
+    return self.__id_block_size
+
+  @property
+  def send_message_number(self) -> int:
+    """Highest send message id handed out, including ids in leased blocks."""
+    return self.__send_message_number
+
+  @property
+  def recv_message_number(self) -> int:
+    """Highest verified received message id."""
+    return self.__recv_message_number
 
-  def __assert_ready(self):
+  def _assert_ready(self):
     if self.__extended_keys is None:
       raise exceptions.AlreadyReseted()
 
+  def _lease_send_message_numbers(self, count: int, exact: bool) -> range:
+    """
+    Take ``count`` ids from the send counter, if ``exact`` is False
+    fewer ids might be returned at the end of the session.
+
+    Subclasses override it to take ids from somewhere else.
+    """
+    with self._send_lock:
+      self._assert_ready()
+      first = self.__send_message_number + 1
+      last = self.__send_message_number + count
+      if last >= self.configuration.max_messages_in_session:
+        if exact or first >= self.configuration.max_messages_in_session:
+          raise exceptions.NeedToRenegotiateKey()
+        last = self.configuration.max_messages_in_session - 1
+      self.__send_message_number = last
+      return range(first, last + 1)
+
   def get_send_message_number(self):
-    with self.__lock:
-      self.__assert_ready()
-      self.__send_message_number += 1
-      if self.__send_message_number >= self.configuration.max_messages_in_session:
-        raise exceptions.NeedToRenegotiateKey()
-      return self.__send_message_number
+    if self.__id_block_size == 1:
+      return self._lease_send_message_numbers(1, exact=True).start
+    block = self.__id_blocks
+    message_number = getattr(block, "next", 0)
+    if (
+        message_number >= getattr(block, "stop", 0) or
+        # Other threads sent so much that peer would reject ids of this block.
+        self.send_message_number - message_number >= self.__max_block_lag
+    ):
+      leased = self._lease_send_message_numbers(self.__id_block_size, exact=False)
+      message_number, block.stop = leased.start, leased.stop
+    else:
+      # Block might have been leased before the session was reset.
+      self._assert_ready()
+    block.next = message_number + 1
+    return message_number
+
+  def get_send_message_numbers(self, count: int) -> range:
+    return self._lease_send_message_numbers(count, exact=True)
 
   def reset(self):
-    with self.__lock:
+    with self._send_lock, self._recv_lock:
       if self.__extended_keys is not None:
         utils.destroy_key(self.__extended_keys)
       self.__send_message_number = self.configuration.max_messages_in_session
@@ -43,13 +118,24 @@ class DefaultSessionState(SessionState):
       self.__extended_keys = None
 
   def get_extended_keys(self) -> ExtendedKeys:
-    with self.__lock:
-      self.__assert_ready()
-      return self.__extended_keys
+    # No lock, reading a reference is atomic, and keys are replaced only by reset.
+    keys = self.__extended_keys
+    if keys is None:
+      raise exceptions.AlreadyReseted()
+    return keys
+
+  def precheck_recv_message_number(self, message_number: int):
+    # No lock, this only reads state, and stale read is harmless as full
+    # check is done after message is verified.
+    self._assert_ready()
+    if message_number <= self.__recv_message_number:
+      raise exceptions.RecvMessageOutOfSequence()
+    if message_number >= self.configuration.max_messages_in_session:
+      raise exceptions.NeedToRenegotiateKey()
 
   def verify_recv_message_number(self, message_number: int):
-    with self.__lock:
-      self.__assert_ready()
+    with self._recv_lock:
+      self._assert_ready()
       if message_number <= self.__recv_message_number:
         raise exceptions.RecvMessageOutOfSequence()
       if message_number >= self.configuration.max_messages_in_session:
@@ -57,5 +143,80 @@ class DefaultSessionState(SessionState):
       self.__recv_message_number = message_number
 
 
+class WindowedSessionState(DefaultSessionState):
+  """
+  Session state that accepts received messages out of order.
 
+  Works like IPsec anti-replay window: message ids greater than the
+  highest id received so far are always accepted, ids that are at most
+  ``window_size`` smaller are accepted exactly once, older ids are
+  rejected. Received ids in the window are stored as bits of a single int.
+  """
 
+  def __init__(
+      self,
+      configuration: ChannelConfiguration,
+      key: ExtendedKeys,
+      send_message_number: int = 0,
+      recv_message_number: int = 0,
+      window_size: int = DEFAULT_REPLAY_WINDOW,
+      id_block_size: int = DEFAULT_ID_BLOCK_SIZE,
+      peer_window_size: int = DEFAULT_REPLAY_WINDOW,
+  ) -> None:
+    super().__init__(
+      configuration, key, send_message_number, recv_message_number, id_block_size,
+      peer_window_size
+    )
+    assert window_size > 0
+    self.__window_size = window_size
+    self.__window_mask = (1 << window_size) - 1
+    self.__highest_message_number = recv_message_number
+    # Bit ``i`` is set if message ``highest - i`` was received. It's not
+    # known which ids up to ``recv_message_number`` were received, so all
+    # count as received.
+    self.__window = self.__window_mask
+
+  @property
+  def window_size(self) -> int:
+    """Number of message ids tracked below the highest received one."""
+    return self.__window_size
+
+  @property
+  def recv_message_number(self) -> int:
+    """Highest verified received message id."""
+    return self.__highest_message_number
+
+  def __check(self, message_number: int):
+    """Raise if message number can't be accepted, returns its offset below highest."""
+    if message_number >= self.configuration.max_messages_in_session:
+      raise exceptions.NeedToRenegotiateKey()
+    offset = self.__highest_message_number - message_number
+    if offset >= self.__window_size:
+      raise exceptions.RecvMessageOutOfSequence()
+    if offset >= 0 and self.__window & (1 << offset):
+      raise exceptions.RecvMessageOutOfSequence()
+    return offset
+
+  def precheck_recv_message_number(self, message_number: int):
+    self._assert_ready()
+    self.__check(message_number)
+
+  def verify_recv_message_number(self, message_number: int):
+    with self._recv_lock:
+      self._assert_ready()
+      offset = self.__check(message_number)
+      if offset <= -self.__window_size:
+        # Whole window is older than the new id, don't shift by the whole gap.
+        self.__window = 1
+        self.__highest_message_number = message_number
+      elif offset < 0:
+        self.__window = ((self.__window << -offset) | 1) & self.__window_mask
+        self.__highest_message_number = message_number
+      else:
+        self.__window |= 1 << offset
+
+  def reset(self):
+    super().reset()
+    with self._recv_lock:
+      self.__highest_message_number = self.configuration.max_messages_in_session
+      self.__window = self.__window_mask
@@ -0,0 +1,345 @@
+"""
+Compact store of sessions of many peers, for gateways talking to
+hundreds of thousands of devices.
+
+Keys and message counters of every peer are a fixed size record in a
+memory mapped file, record of peer is found by its id, so lookup is
+O(1). ``SessionState`` objects are light views created on demand, and
+opening the store doesn't read any records.
+
+Message ids are reserved ahead, as in ``persistent_state``: every record
+holds the highest send and receive ids that might be in use, and it is
+synced before ids past them are used. Store that wasn't closed cleanly
+opens as usual, its records jump to their reservations when used.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import typing
+
+from . import exceptions, utils
+from .api import ChannelConfiguration, ExtendedKeys, SessionState
+from .persistent_state import DEFAULT_RESERVATION_SIZE, open_locked
+
+KEY_SIZE = 32
+"""Size of each of extended keys."""
+
+STORE_HEADER = struct.Struct(">8sBBxxIQII")
+"""
+Magic, version, clean shutdown flag, key size, capacity, generation
+and the last generation that wasn't closed cleanly.
+"""
+
+STORE_MAGIC = b'SCSTORE\x00'
+
+STORE_VERSION = 2
+
+PEER_RECORD = struct.Struct(">B3xIQQQQ")
+"""
+Record status, generation it was written in, send and receive message
+numbers and their reservations, followed by four keys.
+"""
+
+RECORD_SIZE = PEER_RECORD.size + len(ExtendedKeys._fields) * KEY_SIZE
+"""Size of record of a single peer, in bytes."""
+
+LOCK_STRIPES = 64
+"""Number of locks guarding records, records share locks by peer id."""
+
+RECORD_EMPTY = 0
+RECORD_ACTIVE = 1
+RECORD_RESET = 2
+
+
+class SessionStore(object):
+  """
+  Memory mapped file with records of ``capacity`` peers, peer ids are
+  record numbers, from zero to ``capacity - 1``. File is opened with
+  ``open_locked``, so opening store that is already open raises
+  ``SessionStateInUse``.
+
+  Counters are updated in memory, and written back by the OS or by
+  ``flush``, only reservations are synced when they grow, once per
+  ``reservation_size`` ids. Every opening of the store starts a new
+  generation, records last written in a generation that wasn't closed
+  cleanly might hold stale counters, so they continue from their
+  reservations, skipping up to ``reservation_size`` ids.
+  """
+
+  def __init__(
+      self,
+      path: str,
+      capacity: int,
+      reservation_size: int = DEFAULT_RESERVATION_SIZE
+  ):
+    assert reservation_size > 0
+    self.__path = path
+    self.__capacity = capacity
+    self.__reservation_size = reservation_size
+    size = STORE_HEADER.size + capacity * RECORD_SIZE
+    # File stays locked until closed, other users would reuse message ids.
+    self.__fd = open_locked(path)
+    try:
+      existing = os.fstat(self.__fd).st_size
+      if existing == 0:
+        os.ftruncate(self.__fd, size)
+      elif existing != size:
+        raise exceptions.CorruptedSessionState()
+      self.__map = mmap.mmap(self.__fd, size)
+    except BaseException:
+      os.close(self.__fd)
+      raise
+    generation, dirty_generation = 0, 0
+    if existing:
+      magic, version, clean, key_size, stored_capacity, generation, dirty_generation = (
+        STORE_HEADER.unpack_from(self.__map)
+      )
+      if (magic, version, key_size, stored_capacity) != (
+          STORE_MAGIC, STORE_VERSION, KEY_SIZE, capacity
+      ):
+        self.__map.close()
+        os.close(self.__fd)
+        raise exceptions.CorruptedSessionState()
+      if not clean:
+        dirty_generation = generation
+    self.__generation = generation + 1
+    self.__dirty_generation = dirty_generation
+    # Mark as in use until closed, before any record is written.
+    self.__write_header(clean=0)
+    self.__map.flush(0, STORE_HEADER.size)
+    self.__locks = [threading.Lock() for __ in range(LOCK_STRIPES)]
+
+  def __write_header(self, clean: int):
+    STORE_HEADER.pack_into(
+      self.__map, 0, STORE_MAGIC, STORE_VERSION, clean, KEY_SIZE, self.__capacity,
+      self.__generation, self.__dirty_generation
+    )
+
+  @property
+  def path(self) -> str:
+    """Path of the file."""
+    return self.__path
+
+  @property
+  def capacity(self) -> int:
+    """Number of peers store can hold."""
+    return self.__capacity
+
+  @property
+  def reservation_size(self) -> int:
+    """Number of message ids reserved with a single sync."""
+    return self.__reservation_size
+
+  def _offset(self, peer_id: int) -> int:
+    if not 0 <= peer_id < self.__capacity:
+      raise KeyError(peer_id)
+    return STORE_HEADER.size + peer_id * RECORD_SIZE
+
+  def _lock(self, peer_id: int) -> threading.Lock:
+    return self.__locks[peer_id % LOCK_STRIPES]
+
+  def _record(self, offset: int) -> typing.Tuple[int, int, int, int, int]:
+    """
+    Returns status, send and receive message numbers and their reservations,
+    counters that might be stale are replaced by reservations.
+    """
+    status, generation, send, recv, reserved_send, reserved_recv = PEER_RECORD.unpack_from(
+      self.__map, offset
+    )
+    if generation <= self.__dirty_generation:
+      send, recv = reserved_send, reserved_recv
+    return status, send, recv, reserved_send, reserved_recv
+
+  def _write_record(
+      self, offset: int, status: int, send: int, recv: int, reserved_send: int, reserved_recv: int
+  ):
+    PEER_RECORD.pack_into(
+      self.__map, offset, status, self.__generation, send, recv, reserved_send, reserved_recv
+    )
+
+  def _sync(self, offset: int):
+    """Writes record to the file, and waits until it is stored."""
+    start = offset - offset % mmap.PAGESIZE
+    self.__map.flush(start, offset + RECORD_SIZE - start)
+
+  def _read_keys(self, offset: int) -> ExtendedKeys:
+    start = offset + PEER_RECORD.size
+    return ExtendedKeys(*(
+      bytearray(self.__map[start + ii * KEY_SIZE:start + (ii + 1) * KEY_SIZE])
+      for ii in range(len(ExtendedKeys._fields))
+    ))
+
+  def _clear_keys(self, offset: int):
+    start = offset + PEER_RECORD.size
+    self.__map[start:start + RECORD_SIZE - PEER_RECORD.size] = bytes(
+      RECORD_SIZE - PEER_RECORD.size
+    )
+
+  def __contains__(self, peer_id: int) -> bool:
+    if not 0 <= peer_id < self.__capacity:
+      return False
+    return self._record(self._offset(peer_id))[0] == RECORD_ACTIVE
+
+  def put(
+      self,
+      peer_id: int,
+      key: ExtendedKeys,
+      send_message_number: int = 0,
+      recv_message_number: int = 0
+  ):
+    """
+    Stores new session of peer, replacing the previous one, views of
+    previous session must not be used after that.
+    """
+    if any(len(part) != KEY_SIZE for part in key):
+      raise ValueError("every key needs to be {} bytes long".format(KEY_SIZE))
+    offset = self._offset(peer_id)
+    with self._lock(peer_id):
+      start = offset + PEER_RECORD.size
+      for ii, part in enumerate(key):
+        self.__map[start + ii * KEY_SIZE:start + (ii + 1) * KEY_SIZE] = part
+      self._write_record(
+        offset, RECORD_ACTIVE, send_message_number, recv_message_number,
+        send_message_number, recv_message_number
+      )
+
+  def remove(self, peer_id: int):
+    """Zeroes record of peer."""
+    offset = self._offset(peer_id)
+    with self._lock(peer_id):
+      self._clear_keys(offset)
+      self._write_record(offset, RECORD_EMPTY, 0, 0, 0, 0)
+      self._sync(offset)
+
+  def session_state(
+      self,
+      peer_id: int,
+      configuration: ChannelConfiguration
+  ) -> "StoredSessionState":
+    """Returns session state of peer, backed by its record."""
+    if peer_id not in self:
+      raise KeyError(peer_id)
+    return StoredSessionState(configuration, self, peer_id)
+
+  def flush(self):
+    """Write changed records to the file."""
+    self.__map.flush()
+
+  def close(self):
+    """Flush records and mark the store as closed cleanly."""
+    if self.__map.closed:
+      return
+    self.__map.flush()
+    self.__write_header(clean=1)
+    self.__map.flush()
+    self.__map.close()
+    os.close(self.__fd)
+
+  def __enter__(self) -> "SessionStore":
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class StoredSessionState(SessionState):
+  """
+  Session state of single peer, kept in ``SessionStore`` record.
+
+  Behaves as ``DefaultSessionState``, all views of the same peer
+  share its state. Keys are copied out of the record on first use.
+  """
+
+  def __init__(self, configuration: ChannelConfiguration, store: SessionStore, peer_id: int):
+    super().__init__(configuration)
+    self.__store = store
+    self.__peer_id = peer_id
+    self.__offset = store._offset(peer_id)  # pylint: disable=protected-access
+    self.__lock = store._lock(peer_id)  # pylint: disable=protected-access
+    self.__keys = None
+
+  @property
+  def peer_id(self) -> int:
+    """Id of peer this state belongs to."""
+    return self.__peer_id
+
+  def __record(self) -> typing.Tuple[int, int, int, int]:
+    """
+    Returns send and receive message numbers and their reservations,
+    raises if session was reset.
+    """
+    # pylint: disable=protected-access
+    status, *counters = self.__store._record(self.__offset)
+    if status != RECORD_ACTIVE:
+      raise exceptions.AlreadyReseted()
+    return counters
+
+  def __write(
+      self, send: int, recv: int, reserved_send: int, reserved_recv: int, sync: bool
+  ):
+    # pylint: disable=protected-access
+    self.__store._write_record(
+      self.__offset, RECORD_ACTIVE, send, recv, reserved_send, reserved_recv
+    )
+    if sync:
+      self.__store._sync(self.__offset)
+
+  def __reserve(self, message_number: int, reserved: int) -> int:
+    """Returns reservation covering ``message_number``."""
+    if message_number <= reserved:
+      return reserved
+    return min(
+      message_number + self.__store.reservation_size,
+      self.configuration.max_messages_in_session
+    )
+
+  def get_send_message_number(self) -> int:
+    return self.get_send_message_numbers(1).start
+
+  def get_send_message_numbers(self, count: int) -> range:
+    with self.__lock:
+      send, recv, reserved_send, reserved_recv = self.__record()
+      if send + count >= self.configuration.max_messages_in_session:
+        raise exceptions.NeedToRenegotiateKey()
+      reservation = self.__reserve(send + count, reserved_send)
+      # Ids are returned only after they are persisted as reserved.
+      self.__write(
+        send + count, recv, reservation, reserved_recv, sync=reservation != reserved_send
+      )
+      return range(send + 1, send + count + 1)
+
+  def precheck_recv_message_number(self, message_number: int):
+    __, recv, __, __ = self.__record()
+    if message_number <= recv:
+      raise exceptions.RecvMessageOutOfSequence()
+    if message_number >= self.configuration.max_messages_in_session:
+      raise exceptions.NeedToRenegotiateKey()
+
+  def verify_recv_message_number(self, message_number: int):
+    with self.__lock:
+      self.precheck_recv_message_number(message_number)
+      send, __, reserved_send, reserved_recv = self.__record()
+      reservation = self.__reserve(message_number, reserved_recv)
+      self.__write(
+        send, message_number, reserved_send, reservation, sync=reservation != reserved_recv
+      )
+
+  def get_extended_keys(self) -> ExtendedKeys:
+    self.__record()
+    if self.__keys is None:
+      self.__keys = self.__store._read_keys(self.__offset)  # pylint: disable=protected-access
+    return self.__keys
+
+  def reset(self):
+    with self.__lock:
+      # pylint: disable=protected-access
+      status = self.__store._record(self.__offset)[0]
+      if status == RECORD_ACTIVE:
+        self.__store._clear_keys(self.__offset)
+        limit = self.configuration.max_messages_in_session
+        self.__store._write_record(self.__offset, RECORD_RESET, limit, limit, limit, limit)
+        self.__store._sync(self.__offset)
+      if self.__keys is not None:
+        utils.destroy_key(self.__keys)
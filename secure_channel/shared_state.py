@@ -0,0 +1,289 @@
+"""
+Session state shared by many processes, for example by pre-forked workers
+talking to the same peer over one session.
+
+Processes lease disjoint ranges of send message ids from a small file
+locked with ``fcntl``, so taking an id needs no exclusive cross-process
+lock except once per lease. Received message ids are tracked in the same
+file, so a message accepted by one process is rejected by all others.
+POSIX only.
+"""
+
+import fcntl
+import os
+import struct
+import threading
+import time
+import typing
+
+from . import exceptions
+from .api import ChannelConfiguration, ExtendedKeys
+from .session_state import DEFAULT_REPLAY_WINDOW, DefaultSessionState
+
+ID_RANGE_RECORD = struct.Struct(">Q")
+"""Id range file starts with the highest leased message id."""
+
+RECV_RECORD = struct.Struct(">Q")
+"""
+Followed by the highest received message id, and replay window: bit ``i``
+is set if message ``highest - i`` was received.
+"""
+
+DEFAULT_LEASE_SIZE = 16
+"""
+Default number of message ids leased by a process at once, it is much
+smaller than ``DEFAULT_REPLAY_WINDOW``, so leases of many processes fit
+in the replay window of the peer.
+"""
+
+DEFAULT_LAG_CHECK_INTERVAL = 0.01
+"""
+Default number of seconds a process trusts the highest leased id it saw,
+before it reads it from the file again.
+"""
+
+
+class IdRangeFile(object):
+  """
+  Leases disjoint ranges of message ids to processes sharing ``path``.
+
+  File holds the highest message id leased so far, it is read and updated
+  under exclusive ``fcntl.lockf`` lock. If ``durable`` is True every update
+  is synced to disk before the range is returned.
+
+  File also holds received message ids, checked like in
+  ``WindowedSessionState``, with a window of ``window_size`` ids.
+
+  POSIX locks belong to a process, so use a single instance per process,
+  instance is inherited by forked processes.
+  """
+
+  def __init__(self, path: str, durable: bool = False, window_size: int = DEFAULT_REPLAY_WINDOW):
+    assert window_size > 0 and window_size % 8 == 0
+    self.__path = path
+    self.__durable = durable
+    self.__window_size = window_size
+    self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    # Threads of the same process are not excluded by ``lockf``.
+    self.__lock = threading.Lock()
+
+  @property
+  def path(self) -> str:
+    """Path of the file."""
+    return self.__path
+
+  @property
+  def window_size(self) -> int:
+    """Number of received message ids tracked below the highest one."""
+    return self.__window_size
+
+  def __read(self) -> int:
+    data = os.pread(self.__fd, ID_RANGE_RECORD.size, 0)
+    if len(data) < ID_RANGE_RECORD.size:
+      return 0
+    return ID_RANGE_RECORD.unpack(data)[0]
+
+  def __write(self, highest: int):
+    os.pwrite(self.__fd, ID_RANGE_RECORD.pack(highest), 0)
+    if self.__durable:
+      os.fsync(self.__fd)
+
+  def __read_received(self) -> typing.Tuple[int, int]:
+    size = RECV_RECORD.size + self.__window_size // 8
+    data = os.pread(self.__fd, size, ID_RANGE_RECORD.size)
+    if len(data) < size:
+      # Nothing received, ids up to zero count as received.
+      return 0, (1 << self.__window_size) - 1
+    highest, = RECV_RECORD.unpack_from(data)
+    return highest, int.from_bytes(data[RECV_RECORD.size:], "big")
+
+  def __write_received(self, highest: int, window: int):
+    os.pwrite(
+      self.__fd,
+      RECV_RECORD.pack(highest) + window.to_bytes(self.__window_size // 8, "big"),
+      ID_RANGE_RECORD.size
+    )
+    if self.__durable:
+      os.fsync(self.__fd)
+
+  def __window_offset(self, highest: int, window: int, message_number: int) -> int:
+    """Raise if message number was received, returns its offset below highest."""
+    offset = highest - message_number
+    if offset >= self.__window_size:
+      raise exceptions.RecvMessageOutOfSequence()
+    if offset >= 0 and window & (1 << offset):
+      raise exceptions.RecvMessageOutOfSequence()
+    return offset
+
+  def highest_received(self) -> int:
+    """Highest message id received so far by any process."""
+    with self.__lock:
+      fcntl.lockf(self.__fd, fcntl.LOCK_SH)
+      try:
+        return self.__read_received()[0]
+      finally:
+        fcntl.lockf(self.__fd, fcntl.LOCK_UN)
+
+  def check_received(self, message_number: int):
+    """Raise ``RecvMessageOutOfSequence`` if message was already received."""
+    with self.__lock:
+      fcntl.lockf(self.__fd, fcntl.LOCK_SH)
+      try:
+        self.__window_offset(*self.__read_received(), message_number)
+      finally:
+        fcntl.lockf(self.__fd, fcntl.LOCK_UN)
+
+  def receive(self, message_number: int):
+    """
+    Mark message as received, raises ``RecvMessageOutOfSequence`` if it
+    already was received by any process, or is too old.
+    """
+    with self.__lock:
+      fcntl.lockf(self.__fd, fcntl.LOCK_EX)
+      try:
+        highest, window = self.__read_received()
+        offset = self.__window_offset(highest, window, message_number)
+        if offset <= -self.__window_size:
+          # Whole window is older than the new id, don't shift by the whole gap.
+          window = 1
+          highest = message_number
+        elif offset < 0:
+          mask = (1 << self.__window_size) - 1
+          window = ((window << -offset) | 1) & mask
+          highest = message_number
+        else:
+          window |= 1 << offset
+        self.__write_received(highest, window)
+      finally:
+        fcntl.lockf(self.__fd, fcntl.LOCK_UN)
+
+  def highest_leased(self) -> int:
+    """Highest message id leased so far by any process."""
+    with self.__lock:
+      fcntl.lockf(self.__fd, fcntl.LOCK_SH)
+      try:
+        return self.__read()
+      finally:
+        fcntl.lockf(self.__fd, fcntl.LOCK_UN)
+
+  def lease(self, count: int, limit: int) -> range:
+    """
+    Lease up to ``count`` consecutive message ids lower than ``limit``.
+
+    Fewer ids are returned at the end of the session, if there are none
+    left ``NeedToRenegotiateKey`` is raised, for every process.
+    """
+    with self.__lock:
+      fcntl.lockf(self.__fd, fcntl.LOCK_EX)
+      try:
+        highest = self.__read()
+        if highest + 1 >= limit:
+          raise exceptions.NeedToRenegotiateKey()
+        last = min(highest + count, limit - 1)
+        self.__write(last)
+        return range(highest + 1, last + 1)
+      finally:
+        fcntl.lockf(self.__fd, fcntl.LOCK_UN)
+
+  def close(self):
+    """Close the file, can be called many times."""
+    if self.__fd is not None:
+      os.close(self.__fd)
+      self.__fd = None
+
+
+class SharedSessionState(DefaultSessionState):
+  """
+  Session state taking send message ids from ``IdRangeFile`` shared with
+  other processes, received message ids are tracked in the same file.
+
+  Ids are leased ``lease_size`` at a time. Messages from many processes
+  arrive out of order, so peer should use ``WindowedSessionState`` with
+  window of ``peer_window_size`` ids, which needs to hold leases of all
+  processes sending at the same time: ``peer_window_size`` should be at
+  least the number of processes times ``lease_size``. Rest of the lease
+  of a process that was idle while others sent is dropped, once it would
+  fall out of the peer's window. To keep sends free of file access, the
+  highest id leased by others is read from the file at most once per
+  ``lag_check_interval`` seconds, and learned for free with every lease.
+
+  Leases don't survive ``fork``, so state created before forking workers
+  is safe to use in all of them.
+  """
+
+  def __init__(
+      self,
+      configuration: ChannelConfiguration,
+      key: ExtendedKeys,
+      id_file: IdRangeFile,
+      lease_size: int = DEFAULT_LEASE_SIZE,
+      recv_message_number: int = 0,
+      peer_window_size: int = DEFAULT_REPLAY_WINDOW,
+      lag_check_interval: float = DEFAULT_LAG_CHECK_INTERVAL,
+  ) -> None:
+    super().__init__(configuration, key)
+    assert 0 < lease_size < peer_window_size
+    self.__id_file = id_file
+    self.__lease_size = lease_size
+    self.__max_lag = peer_window_size - lease_size
+    self.__lag_check_interval = lag_check_interval
+    self.__leased = range(0)
+    # Highest id leased by any process as last seen, and when it was seen.
+    self.__highest_leased = 0
+    self.__checked_at = time.monotonic()
+    self.__pid = os.getpid()
+    self.__recv_message_number = recv_message_number
+
+  @property
+  def id_file(self) -> IdRangeFile:
+    """File ids are leased from."""
+    return self.__id_file
+
+  @property
+  def recv_message_number(self) -> int:
+    """Highest verified received message id, of all processes."""
+    return max(self.__recv_message_number, self.__id_file.highest_received())
+
+  def _lease_send_message_numbers(self, count: int, exact: bool) -> range:
+    with self._send_lock:
+      self._assert_ready()
+      if self.__pid != os.getpid():
+        # Forked, parent and other children have the same lease.
+        self.__leased = range(0)
+        self.__pid = os.getpid()
+      if self.__leased:
+        now = time.monotonic()
+        if now - self.__checked_at >= self.__lag_check_interval:
+          self.__highest_leased = self.__id_file.highest_leased()
+          self.__checked_at = now
+        if self.__highest_leased - self.__leased.start >= self.__max_lag:
+          # Other processes sent so much that peer would reject these ids.
+          self.__leased = range(0)
+      if len(self.__leased) < count and (exact or not self.__leased):
+        self.__leased = self.__id_file.lease(
+          max(count, self.__lease_size), self.configuration.max_messages_in_session
+        )
+        # Nothing was leased after the new lease yet.
+        self.__highest_leased = self.__leased.stop - 1
+        self.__checked_at = time.monotonic()
+        if exact and len(self.__leased) < count:
+          raise exceptions.NeedToRenegotiateKey()
+      result = self.__leased[:count]
+      self.__leased = self.__leased[count:]
+      return result
+
+  def __check(self, message_number: int):
+    self._assert_ready()
+    if message_number <= self.__recv_message_number:
+      raise exceptions.RecvMessageOutOfSequence()
+    if message_number >= self.configuration.max_messages_in_session:
+      raise exceptions.NeedToRenegotiateKey()
+
+  def precheck_recv_message_number(self, message_number: int):
+    self.__check(message_number)
+    self.__id_file.check_received(message_number)
+
+  def verify_recv_message_number(self, message_number: int):
+    with self._recv_lock:
+      self.__check(message_number)
+      self.__id_file.receive(message_number)
@@ -5,8 +5,8 @@ from .api import DataBuffer, ExtendedKeys
 
 def clear_buffer(buffer: DataBuffer):
   """Sets all bytes in the buffer to zero."""
-  for ii in range(len(buffer)):  # pylint: disable=consider-using-enumerate
-    buffer[ii] = 0
+  with memoryview(buffer) as view, view.cast('B') as target:
+    target[:] = bytes(len(target))
 
 
 def destroy_key(key: ExtendedKeys):
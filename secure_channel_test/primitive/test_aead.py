@@ -0,0 +1,78 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+
+import os
+
+import pytest
+
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+
+from secure_channel.exceptions import CounterOverflowError, InvalidSignature
+from secure_channel.primitives.pycrypto_backend import aead_nonce
+
+
+@pytest.fixture(params=["AES-256-GCM", "ChaCha20-Poly1305"])
+def cipher_name(request):
+  return request.param
+
+
+@pytest.fixture()
+def aead_key():
+  return bytearray(os.urandom(32))
+
+
+@pytest.fixture()
+def aead(pycrypto_backend, aead_key, cipher_name):
+  return pycrypto_backend.create_aead(aead_key, cipher_name)
+
+
+def test_aead_nonce():
+  assert aead_nonce(1) == b'\0' * 11 + b'\1'
+  assert len(aead_nonce(2 ** 64 - 1)) == 12
+  assert aead_nonce(2 ** 96 - 1) == b'\xff' * 12
+  with pytest.raises(CounterOverflowError):
+    aead_nonce(2 ** 96)
+
+
+def test_aead_round_trip(aead, random_data_for_tests):
+  ciphertext, tag = aead.encrypt(5, random_data_for_tests, b'header')
+  assert len(tag) == aead.tag_size_bytes == 16
+  assert len(ciphertext) == len(random_data_for_tests)
+  assert aead.decrypt(5, ciphertext, tag, b'header') == random_data_for_tests
+
+
+def test_aead_accepts_buffers(aead):
+  ciphertext, tag = aead.encrypt(5, bytearray(b'odd length'), memoryview(b'header'))
+  assert aead.decrypt(5, memoryview(ciphertext), bytearray(tag), b'header') == b'odd length'
+
+
+def test_aead_matches_pycrypto(aead_key):
+  from secure_channel.primitives import BACKEND
+  expected = AES.new(key=bytes(aead_key), mode=AES.MODE_GCM, nonce=aead_nonce(7))
+  expected.update(b'ad')
+  actual = BACKEND.create_aead(aead_key, "AES-256-GCM").encrypt(7, b'data', b'ad')
+  assert actual == expected.encrypt_and_digest(b'data')
+
+  expected = ChaCha20_Poly1305.new(key=bytes(aead_key), nonce=aead_nonce(7))
+  expected.update(b'ad')
+  actual = BACKEND.create_aead(aead_key, "ChaCha20-Poly1305").encrypt(7, b'data', b'ad')
+  assert actual == expected.encrypt_and_digest(b'data')
+
+
+def test_aead_tampered_data(aead):
+  ciphertext, tag = aead.encrypt(5, b'attack at dawn', b'header')
+  tampered = bytearray(ciphertext)
+  tampered[0] ^= 1
+  with pytest.raises(InvalidSignature):
+    aead.decrypt(5, tampered, tag, b'header')
+
+
+def test_aead_wrong_associated_data(aead):
+  ciphertext, tag = aead.encrypt(5, b'attack at dawn', b'header')
+  with pytest.raises(InvalidSignature):
+    aead.decrypt(5, ciphertext, tag, b'other header')
+
+
+def test_aead_wrong_nonce(aead):
+  ciphertext, tag = aead.encrypt(5, b'attack at dawn', b'header')
+  with pytest.raises(InvalidSignature):
+    aead.decrypt(6, ciphertext, tag, b'header')
@@ -123,3 +123,209 @@ def test_pad(pycrypto_ciphers):
 def test_unpad(pycrypto_ciphers):
   encrypt, __ = pycrypto_ciphers
   assert encrypt.unpad(encrypt.pad(b'1234')) == b'1234'
+
+
+@pytest.fixture()
+def pycrypto_context_cipher(pycrypto_backend: Backend, random_key, random_message_id):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  return context.create_cipher_mode(random_message_id, Direction.ENCRYPT)
+
+
+@pytest.fixture()
+def pycrypto_reference_cipher(pycrypto_backend: Backend, random_key, random_message_id):
+  return pycrypto_backend.create_cipher_mode(
+    key=random_key,
+    ctr=random_message_id,
+    cipher="AES",
+    direction=Direction.ENCRYPT
+  )
+
+
+@pytest.mark.parametrize("block_count", [1, 2, 31, 32, 33, 100])
+def test_context_cipher_matches_reference(
+    pycrypto_context_cipher,
+    pycrypto_reference_cipher,
+    block_count
+):
+  plaintext = os.urandom(16 * block_count)
+  assert pycrypto_context_cipher.update(plaintext) == pycrypto_reference_cipher.update(plaintext)
+
+
+def test_context_cipher_matches_reference_on_subsequent_updates(
+    pycrypto_context_cipher,
+    pycrypto_reference_cipher,
+):
+  # Mixes keystream and native ctr mode updates, counters need to continue.
+  for block_count in [3, 100, 1, 64, 2]:
+    plaintext = os.urandom(16 * block_count)
+    expected = pycrypto_reference_cipher.update(plaintext)
+    assert pycrypto_context_cipher.update(plaintext) == expected
+
+
+def test_context_cipher_decryption(pycrypto_backend: Backend, random_key, random_data_for_tests):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  encrypt = context.create_cipher_mode(1, Direction.ENCRYPT)
+  decrypt = context.create_cipher_mode(1, Direction.DECRYPT)
+  assert decrypt.update(encrypt.update(random_data_for_tests)) == random_data_for_tests
+
+
+def test_context_cipher_pad(pycrypto_context_cipher):
+  assert pycrypto_context_cipher.unpad(pycrypto_context_cipher.pad(b'1234')) == b'1234'
+  assert pycrypto_context_cipher.block_size_bytes == 16
+
+
+@pytest.fixture()
+def batch_messages(srandom):
+  # Mixes messages batched by keystream with ones large enough for native ctr.
+  return [
+    (srandom.randint(1, 2 ** 40), os.urandom(16 * block_count))
+    for block_count in [1, 3, 32, 33, 2, 0, 100, 1, 16]
+  ]
+
+
+def test_update_many_matches_single_messages(pycrypto_backend: Backend, random_key, batch_messages):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  expected = [
+    pycrypto_backend.create_cipher_mode(
+      key=random_key, ctr=message_id, cipher="AES", direction=Direction.ENCRYPT
+    ).update(data)
+    for message_id, data in batch_messages
+  ]
+  assert context.update_many(batch_messages, Direction.ENCRYPT) == expected
+
+
+def test_default_update_many(pycrypto_backend: Backend, random_key, batch_messages):
+  from secure_channel.primitives.api import CipherContext
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  expected = context.update_many(batch_messages, Direction.ENCRYPT)
+  assert CipherContext.update_many(context, batch_messages, Direction.ENCRYPT) == expected
+
+
+def test_update_many_round_trip(pycrypto_backend: Backend, random_key, batch_messages):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  ciphertexts = context.update_many(batch_messages, Direction.ENCRYPT)
+  decrypted = context.update_many(
+    [(message_id, ciphertext) for (message_id, __), ciphertext in zip(batch_messages, ciphertexts)],
+    Direction.DECRYPT
+  )
+  assert decrypted == [data for __, data in batch_messages]
+
+
+def test_update_many_empty(pycrypto_backend: Backend, random_key):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  assert context.update_many([], Direction.ENCRYPT) == []
+
+
+@pytest.mark.parametrize("block_count", [1, 2, 31, 32, 33, 100])
+def test_update_into(
+    pycrypto_ciphers, pycrypto_context_cipher, pycrypto_reference_cipher, block_count
+):
+  plaintext = os.urandom(16 * block_count)
+  expected = pycrypto_reference_cipher.update(plaintext)
+  for cipher in (pycrypto_ciphers[0], pycrypto_context_cipher):
+    output = bytearray(len(plaintext))
+    cipher.update_into(plaintext, output)
+    assert output == expected
+
+
+def test_update_into_in_place(pycrypto_backend: Backend, random_key):
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  reference = pycrypto_backend.create_cipher_mode(random_key, 5, "AES", Direction.DECRYPT)
+  plaintext = os.urandom(16 * 100)
+  buffer = bytearray(plaintext)
+  encrypt = context.create_cipher_mode(5, Direction.ENCRYPT)
+  with memoryview(buffer) as view:
+    # Subsequent updates, first using keystream, then native ctr mode.
+    encrypt.update_into(view[:16], view[:16])
+    encrypt.update_into(view[16:], view[16:])
+  assert reference.update(buffer) == plaintext
+  reference = pycrypto_backend.create_cipher_mode(random_key, 5, "AES", Direction.DECRYPT)
+  reference.update_into(buffer, buffer)
+  assert buffer == plaintext
+
+
+def test_default_update_into(pycrypto_context_cipher, pycrypto_reference_cipher):
+  from secure_channel.primitives.api import CipherMode
+  plaintext = os.urandom(64)
+  output = bytearray(64)
+  with memoryview(output) as view:
+    CipherMode.update_into(pycrypto_context_cipher, plaintext, view)
+  assert output == pycrypto_reference_cipher.update(plaintext)
+
+
+@pytest.fixture()
+def small_segments(monkeypatch):
+  from secure_channel.primitives import pycrypto_backend
+  monkeypatch.setattr(pycrypto_backend, "MIN_SEGMENT_BYTES", 64)
+  monkeypatch.setattr(pycrypto_backend.os, "cpu_count", lambda: 4)
+
+
+@pytest.mark.parametrize("executor", [None, "thread_pool"])
+@pytest.mark.parametrize("block_count", [64, 65, 1000, 1001])
+def test_parallel_update_matches_reference(random_key, small_segments, executor, block_count):
+  # pylint: disable=unused-argument
+  import concurrent.futures
+  from secure_channel.primitives import pycrypto_backend
+  if executor is not None:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+  backend = pycrypto_backend.PycryptoBackend(parallel_threshold_bytes=1024, executor=executor)
+  context = backend.create_cipher_context(key=random_key, cipher="AES")
+  assert context.parallel_threshold_bytes == 1024
+  reference = backend.create_cipher_mode(random_key, 3, "AES", Direction.ENCRYPT)
+  encrypt_into = context.create_cipher_mode(3, Direction.ENCRYPT)
+  encrypt = context.create_cipher_mode(3, Direction.ENCRYPT)
+  # Parallel update needs to start at the right block after previous updates.
+  for data in (os.urandom(16 * 70), os.urandom(16 * block_count), os.urandom(16 * 2)):
+    expected = reference.update(data)
+    output = bytearray(len(data))
+    encrypt_into.update_into(data, output)
+    assert output == expected
+    assert encrypt.update(data) == expected
+  if executor is not None:
+    executor.shutdown()
+
+
+def test_parallel_update_uses_executor(random_key, small_segments):
+  # pylint: disable=unused-argument
+  import concurrent.futures
+  from secure_channel.primitives import pycrypto_backend
+
+  class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *args, **kwargs):  # pylint: disable=arguments-differ
+      self.submitted += 1
+      return super().submit(*args, **kwargs)
+
+  with CountingExecutor(max_workers=2) as executor:
+    context = pycrypto_backend.PyCryptoCipherContext(
+      pycrypto_backend.AES, random_key, parallel_threshold_bytes=1024, executor=executor
+    )
+    context.create_cipher_mode(1, Direction.ENCRYPT).update(os.urandom(16 * 1000))
+    assert executor.submitted > 0
+
+
+def test_default_parallel_threshold(pycrypto_backend: Backend, random_key):
+  from secure_channel.primitives import pycrypto_backend as module
+  from secure_channel.primitives.api import CipherContext
+  context = pycrypto_backend.create_cipher_context(key=random_key, cipher="AES")
+  assert context.parallel_threshold_bytes == module.PARALLEL_THRESHOLD_BYTES
+  assert CipherContext.parallel_threshold_bytes.fget(context) is None
+  assert module.parallel_executor() is module.parallel_executor()
+
+
+def test_configure_parallel_encryption(random_key):
+  import concurrent.futures
+  from secure_channel import primitives
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+  primitives.configure_parallel_encryption(1024, executor)
+  try:
+    context = primitives.BACKEND.create_cipher_context(key=random_key, cipher="AES")
+    assert context.parallel_threshold_bytes == 1024
+    assert context.executor is executor
+  finally:
+    primitives.configure_parallel_encryption()
+    executor.shutdown()
+  context = primitives.BACKEND.create_cipher_context(key=random_key, cipher="AES")
+  assert context.parallel_threshold_bytes == primitives.PARALLEL_THRESHOLD_BYTES
+  assert context.executor is None
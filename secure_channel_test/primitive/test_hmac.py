@@ -88,6 +88,28 @@ def test_pycrypto_hmac_verifier_negative(
     pycrypto_hmac_verifier(fixed_message, fixed_message_invalid_hash)
 
 
+@pytest.mark.parametrize("key_length", [0, 32, 64, 65, 200])
+def test_pycrypto_hmac_key_lengths(pycrypto_backend, fixed_message, key_length):
+  key = os.urandom(key_length)
+  expected = hmac.HMAC(key, fixed_message, digestmod=hashlib.sha256).digest()
+  actual = pycrypto_backend.create_hmac(key=key, hash_func="SHA-256")
+  actual.update(fixed_message)
+  assert actual.finalize() == expected
+
+
+def test_pycrypto_hmac_copy(hmac_key, fixed_message, fixed_message_hash, pycrypto_backend):
+  prefix = pycrypto_backend.create_hmac(key=hmac_key, hash_func="SHA-256")
+  prefix.update(fixed_message[:10])
+  first = prefix.copy()
+  second = prefix.copy()
+  first.update(fixed_message[10:])
+  second.update(b'other suffix')
+  assert first.finalize() == fixed_message_hash
+  assert second.finalize() != fixed_message_hash
+  prefix.update(fixed_message[10:])
+  assert prefix.finalize() == fixed_message_hash
+
+
 @pytest.fixture(params=list(range(100)))
 def random_test_data():
   buffer = bytearray(os.urandom(1024))
@@ -4,6 +4,8 @@ import pytest
 
 from secure_channel.exceptions import CounterOverflowError
 from secure_channel.primitives.pycrypto_backend import format_counter
+from secure_channel.primitives.utils import ctr_blocks, xor_buffers
+from secure_channel.primitives.example import ctr_plaintext
 
 
 def test_format_counter():
@@ -18,3 +20,24 @@ def test_format_counter_negative():
     format_counter((2 ** (8 * 8)))
   with pytest.raises(CounterOverflowError):
     format_counter((2 ** (8 * 9)))
+
+
+def test_ctr_blocks():
+  expected = ctr_plaintext(5, 7) + ctr_plaintext(5, 8) + ctr_plaintext(5, 9)
+  assert ctr_blocks(5, 7, 3) == expected
+  assert ctr_blocks(5, 7, 0) == b''
+
+
+def test_ctr_blocks_past_precomputed_suffixes():
+  expected = b''.join(ctr_plaintext(5, block) for block in range(1020, 1030))
+  assert ctr_blocks(5, 1020, 10) == expected
+
+
+def test_ctr_blocks_overflow():
+  with pytest.raises(CounterOverflowError):
+    ctr_blocks(2 ** (8 * 8), 0, 1)
+
+
+def test_xor_buffers():
+  assert xor_buffers(b'\x00\xff\x0f', b'\xff\xff\x01') == b'\xff\x00\x0e'
+  assert xor_buffers(b'', b'') == b''
@@ -47,3 +47,9 @@ def channel(channel_sources, key_generators):
     data_source=channel_sources[0],
     key_generator=key_generators[0]
   )
+
+
+@pytest.fixture()
+def example_message():
+  return b'\x10.A\x7f\x1d.\xdf3\x9cTd;\xa7\xd9\x8c\x1d\xe4' \
+         b'\x11\xa3Q,\x9b\xbe\xd1m\xb3d\xed\xa3\xd0\xb63'
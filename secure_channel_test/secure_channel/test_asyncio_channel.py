@@ -0,0 +1,114 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import asyncio
+import concurrent.futures
+import socket
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+
+  def __init__(self):
+    super().__init__(max_workers=2)
+    self.submitted = 0
+
+  def submit(self, *args, **kwargs):  # pylint: disable=arguments-differ
+    self.submitted += 1
+    return super().submit(*args, **kwargs)
+
+
+async def create_channels(key_generators, **kwargs):
+  left, right = socket.socketpair()
+  result = []
+  for sock, key_generator in zip((left, right), key_generators):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    result.append(secure_channel.AsyncSecureChannel(
+      data_source=data_source.StreamDataSource(api.DEFAULT_CONFIGURATION, reader, writer),
+      key_generator=key_generator,
+      **kwargs
+    ))
+  return result
+
+
+async def close_channels(channels):
+  for channel in channels:
+    await channel._data_source.close()
+
+
+def test_async_message_passing(key_generators, srandom):
+  messages = [bytes(srandom.getrandbits(8) for __ in range(16 * ii)) for ii in (1, 64, 3)]
+
+  async def run():
+    channel1, channel2 = await create_channels(key_generators)
+    for message in messages:
+      await channel1.send_message(message)
+    received = [await channel2.receive_message() for __ in messages]
+    await close_channels((channel1, channel2))
+    return received
+
+  assert asyncio.run(run()) == messages
+
+
+def test_async_both_directions(key_generators, example_message):
+
+  async def run():
+    channel1, channel2 = await create_channels(key_generators)
+    await channel1.send_message(example_message)
+    await channel2.send_message(example_message[::-1])
+    received = await channel2.receive_message(), await channel1.receive_message()
+    await close_channels((channel1, channel2))
+    return received
+
+  assert asyncio.run(run()) == (example_message, example_message[::-1])
+
+
+def test_async_large_messages_use_executor(key_generators, srandom):
+  executor = CountingExecutor()
+  small = bytes(16)
+  large = bytes(srandom.getrandbits(8) for __ in range(16 * 64))
+
+  async def run():
+    channel1, channel2 = await create_channels(
+      key_generators, executor=executor, executor_threshold_bytes=512
+    )
+    # Concurrent sends still need to be written in order of message ids.
+    await asyncio.gather(channel1.send_message(large), channel1.send_message(small))
+    received = [await channel2.receive_message() for __ in range(2)]
+    await close_channels((channel1, channel2))
+    return received
+
+  with executor:
+    assert asyncio.run(run()) == [large, small]
+  # One for encryption and one for decryption
+  assert executor.submitted == 2
+
+
+def test_async_invalid_message(key_generators, example_message):
+
+  async def run():
+    channel1, channel2 = await create_channels(key_generators)
+    await channel1.send_message(example_message)
+    await channel1.send_message(example_message)
+    await channel2.receive_message()
+    # Replay first message.
+    channel2._session_state.verify_recv_message_number(2)
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      await channel2.receive_message()
+    await close_channels((channel1, channel2))
+
+  asyncio.run(run())
+
+
+def test_async_closed_connection(key_generators):
+
+  async def run():
+    channel1, channel2 = await create_channels(key_generators)
+    await channel1._data_source.close()
+    with pytest.raises(exceptions.NotEnoughDataInInput):
+      await channel2.receive_message()
+    await channel2._data_source.close()
+
+  asyncio.run(run())
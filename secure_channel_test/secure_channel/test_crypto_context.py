@@ -0,0 +1,245 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel
+from secure_channel.secure_channel import crypto_context, utils
+
+
+@pytest.fixture(params=[
+  utils.AES_GCM_CRYPTO_CONFIGURATION,
+  utils.CHACHA20_POLY1305_CRYPTO_CONFIGURATION,
+])
+def aead_configuration(request):
+  return request.param
+
+
+def create_channels(key_generators, crypto_configuration):
+  return tuple(
+    secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []),
+      key_generator=key_generator,
+      crypto_configration=crypto_configuration,
+    )
+    for key_generator in key_generators
+  )
+
+
+@pytest.fixture()
+def etm_channels(key_generators):
+  return create_channels(key_generators, utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION)
+
+
+@pytest.fixture()
+def aead_channels(key_generators, aead_configuration):
+  return create_channels(key_generators, aead_configuration)
+
+
+def connect_channels(channel_in, channel_out):
+  channel_out._data_source.in_messages = channel_in._data_source.out_messages
+
+
+def test_protocol_versions_are_unique():
+  versions = [
+    utils.CRYPTO_CONFIGURATION.protocol_version,
+    utils.AES_GCM_CRYPTO_CONFIGURATION.protocol_version,
+    utils.CHACHA20_POLY1305_CRYPTO_CONFIGURATION.protocol_version,
+    utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION.protocol_version,
+  ]
+  assert len(set(versions)) == len(versions)
+
+
+def test_create_crypto_context(alice_keys):
+  assert isinstance(
+    crypto_context.create_crypto_context(utils.CRYPTO_CONFIGURATION, alice_keys),
+    crypto_context.HmacCtrCryptoContext
+  )
+  assert isinstance(
+    crypto_context.create_crypto_context(utils.AES_GCM_CRYPTO_CONFIGURATION, alice_keys),
+    crypto_context.AeadCryptoContext
+  )
+
+
+def test_message_header(alice_keys):
+  context = crypto_context.create_crypto_context(utils.CRYPTO_CONFIGURATION, alice_keys)
+  header = context.message_header(1, 2)
+  assert header.startswith(b'\0' * 7 + b'\1')
+  assert header.endswith(b'\0' * 7 + b'\2')
+  assert context.serialized_details in header
+
+
+def test_aead_message_passing(aead_channels, srandom):
+  channel1, channel2 = aead_channels
+  # AEAD messages don't need to be a multiple of block size.
+  messages = [bytes(srandom.getrandbits(8) for __ in range(size)) for size in (0, 1, 17, 1000)]
+  for message in messages:
+    channel1.send_message(message)
+  for sent, message in zip(channel1._data_source.out_messages, messages):
+    assert len(sent.data) == len(message)
+    assert len(sent.hmac) == 16
+  connect_channels(channel1, channel2)
+  assert [channel2.receive_message() for __ in messages] == messages
+
+
+def test_aead_batch_message_passing(aead_channels, example_message):
+  channel1, channel2 = aead_channels
+  channel1.send_messages([example_message] * 3)
+  sent = channel1._data_source.out_messages
+  sent[1] = sent[1]._replace(hmac=bytes(16))
+  connect_channels(channel1, channel2)
+  received = channel2.receive_messages(10)
+  assert [r.data for r in received] == [example_message, None, example_message]
+  assert isinstance(received[1].error, exceptions.InvalidSignature)
+
+
+@pytest.mark.parametrize("tamper", ["data", "hmac", "short_hmac", "message_id"])
+def test_aead_rejects_tampered_message(aead_channels, example_message, tamper):
+  channel1, channel2 = aead_channels
+  channel1.send_message(example_message)
+  message = channel1._data_source.out_messages[0]
+  if tamper == "data":
+    data = bytearray(message.data)
+    data[0] ^= 1
+    message = message._replace(data=data)
+  elif tamper == "hmac":
+    hmac = bytearray(message.hmac)
+    hmac[0] ^= 1
+    message = message._replace(hmac=hmac)
+  elif tamper == "short_hmac":
+    message = message._replace(hmac=message.hmac[:-1])
+  else:
+    message = message._replace(message_id=message.message_id + 1)
+  channel2._data_source.in_messages = [message]
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message()
+
+
+def test_protocols_are_not_interchangeable(key_generators, example_message):
+  sender, receiver = [
+    secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []),
+      key_generator=key_generator,
+      crypto_configration=configuration,
+    )
+    for key_generator, configuration in zip(key_generators, (
+      utils.AES_GCM_CRYPTO_CONFIGURATION,
+      utils.CHACHA20_POLY1305_CRYPTO_CONFIGURATION,
+    ))
+  ]
+  sender.send_message(example_message)
+  connect_channels(sender, receiver)
+  with pytest.raises(exceptions.InvalidSignature):
+    receiver.receive_message()
+
+
+def test_etm_message_passing(etm_channels, srandom):
+  channel1, channel2 = etm_channels
+  messages = [bytes(srandom.getrandbits(8) for __ in range(16 * ii)) for ii in (1, 2, 40, 0)]
+  for message in messages:
+    channel1.send_message(message)
+  connect_channels(channel1, channel2)
+  assert [channel2.receive_message() for __ in messages] == messages
+
+
+def test_etm_hmac_covers_ciphertext(etm_channels, example_message):
+  channel1, __ = etm_channels
+  channel1.send_message(example_message)
+  message = channel1._data_source.out_messages[0]
+  context = channel1._crypto_context
+  hmac = context.create_send_hmac(message.message_id, len(message.data))
+  hmac.update(message.data)
+  assert message.hmac == hmac.finalize()
+  assert message.data != example_message
+
+
+def test_etm_rejects_before_decryption(etm_channels, example_message, monkeypatch):
+  channel1, channel2 = etm_channels
+  channel1.send_message(example_message)
+  message = channel1._data_source.out_messages[0]
+  data = bytearray(message.data)
+  data[0] ^= 1
+  channel2._data_source.in_messages = [message._replace(data=data)]
+
+  def fail(*args, **kwargs):
+    raise AssertionError("Forged message was decrypted")
+
+  def update_many(messages, direction):
+    assert not messages, "Forged message was decrypted"
+    return []
+
+  monkeypatch.setattr(channel2._crypto_context, "create_recv_cipher", fail)
+  monkeypatch.setattr(channel2._crypto_context.recv_cipher, "update_many", update_many)
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message()
+  channel2._data_source.in_messages = [message._replace(data=data)]
+  assert isinstance(channel2.receive_messages(1)[0].error, exceptions.InvalidSignature)
+
+
+@pytest.mark.parametrize("tamper", [
+  lambda m: m._replace(hmac=m.hmac[:-1]),
+  lambda m: m._replace(data=m.data[:-1]),
+  lambda m: m._replace(message_id=m.message_id + 1),
+])
+def test_etm_rejects_tampered_message(etm_channels, example_message, tamper):
+  channel1, channel2 = etm_channels
+  channel1.send_message(example_message)
+  channel2._data_source.in_messages = [tamper(channel1._data_source.out_messages[0])]
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message()
+
+
+def test_etm_batch_matches_single(key_generators, example_message):
+  batch, __ = create_channels(key_generators, utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION)
+  single, receiver = create_channels(key_generators, utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION)
+  batch.send_messages([example_message, example_message * 2])
+  single.send_message(example_message)
+  single.send_message(example_message * 2)
+  assert [(m.data, bytes(m.hmac)) for m in batch._data_source.out_messages] == \
+         [(m.data, bytes(m.hmac)) for m in single._data_source.out_messages]
+  sent = single._data_source.out_messages
+  sent[0] = sent[0]._replace(hmac=bytes(32))
+  connect_channels(single, receiver)
+  assert [r.data for r in receiver.receive_messages(5)] == [None, example_message * 2]
+
+
+@pytest.fixture(params=[
+  utils.CRYPTO_CONFIGURATION,
+  utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION,
+  utils.AES_GCM_CRYPTO_CONFIGURATION,
+])
+def any_channels(request, key_generators):
+  return create_channels(key_generators, request.param)
+
+
+@pytest.mark.parametrize("size", [0, 16, 1024])
+def test_open_into(any_channels, srandom, size):
+  sender, receiver = any_channels
+  data = bytes(srandom.getrandbits(8) for __ in range(size))
+  message = sender._crypto_context.seal(1, data)
+  output = bytearray(b'\xff' * (size + 10))
+  assert receiver._crypto_context.open_into(message, output) == size
+  assert output == data + b'\xff' * 10
+
+
+def test_open_into_invalid_message(any_channels, example_message):
+  sender, receiver = any_channels
+  message = sender._crypto_context.seal(1, example_message)
+  message = message._replace(data=bytes(len(message.data)))
+  output = bytearray(len(example_message))
+  with pytest.raises(exceptions.InvalidSignature):
+    receiver._crypto_context.open_into(message, output)
+  assert output == bytes(len(example_message))
+
+
+@pytest.mark.parametrize("chunk_size", [16, 1024])
+def test_etm_fused_chunks_match_two_pass(etm_channels, monkeypatch, srandom, chunk_size):
+  monkeypatch.setattr(crypto_context, "FUSED_CHUNK_SIZE", chunk_size)
+  channel1, channel2 = etm_channels
+  data = bytes(srandom.getrandbits(8) for __ in range(16 * 100))
+  context = channel1._crypto_context
+  message = context.seal(7, data)
+  ciphertext = context.create_send_cipher(7).update(data)
+  hmac = context.create_send_hmac(7, len(data))
+  hmac.update(ciphertext)
+  assert (message.data, message.hmac) == (ciphertext, hmac.finalize())
+  assert channel2._crypto_context.open(message) == data
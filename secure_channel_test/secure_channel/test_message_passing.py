@@ -1,12 +1,14 @@
 # pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
 
-import pytest
+import socket
+import tracemalloc
 
+import pytest
 
-@pytest.fixture()
-def example_message():
-  return b'\x10.A\x7f\x1d.\xdf3\x9cTd;\xa7\xd9\x8c\x1d\xe4' \
-         b'\x11\xa3Q,\x9b\xbe\xd1m\xb3d\xed\xa3\xd0\xb63'
+from secure_channel import (
+  api, codec, data_source, exceptions, key_negotiation, primitives, secure_channel, session_state
+)
+from secure_channel.secure_channel import crypto_context
 
 
 def connect_channels(channel_in, channel_out):
@@ -33,3 +35,344 @@ def test_single_message_two_way_encryption(channels, example_message):
 #   data = channel2.recv_message()
 #   assert data == random_data_for_tests
 
+
+
+def test_many_messages_two_way_encryption(channels, srandom):
+  channel1, channel2 = channels
+  messages = [
+    bytes(srandom.getrandbits(8) for __ in range(16 * block_count))
+    for block_count in [1, 2, 31, 32, 33, 100, 1]
+  ]
+  for message in messages:
+    channel1.send_message(message)
+  connect_channels(channel1, channel2)
+  assert messages == [channel2.receive_message() for __ in messages]
+
+
+def test_crypto_context_is_reused(channel, example_message):
+  context = channel._crypto_context
+  channel.send_message(example_message)
+  channel.send_message(example_message)
+  assert channel._crypto_context is context
+
+
+def reference_encrypt(channel, message_id, data):
+  """Encrypts message building every primitive from scratch."""
+  import pickle
+  from secure_channel.primitives import BACKEND, Direction
+  from secure_channel.primitives.utils import format_counter
+  from secure_channel.secure_channel import utils
+
+  keys = channel._session_state.get_extended_keys()
+  details = pickle.dumps(utils.CryptoDetailsSerializedForm(channel._crypto_config))
+  hmac = BACKEND.create_hmac(keys.send_sign_key, "SHA-256")
+  for part in [
+      format_counter(message_id), format_counter(len(details)), details,
+      format_counter(len(data)), data
+  ]:
+    hmac.update(part)
+  cipher = BACKEND.create_cipher_mode(
+    key=keys.send_encryption_key, ctr=message_id, cipher="AES", direction=Direction.ENCRYPT
+  )
+  return cipher.update(data), cipher.update(cipher.pad(hmac.finalize()))
+
+
+@pytest.mark.parametrize("block_count", [1, 32, 100])
+def test_message_matches_reference_encoding(channel, block_count):
+  data = bytes(range(16)) * block_count
+  channel.send_message(data)
+  message = channel._data_source.out_messages[-1]
+  assert (message.data, message.hmac) == reference_encrypt(channel, message.message_id, data)
+
+
+def test_message_passing_through_codec(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_message(example_message)
+  frames = [
+    codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+    for message in channel1._data_source.out_messages
+  ]
+  channel2._data_source.in_messages = [
+    codec.decode_message(frame, api.DEFAULT_CONFIGURATION) for frame in frames
+  ]
+  assert example_message == channel2.receive_message()
+
+
+def test_message_passing_over_socket(key_generators, srandom):
+
+  left, right = socket.socketpair()
+  try:
+    channel1, channel2 = [
+      secure_channel.SecureChannel(
+        data_source=data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, sock, timeout=5),
+        key_generator=key_generator
+      )
+      for sock, key_generator in zip((left, right), key_generators)
+    ]
+    messages = [bytes(srandom.getrandbits(8) for __ in range(16 * ii)) for ii in (1, 64, 3)]
+    for message in messages:
+      channel1.send_message(message)
+    assert messages == [channel2.receive_message() for __ in messages]
+  finally:
+    left.close()
+    right.close()
+
+
+def test_batch_message_passing(channels, srandom):
+  channel1, channel2 = channels
+  messages = [bytes(srandom.getrandbits(8) for __ in range(16 * ii)) for ii in range(1, 10)]
+  channel1.send_messages(messages)
+  sent = channel1._data_source.out_messages
+  assert [m.message_id for m in sent] == list(range(1, 10))
+  connect_channels(channel1, channel2)
+  received = channel2.receive_messages(5) + channel2.receive_messages(5)
+  assert [r.data for r in received] == messages
+  assert [r.message_id for r in received] == list(range(1, 10))
+  assert all(r.error is None for r in received)
+
+
+def test_batch_reports_invalid_message(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_messages([example_message] * 4)
+  sent = channel1._data_source.out_messages
+  tampered = bytearray(sent[1].data)
+  tampered[0] ^= 1
+  sent[1] = sent[1]._replace(data=tampered)
+  # Replay of first message
+  sent.append(sent[0])
+  connect_channels(channel1, channel2)
+  received = channel2.receive_messages(10)
+  assert [r.data for r in received] == [
+    example_message, None, example_message, example_message, None
+  ]
+  assert isinstance(received[1].error, exceptions.InvalidSignature)
+  assert isinstance(received[4].error, exceptions.RecvMessageOutOfSequence)
+
+
+def test_invalid_hmac_padding(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_message(example_message)
+  message = channel1._data_source.out_messages[0]
+  tampered = bytearray(message.hmac)
+  tampered[-1] ^= 0xff
+  channel2._data_source.in_messages = [message._replace(hmac=tampered)]
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message()
+
+
+def test_batch_matches_single_messages(key_generators, srandom):
+
+  def create_channel():
+    return secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []),
+      key_generator=key_generators[0]
+    )
+
+  batch, single = create_channel(), create_channel()
+  messages = [bytes(srandom.getrandbits(8) for __ in range(16 * ii)) for ii in (1, 2, 40, 3)]
+  batch.send_messages(messages)
+  for message in messages:
+    single.send_message(message)
+  assert [
+    (m.message_id, bytes(m.data), bytes(m.hmac)) for m in batch._data_source.out_messages
+  ] == [
+    (m.message_id, bytes(m.data), bytes(m.hmac)) for m in single._data_source.out_messages
+  ]
+
+
+def test_batch_reports_invalid_block_length(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_messages([example_message] * 3)
+  sent = channel1._data_source.out_messages
+  sent[1] = sent[1]._replace(hmac=sent[1].hmac[:-1])
+  connect_channels(channel1, channel2)
+  received = channel2.receive_messages(10)
+  assert [r.data for r in received] == [example_message, None, example_message]
+  assert isinstance(received[1].error, exceptions.InvalidSignature)
+
+
+def test_invalid_block_length(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_message(example_message)
+  message = channel1._data_source.out_messages[0]
+  channel2._data_source.in_messages = [message._replace(data=message.data[:-1])]
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message()
+
+
+def test_reordered_messages_with_windowed_session_state(session_key, srandom):
+  alice, bob = [
+    secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []),
+      key_generator=key_negotiation.TestSessionKeyNegotiator(
+        session_key, side, session_state_factory=session_state.WindowedSessionState
+      )
+    )
+    for side in (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+  ]
+  messages = [bytes([ii]) * 16 for ii in range(10)]
+  for message in messages:
+    alice.send_message(message)
+  sent = list(zip(alice._data_source.out_messages, messages))
+  srandom.shuffle(sent)
+  bob._data_source.in_messages = [message for message, __ in sent]
+  assert [data for __, data in sent] == [bob.receive_message() for __ in sent]
+  bob._data_source.in_messages = [sent[0][0]]
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    bob.receive_message()
+
+
+def test_message_passing_over_udp(key_generators, srandom):
+  sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for __ in range(2)]
+  for sock in sockets:
+    sock.bind(("127.0.0.1", 0))
+  sockets[0].connect(sockets[1].getsockname())
+  sockets[1].connect(sockets[0].getsockname())
+  config = data_source.datagram_configuration()
+  alice, bob = [
+    secure_channel.SecureChannel(
+      data_source=data_source.DatagramDataSource(config, sock, timeout=5),
+      key_generator=key_generator,
+      configuration=config
+    )
+    for sock, key_generator in zip(sockets, key_generators)
+  ]
+  messages = [bytes(srandom.getrandbits(8) for __ in range(size)) for size in [16, 1024, 1376]]
+  try:
+    alice.send_messages(messages)
+    assert [bob.receive_message() for __ in messages] == messages
+  finally:
+    for sock in sockets:
+      sock.close()
+
+
+def test_receive_message_into(channels, srandom):
+  channel1, channel2 = channels
+  messages = [bytes(srandom.getrandbits(8) for __ in range(size)) for size in [16, 1024, 0]]
+  channel1.send_messages(messages)
+  connect_channels(channel1, channel2)
+  buffer = bytearray(2048)
+  for message in messages:
+    size = channel2.receive_message_into(buffer)
+    assert buffer[:size] == message
+
+
+def test_receive_message_into_small_buffer(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_message(example_message)
+  connect_channels(channel1, channel2)
+  with pytest.raises(ValueError):
+    channel2.receive_message_into(bytearray(len(example_message) - 1))
+
+
+def test_receive_message_into_replayed(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_message(example_message)
+  message, = channel1._data_source.out_messages
+  channel2._data_source.in_messages = [message, message]
+  buffer = bytearray(len(example_message))
+  channel2.receive_message_into(buffer)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    channel2.receive_message_into(buffer)
+  assert buffer == bytes(len(buffer))
+
+
+def test_receive_message_lease(channels, example_message):
+  channel1, channel2 = channels
+  channel1.send_messages([example_message, example_message])
+  message = channel1._data_source.out_messages[0]
+  channel2._data_source.in_messages = channel1._data_source.out_messages + [message]
+  with channel2.receive_message_lease() as lease:
+    assert lease.view == example_message
+  assert channel2.buffer_pool.free_buffers == 1
+  with channel2.receive_message_lease() as lease:
+    assert lease.view == example_message
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    channel2.receive_message_lease()
+  assert channel2.buffer_pool.free_buffers == 1
+
+
+def test_receive_message_into_does_not_allocate(key_generators, srandom):
+  # Steady state receiving over a socket allocates nothing close to message size.
+  left, right = socket.socketpair()
+  try:
+    sender, receiver = [
+      secure_channel.SecureChannel(
+        data_source=data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, sock, timeout=5),
+        key_generator=key_generator
+      )
+      for sock, key_generator in zip((left, right), key_generators)
+    ]
+    message = bytes(srandom.getrandbits(8) for __ in range(32 * 1024))
+    buffer = bytearray(len(message))
+    for __ in range(3):
+      sender.send_messages([message, message])
+      receiver.receive_message_into(buffer)
+      with receiver.receive_message_lease():
+        pass
+    sender.send_messages([message] * 2)
+    tracemalloc.start()
+    try:
+      assert receiver.receive_message_into(buffer) == len(message)
+      with receiver.receive_message_lease() as lease:
+        assert lease.view == message
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+    assert buffer == message
+    assert peak < len(message) // 4
+  finally:
+    left.close()
+    right.close()
+
+
+@pytest.mark.parametrize("chunk_size", [16, 48, 1024])
+@pytest.mark.parametrize("block_count", [1, 3, 64, 100])
+def test_fused_chunks_match_reference_encoding(channels, monkeypatch, chunk_size, block_count):
+  monkeypatch.setattr(crypto_context, "FUSED_CHUNK_SIZE", chunk_size)
+  channel1, channel2 = channels
+  data = bytes(range(16)) * block_count
+  channel1.send_message(data)
+  message = channel1._data_source.out_messages[-1]
+  assert (message.data, message.hmac) == reference_encrypt(channel1, message.message_id, data)
+  connect_channels(channel1, channel2)
+  assert channel2.receive_message() == data
+
+
+@pytest.mark.parametrize("chunk_size", [16, 1024])
+def test_fused_chunks_reject_tampered_message(channels, monkeypatch, chunk_size):
+  monkeypatch.setattr(crypto_context, "FUSED_CHUNK_SIZE", chunk_size)
+  channel1, channel2 = channels
+  channel1.send_message(bytes(16 * 10))
+  message = channel1._data_source.out_messages[-1]
+  data = bytearray(message.data)
+  data[-1] ^= 1
+  channel2._data_source.in_messages = [message._replace(data=data)]
+  buffer = bytearray(len(data))
+  with pytest.raises(exceptions.InvalidSignature):
+    channel2.receive_message_into(buffer)
+  assert buffer == bytes(len(data))
+
+
+@pytest.fixture()
+def parallel_encryption():
+  primitives.configure_parallel_encryption(1024)
+  yield
+  primitives.configure_parallel_encryption()
+
+
+@pytest.mark.usefixtures("parallel_encryption")
+def test_parallel_encryption_matches_reference_encoding(channels, monkeypatch, srandom):
+  from secure_channel.primitives import pycrypto_backend
+  monkeypatch.setattr(pycrypto_backend, "MIN_SEGMENT_BYTES", 64)
+  monkeypatch.setattr(pycrypto_backend.os, "cpu_count", lambda: 4)
+  channel1, channel2 = channels
+  for channel in channels:
+    for cipher in (channel._crypto_context.send_cipher, channel._crypto_context.recv_cipher):
+      assert cipher.parallel_threshold_bytes == 1024
+  data = bytes(srandom.getrandbits(8) for __ in range(16 * 1000))
+  channel1.send_message(data)
+  message = channel1._data_source.out_messages[-1]
+  assert (message.data, message.hmac) == reference_encrypt(channel1, message.message_id, data)
+  connect_channels(channel1, channel2)
+  assert channel2.receive_message() == data
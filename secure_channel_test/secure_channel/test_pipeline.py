@@ -0,0 +1,299 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import concurrent.futures
+import socket
+import threading
+import time
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel
+from secure_channel.secure_channel import precheck
+
+
+def connect_channels(channel_in, channel_out):
+  channel_out._data_source.in_messages = channel_in._data_source.out_messages
+
+
+def make_data(thread, index):
+  return bytes([thread, index]) * 16
+
+
+def assert_ids_increasing(channel):
+  message_ids = [message.message_id for message in channel._data_source.out_messages]
+  assert message_ids == sorted(message_ids)
+  assert len(set(message_ids)) == len(message_ids)
+
+
+def test_concurrent_send_message(channels):
+  sender, receiver = channels
+  barrier = threading.Barrier(8)
+
+  def produce(thread):
+    barrier.wait()
+    for index in range(50):
+      sender.send_message(make_data(thread, index))
+
+  threads = [threading.Thread(target=produce, args=(thread, )) for thread in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert_ids_increasing(sender)
+  connect_channels(sender, receiver)
+  received = [receiver.receive_message() for __ in range(8 * 50)]
+  for thread in range(8):
+    # Messages of each producer are received in the order they were sent.
+    assert [data for data in received if data[0] == thread] == [
+      make_data(thread, index) for index in range(50)
+    ]
+
+
+def test_concurrent_send_messages(channels):
+  sender, receiver = channels
+
+  def produce(thread):
+    for index in range(0, 40, 4):
+      sender.send_messages([make_data(thread, index + offset) for offset in range(4)])
+
+  with concurrent.futures.ThreadPoolExecutor(4) as executor:
+    list(executor.map(produce, range(4)))
+  assert_ids_increasing(sender)
+  connect_channels(sender, receiver)
+  assert len([receiver.receive_message() for __ in range(4 * 40)]) == 4 * 40
+
+
+def test_pipeline_submission_order(channels):
+  sender, receiver = channels
+  data = [make_data(0, index) for index in range(100)]
+  with concurrent.futures.ThreadPoolExecutor(4) as executor:
+    pipeline = sender.open_send_pipeline(executor, max_pending=8)
+    futures = [pipeline.submit(message) for message in data]
+    concurrent.futures.wait(futures)
+    pipeline.send_message(b'last message....')
+    pipeline.close()
+  assert all(future.result() is None for future in futures)
+  assert_ids_increasing(sender)
+  connect_channels(sender, receiver)
+  assert [receiver.receive_message() for __ in data] == data
+  assert receiver.receive_message() == b'last message....'
+
+
+def test_pipeline_own_executor(channels, example_message):
+  sender, receiver = channels
+  with sender.open_send_pipeline() as pipeline:
+    futures = [pipeline.submit(example_message) for __ in range(10)]
+  assert all(future.done() for future in futures)
+  connect_channels(sender, receiver)
+  assert [receiver.receive_message() for __ in range(10)] == [example_message] * 10
+
+
+def test_out_of_order_completion(channel, example_message):
+  sequencer = channel._send_utils.sequencer
+  first = sequencer.reserve(1)
+  second = sequencer.reserve(2)
+  sequencer.seal(second, [example_message, example_message])
+  assert not channel._data_source.out_messages
+  assert not second.future.done()
+  sequencer.seal(first, [example_message])
+  assert [message.message_id for message in channel._data_source.out_messages] == [
+    first.message_ids[0], *second.message_ids
+  ]
+  assert first.future.result() is None
+  assert second.future.result() is None
+
+
+class SealError(Exception):
+  pass
+
+
+def test_seal_error_does_not_block_others(channel, example_message, monkeypatch):
+  context = channel._crypto_context
+  seal = context.seal
+
+  def failing_seal(message_id, data):
+    if data == b'fail':
+      raise SealError()
+    return seal(message_id, data)
+
+  monkeypatch.setattr(context, "seal", failing_seal)
+  sequencer = channel._send_utils.sequencer
+  failing = sequencer.reserve(1)
+  sequencer.seal(failing, [b'fail'])
+  with pytest.raises(SealError):
+    failing.future.result()
+  channel.send_message(example_message)
+  assert len(channel._data_source.out_messages) == 1
+  with pytest.raises(SealError):
+    channel.send_message(b'fail')
+
+
+def test_write_error(channel, example_message, monkeypatch):
+
+  def failing_write(messages):
+    raise OSError("broken pipe")
+
+  monkeypatch.setattr(channel._data_source, "write_many", failing_write)
+  with pytest.raises(OSError):
+    channel.send_message(example_message)
+  with channel.open_send_pipeline() as pipeline:
+    future = pipeline.submit(example_message)
+  with pytest.raises(OSError):
+    future.result()
+
+
+def test_pipeline_reserve_error_releases_slot(channel, example_message, monkeypatch):
+
+  def exhausted():
+    raise exceptions.NeedToRenegotiateKey()
+
+  with channel.open_send_pipeline(max_pending=1) as pipeline:
+    with monkeypatch.context() as patch:
+      patch.setattr(channel._session_state, "get_send_message_number", exhausted)
+      with pytest.raises(exceptions.NeedToRenegotiateKey):
+        pipeline.submit(example_message)
+    pipeline.send_message(example_message)
+  assert len(channel._data_source.out_messages) == 1
+
+
+def test_submit_after_close(channel, example_message):
+  pipeline = channel.open_send_pipeline()
+  pipeline.close()
+  with pytest.raises(ValueError):
+    pipeline.submit(example_message)
+  channel.send_message(example_message)
+  assert len(channel._data_source.out_messages) == 1
+
+
+def test_executor_error_does_not_block_others(channel, example_message):
+  executor = concurrent.futures.ThreadPoolExecutor(1)
+  executor.shutdown()
+  pipeline = channel.open_send_pipeline(executor)
+  with pytest.raises(RuntimeError):
+    pipeline.submit(example_message)
+  # Failed submit doesn't block later sends.
+  channel.send_message(example_message)
+  assert len(channel._data_source.out_messages) == 1
+  pipeline.close()
+
+
+def test_close_waits_for_submitted_messages(channel, example_message, monkeypatch):
+  started = threading.Event()
+  release = threading.Event()
+
+  def slow_seal(ticket, data):
+    started.set()
+    release.wait()
+    sequencer.complete(ticket, error=SealError())
+
+  sequencer = channel._send_utils.sequencer
+  with concurrent.futures.ThreadPoolExecutor(2) as executor:
+    pipeline = channel.open_send_pipeline(executor)
+    with monkeypatch.context() as patch:
+      patch.setattr(sequencer, "seal", slow_seal)
+      future = pipeline.submit(example_message)
+    started.wait()
+    closing = executor.submit(pipeline.close)
+    time.sleep(0.05)
+    assert not closing.done()
+    release.set()
+    closing.result()
+    assert future.done()
+    # Executor of the caller is left running.
+    assert executor.submit(lambda: 1).result() == 1
+
+
+def send_data(sender, count):
+  data = [make_data(0, index) for index in range(count)]
+  sender.send_messages(data)
+  return data
+
+
+def test_receive_pipeline(channels):
+  sender, receiver = channels
+  data = send_data(sender, 100)
+  connect_channels(sender, receiver)
+  with receiver.open_receive_pipeline(max_pending=4) as pipeline:
+    assert [pipeline.receive_message() for __ in data] == data
+    # Reader stopped on empty test data source, error is raised every time.
+    for __ in range(2):
+      with pytest.raises(IndexError):
+        pipeline.receive_message()
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    receiver._session_state.verify_recv_message_number(99)
+
+
+def test_receive_pipeline_invalid_messages(channels):
+  sender, receiver = channels
+  send_data(sender, 3)
+  first, second, third = sender._data_source.out_messages
+  forged = second._replace(data=bytes(len(second.data)))
+  receiver._data_source.in_messages = [first, first, forged, second, third]
+  with concurrent.futures.ThreadPoolExecutor(2) as executor:
+    pipeline = receiver.open_receive_pipeline(executor)
+    assert pipeline.receive_message() == make_data(0, 0)
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      pipeline.receive_message()
+    with pytest.raises(exceptions.InvalidSignature):
+      pipeline.receive_message()
+    # Forged message didn't update session state.
+    assert pipeline.receive_message() == make_data(0, 1)
+    assert pipeline.receive_message() == make_data(0, 2)
+    pipeline.close()
+
+
+def test_receive_pipeline_precheck(channel_sources, key_generators):
+  sender = secure_channel.SecureChannel(channel_sources[0], key_generators[0])
+  receiver = secure_channel.SecureChannel(
+    channel_sources[1], key_generators[1], recv_precheck=True
+  )
+  send_data(sender, 2)
+  first, second = sender._data_source.out_messages
+  receiver._session_state.verify_recv_message_number(first.message_id)
+  receiver._data_source.in_messages = [first, second]
+  with receiver.open_receive_pipeline() as pipeline:
+    assert pipeline.receive_message() == make_data(0, 1)
+  assert receiver.dropped_messages[precheck.DropReason.REPLAYED] == 1
+
+
+def test_receive_pipeline_backpressure(channels):
+  sender, receiver = channels
+  send_data(sender, 100)
+  connect_channels(sender, receiver)
+  pipeline = receiver.open_receive_pipeline(max_pending=2)
+  assert pipeline.receive_message() == make_data(0, 0)
+  time.sleep(0.1)
+  # Two messages queued, and one read and waiting for space in the queue.
+  assert len(receiver._data_source.in_messages) >= 100 - 4
+  pipeline.close()
+  with pytest.raises(ValueError):
+    pipeline.receive_message()
+
+
+def test_receive_pipeline_over_socket(key_generators, srandom):
+  left, right = socket.socketpair()
+  try:
+    sender, receiver = [
+      secure_channel.SecureChannel(
+        data_source=data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, sock, timeout=5),
+        key_generator=key_generator
+      )
+      for sock, key_generator in zip((left, right), key_generators)
+    ]
+    data = [bytes(srandom.getrandbits(8) for __ in range(16 * size)) for size in range(1, 50)]
+
+    def send():
+      for message in data:
+        sender.send_message(message)
+      left.shutdown(socket.SHUT_WR)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    with receiver.open_receive_pipeline(max_pending=8) as pipeline:
+      assert [pipeline.receive_message() for __ in data] == data
+      with pytest.raises(exceptions.NotEnoughDataInInput):
+        pipeline.receive_message()
+    thread.join()
+  finally:
+    left.close()
+    right.close()
@@ -0,0 +1,126 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import asyncio
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel
+from secure_channel.secure_channel.precheck import DropReason
+
+
+CONFIGURATION = api.ChannelConfiguration(max_message_size_bytes=64, max_messages_in_session=100)
+
+
+@pytest.fixture()
+def prechecked_channels(key_generators):
+  return tuple(
+    secure_channel.SecureChannel(
+      data_source=data_source.TestDataSource(CONFIGURATION, []),
+      key_generator=key_generator,
+      configuration=CONFIGURATION,
+      recv_precheck=True,
+    )
+    for key_generator in key_generators
+  )
+
+
+def send(channel, data, count=1):
+  for __ in range(count):
+    channel.send_message(data)
+  return list(channel._data_source.out_messages)
+
+
+def expected_drops(**counts):
+  result = {reason: 0 for reason in DropReason}
+  result.update({DropReason[name]: count for name, count in counts.items()})
+  return result
+
+
+def test_precheck_drops_replayed_messages(prechecked_channels, example_message):
+  sender, receiver = prechecked_channels
+  first, second = send(sender, example_message, 2)
+  receiver._data_source.in_messages = [first, first, first, second]
+  assert receiver.receive_message() == example_message
+  assert receiver.receive_message() == example_message
+  assert receiver.dropped_messages == expected_drops(REPLAYED=2)
+
+
+def test_precheck_drops_too_large_messages(prechecked_channels, example_message):
+  sender, receiver = prechecked_channels
+  message, = send(sender, example_message)
+  too_large = message._replace(data=bytes(CONFIGURATION.max_message_size_bytes + 16))
+  receiver._data_source.in_messages = [too_large, message]
+  assert receiver.receive_message() == example_message
+  assert receiver.dropped_messages == expected_drops(TOO_LARGE=1)
+
+
+def test_precheck_drops_messages_beyond_session(prechecked_channels, example_message):
+  sender, receiver = prechecked_channels
+  message, = send(sender, example_message)
+  beyond = message._replace(message_id=CONFIGURATION.max_messages_in_session)
+  receiver._data_source.in_messages = [beyond, message]
+  assert receiver.receive_message() == example_message
+  assert receiver.dropped_messages == expected_drops(BEYOND_SESSION=1)
+
+
+def test_precheck_does_not_update_state(prechecked_channels, example_message):
+  sender, receiver = prechecked_channels
+  message, = send(sender, example_message)
+  # Forged message with high id passes pre-check, but must not move low-water mark.
+  forged = message._replace(message_id=50)
+  receiver._data_source.in_messages = [forged, message]
+  with pytest.raises(exceptions.InvalidSignature):
+    receiver.receive_message()
+  assert receiver.receive_message() == example_message
+
+
+def test_precheck_batch(prechecked_channels, example_message):
+  sender, receiver = prechecked_channels
+  first, second = send(sender, example_message, 2)
+  receiver._data_source.in_messages = [first]
+  assert [r.data for r in receiver.receive_messages(5)] == [example_message]
+  receiver._data_source.in_messages = [first, first]
+  assert receiver.receive_messages(5) == []
+  receiver._data_source.in_messages = [first, second]
+  assert [r.message_id for r in receiver.receive_messages(5)] == [second.message_id]
+  assert receiver.dropped_messages == expected_drops(REPLAYED=3)
+
+
+def test_precheck_disabled(channels, example_message):
+  sender, receiver = channels
+  message, = send(sender, example_message)
+  receiver._data_source.in_messages = [message, message]
+  receiver.receive_message()
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    receiver.receive_message()
+  assert receiver.dropped_messages == expected_drops()
+
+
+class QueueDataSource(api.AsyncDataSource):
+
+  def __init__(self, messages):
+    super().__init__(CONFIGURATION)
+    self.messages = list(messages)
+
+  async def read(self):
+    return self.messages.pop(0)
+
+  async def write(self, message):  # pylint: disable=arguments-differ
+    self.messages.append(message)  # pragma: no cover
+
+
+def test_precheck_async(prechecked_channels, key_generators, example_message):
+  sender, __ = prechecked_channels
+  first, second = send(sender, example_message, 2)
+  receiver = secure_channel.AsyncSecureChannel(
+    data_source=QueueDataSource([first, first, second]),
+    key_generator=key_generators[1],
+    configuration=CONFIGURATION,
+    recv_precheck=True,
+  )
+
+  async def run():
+    return [await receiver.receive_message() for __ in range(2)]
+
+  assert asyncio.run(run()) == [example_message, example_message]
+  assert receiver.dropped_messages == expected_drops(REPLAYED=1)
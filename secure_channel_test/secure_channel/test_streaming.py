@@ -0,0 +1,310 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import gc
+import io
+import shutil
+import struct
+
+import pytest
+
+from secure_channel import exceptions
+from secure_channel.secure_channel import streaming
+
+
+def connect_channels(channel_in, channel_out):
+  channel_out._data_source.in_messages = channel_in._data_source.out_messages
+
+
+def send_stream(channel, data, chunk_size=64, write_size=None):
+  with channel.open_send_stream(chunk_size=chunk_size) as stream:
+    if write_size is None:
+      stream.write(data)
+    else:
+      for position in range(0, len(data), write_size):
+        stream.write(data[position:position + write_size])
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 63, 64, 65, 200, 1000])
+@pytest.mark.parametrize("write_size", [None, 1, 7, 64, 100])
+def test_stream_round_trip(channels, srandom, size, write_size):
+  sender, receiver = channels
+  data = bytes(srandom.getrandbits(8) for __ in range(size))
+  send_stream(sender, data, write_size=write_size)
+  connect_channels(sender, receiver)
+  stream = receiver.open_receive_stream()
+  assert stream.readall() == data
+  assert stream.finished
+
+
+def test_stream_record_count(channels):
+  sender, __ = channels
+  send_stream(sender, bytes(200))
+  # Four chunks and end of stream record.
+  assert len(sender._data_source.out_messages) == 5
+
+
+def test_stream_copyfileobj(channels, srandom):
+  sender, receiver = channels
+  data = bytes(srandom.getrandbits(8) for __ in range(10000))
+  with sender.open_send_stream(chunk_size=1024) as stream:
+    assert stream.chunk_size == 1024
+    assert stream.writable()
+    shutil.copyfileobj(io.BytesIO(data), stream)
+  connect_channels(sender, receiver)
+  result = io.BytesIO()
+  with receiver.open_receive_stream() as stream:
+    assert stream.readable()
+    shutil.copyfileobj(stream, result)
+  assert result.getvalue() == data
+
+
+def test_stream_close_twice(channels):
+  sender, __ = channels
+  stream = sender.open_send_stream()
+  stream.close()
+  stream.close()
+  assert len(sender._data_source.out_messages) == 1
+  with pytest.raises(ValueError):
+    stream.write(b'data')
+
+
+def test_stream_messages_after_stream(channels, example_message):
+  sender, receiver = channels
+  send_stream(sender, b'stream data')
+  sender.send_message(example_message)
+  connect_channels(sender, receiver)
+  assert receiver.open_receive_stream().readall() == b'stream data'
+  assert receiver.receive_message() == example_message
+
+
+class FailingHeader(object):
+  size = streaming.RECORD_HEADER.size
+
+  def pack_into(self, *args):
+    raise struct.error("header")
+
+
+def test_stream_record_error_does_not_block_channel(channel, example_message, monkeypatch):
+  stream = channel.open_send_stream(chunk_size=64)
+  with monkeypatch.context() as patch:
+    patch.setattr(streaming, "RECORD_HEADER", FailingHeader())
+    with pytest.raises(struct.error):
+      stream.write(bytes(64))
+  channel.send_message(example_message)
+  assert len(channel._data_source.out_messages) == 1
+
+
+def read_stream_from(receiver, messages):
+  receiver._data_source.in_messages = messages
+  return receiver.open_receive_stream().readall()
+
+
+def test_stream_truncated(channels, example_message):
+  sender, receiver = channels
+  send_stream(sender, bytes(200))
+  sender.send_message(example_message)
+  messages = sender._data_source.out_messages
+  # End of stream record is dropped.
+  with pytest.raises(exceptions.MalformedStream):
+    read_stream_from(receiver, messages[:-2] + messages[-1:])
+
+
+class StreamError(Exception):
+  pass
+
+
+def read_aborted_stream(sender, receiver, example_message):
+  sender.send_message(example_message)
+  connect_channels(sender, receiver)
+  stream = receiver.open_receive_stream()
+  assert stream.read(64) == bytes(64)
+  with pytest.raises(exceptions.MalformedStream):
+    stream.read()
+  assert not stream.finished
+
+
+def test_stream_aborted_by_exception(channels, example_message):
+  sender, receiver = channels
+  with pytest.raises(StreamError):
+    with sender.open_send_stream(chunk_size=64) as stream:
+      stream.write(bytes(100))
+      raise StreamError()
+  assert stream.closed
+  # Only the first chunk was sent.
+  assert len(sender._data_source.out_messages) == 1
+  read_aborted_stream(sender, receiver, example_message)
+
+
+def test_stream_garbage_collected(channels, example_message):
+  sender, receiver = channels
+  stream = sender.open_send_stream(chunk_size=64)
+  stream.write(bytes(100))
+  del stream
+  gc.collect()
+  assert len(sender._data_source.out_messages) == 1
+  read_aborted_stream(sender, receiver, example_message)
+
+
+def test_stream_closed_while_handling_exception(channels):
+  sender, receiver = channels
+  stream = sender.open_send_stream(chunk_size=64)
+  stream.write(bytes(100))
+  try:
+    raise StreamError()
+  except StreamError:
+    # Unrelated exception doesn't change what close does.
+    stream.close()
+  assert stream.closed
+  assert len(sender._data_source.out_messages) == 3
+  connect_channels(sender, receiver)
+  assert receiver.open_receive_stream().readall() == bytes(100)
+
+
+def test_stream_aborted_explicitly(channels, example_message):
+  sender, receiver = channels
+  stream = sender.open_send_stream(chunk_size=64)
+  stream.write(bytes(100))
+  stream.abort()
+  stream.close()
+  assert len(sender._data_source.out_messages) == 1
+  read_aborted_stream(sender, receiver, example_message)
+
+
+def test_stream_failed_finish(channel, monkeypatch):
+
+  def failing_write(messages):
+    raise OSError("broken pipe")
+
+  stream = channel.open_send_stream(chunk_size=64)
+  stream.write(b'data')
+  monkeypatch.setattr(channel._data_source, "write_many", failing_write)
+  with pytest.raises(OSError):
+    stream.finish()
+  assert stream.closed
+
+
+def test_stream_dropped_record(channels):
+  sender, receiver = channels
+  send_stream(sender, bytes(200))
+  messages = sender._data_source.out_messages
+  with pytest.raises(exceptions.MalformedStream):
+    read_stream_from(receiver, messages[:1] + messages[2:])
+
+
+def test_stream_missing_first_record(channels):
+  sender, receiver = channels
+  send_stream(sender, bytes(200))
+  with pytest.raises(exceptions.MalformedStream):
+    read_stream_from(receiver, sender._data_source.out_messages[1:])
+
+
+def test_stream_record_from_other_stream(channels):
+  sender, receiver = channels
+  send_stream(sender, bytes(100))
+  first = sender._data_source.out_messages[:]
+  send_stream(sender, bytes(100))
+  second = sender._data_source.out_messages[len(first):]
+  with pytest.raises(exceptions.MalformedStream):
+    read_stream_from(receiver, first[:1] + second[1:])
+
+
+def make_record(record_type, stream_id, index, length, payload=b''):
+  return streaming.RECORD_HEADER.pack(record_type, stream_id, index, length) + payload
+
+
+@pytest.mark.parametrize("records", [
+  # Too short for record header
+  [bytes(16)],
+  # Unknown record type
+  [make_record(5, 1, 0, 0)],
+  # Length larger than payload
+  [make_record(streaming.RECORD_CHUNK, 1, 0, 17, bytes(16))],
+  # Wrong total length
+  [
+    make_record(streaming.RECORD_CHUNK, 1, 0, 16, bytes(16)),
+    make_record(streaming.RECORD_END, 1, 1, 15),
+  ],
+])
+def test_stream_malformed_records(channels, records):
+  sender, receiver = channels
+  for record in records:
+    sender.send_message(record)
+  with pytest.raises(exceptions.MalformedStream):
+    read_stream_from(receiver, sender._data_source.out_messages)
+
+
+@pytest.mark.parametrize("size", [0, 100, 1000])
+@pytest.mark.parametrize("spill_threshold", [0, 64, 10000])
+def test_staged_stream(channels, srandom, size, spill_threshold):
+  sender, receiver = channels
+  data = bytes(srandom.getrandbits(8) for __ in range(size))
+  send_stream(sender, data)
+  connect_channels(sender, receiver)
+  with receiver.receive_staged_stream(spill_threshold=spill_threshold) as staged:
+    assert staged.in_memory == (size <= spill_threshold)
+    assert staged.size == size
+    assert staged.read() == data
+    with staged.view() as view:
+      assert view.readonly
+      assert view == data
+    # Released view doesn't affect the stream.
+    with staged.view() as view:
+      assert view == data
+    staged.seek(0)
+    assert staged.read() == data
+  assert staged.closed
+  staged.close()
+
+
+def test_staged_stream_seek(channels):
+  sender, receiver = channels
+  send_stream(sender, bytes(range(200)))
+  connect_channels(sender, receiver)
+  staged = receiver.receive_staged_stream(spill_threshold=0)
+  assert staged.readable() and staged.seekable()
+  assert staged.seek(10) == 10
+  assert staged.read(5) == bytes(range(10, 15))
+  assert staged.seek(-5, io.SEEK_CUR) == 10
+  assert staged.tell() == 10
+  assert staged.seek(-1, io.SEEK_END) == 199
+  assert staged.read() == bytes([199])
+  staged.seek(300)
+  assert staged.read() == b''
+  with pytest.raises(ValueError):
+    staged.seek(-1)
+  with pytest.raises(ValueError):
+    staged.seek(0, 5)
+  staged.close()
+
+
+class StagingSpy(streaming._Staging):
+
+  instances = []
+
+  def __init__(self, *args):
+    super().__init__(*args)
+    self.instances.append(self)
+    self.discarded = None
+
+  def discard(self):
+    self.discarded = self.file
+    super().discard()
+
+
+@pytest.mark.parametrize("spill_threshold", [0, 10000])
+def test_staged_stream_discarded_on_failure(channels, monkeypatch, tmpdir, spill_threshold):
+  monkeypatch.setattr(streaming, "_Staging", StagingSpy)
+  StagingSpy.instances.clear()
+  sender, receiver = channels
+  send_stream(sender, bytes(range(200)) * 3)
+  messages = sender._data_source.out_messages
+  receiver._data_source.in_messages = messages[:3] + messages[4:]
+  with pytest.raises(exceptions.MalformedStream):
+    receiver.receive_staged_stream(spill_threshold=spill_threshold, directory=str(tmpdir))
+  staging, = StagingSpy.instances
+  if spill_threshold:
+    assert staging.discarded is None
+    assert staging.buffer == bytes(len(staging.buffer))
+  else:
+    assert staging.discarded.closed
+  assert staging.size == 64 * 3
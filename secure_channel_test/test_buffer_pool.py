@@ -0,0 +1,70 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+
+import pytest
+
+from secure_channel import buffer_pool
+
+
+@pytest.fixture()
+def pool():
+  return buffer_pool.BufferPool(buffer_size=64, max_free_buffers=2)
+
+
+def test_lease_size(pool):
+  lease = pool.lease(10)
+  assert len(lease.view) == 10
+  assert not lease.released
+  assert pool.buffer_size == 64
+
+
+def test_lease_reuses_buffer(pool):
+  lease = pool.lease(10)
+  lease.view[:] = b'\xff' * 10
+  lease.release()
+  assert lease.released
+  assert pool.free_buffers == 1
+  with pool.lease(64) as second:
+    assert pool.free_buffers == 0
+    assert second.view == bytes(64)
+  assert pool.free_buffers == 1
+
+
+def test_release_zeroes_buffer(pool):
+  lease = pool.lease(64)
+  buffer = lease.view.obj
+  lease.view[:] = b'\xff' * 64
+  lease.release()
+  assert buffer == bytes(64)
+
+
+def test_release_twice(pool):
+  lease = pool.lease(10)
+  lease.release()
+  lease.release()
+  assert pool.free_buffers == 1
+  with pytest.raises(ValueError):
+    lease.view  # pylint: disable=pointless-statement
+
+
+def test_large_lease_not_pooled(pool):
+  lease = pool.lease(1000)
+  assert len(lease.view) == 1000
+  buffer = lease.view.obj
+  lease.view[:] = b'\xff' * 1000
+  lease.release()
+  assert buffer == bytes(1000)
+  assert pool.free_buffers == 0
+
+
+def test_max_free_buffers(pool):
+  leases = [pool.lease(1) for __ in range(3)]
+  for lease in leases:
+    lease.release()
+  assert pool.free_buffers == 2
+
+
+def test_clear_larger_than_zeros():
+  pool = buffer_pool.BufferPool(buffer_size=4)
+  buffer = bytearray(b'\xff' * 10)
+  pool.clear(memoryview(buffer))
+  assert buffer == bytes(10)
@@ -0,0 +1,88 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name, protected-access
+
+import pytest
+
+from secure_channel import api, codec, exceptions
+
+
+@pytest.fixture()
+def message():
+  return api.Message(message_id=258, data=bytearray(b'\x01' * 32), hmac=b'\x02' * 48)
+
+
+@pytest.fixture()
+def small_configuration():
+  return api.ChannelConfiguration(max_message_size_bytes=64, max_messages_in_session=100)
+
+
+def test_encode_known_value():
+  message = api.Message(message_id=1, data=b'ab', hmac=b'c')
+  expected = b'\0\0\0\0\0\0\0\x01' + b'\0\0\0\x02' + b'\0\x01' + b'abc'
+  assert codec.encode_message(message, api.DEFAULT_CONFIGURATION) == expected
+
+
+def test_round_trip(message):
+  encoded = codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+  assert len(encoded) == codec.frame_size(message)
+  decoded = codec.decode_message(encoded, api.DEFAULT_CONFIGURATION)
+  assert decoded.message_id == message.message_id
+  assert decoded.data == message.data
+  assert decoded.hmac == message.hmac
+
+
+def test_decode_does_not_copy(message):
+  encoded = codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+  decoded = codec.decode_message(encoded, api.DEFAULT_CONFIGURATION)
+  assert isinstance(decoded.data, memoryview)
+  assert isinstance(decoded.hmac, memoryview)
+  encoded[codec.HEADER.size] = 0xff
+  assert decoded.data[0] == 0xff
+
+
+def test_decode_stream_of_frames(message):
+  other = message._replace(message_id=259, data=b'\x03' * 16)
+  buffer = codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+  buffer += codec.encode_message(other, api.DEFAULT_CONFIGURATION)
+  view = memoryview(buffer)
+  first = codec.decode_message(view, api.DEFAULT_CONFIGURATION)
+  second = codec.decode_message(view[codec.frame_size(first):], api.DEFAULT_CONFIGURATION)
+  assert second.message_id == 259
+  assert second.data == other.data
+
+
+def test_decode_header(message):
+  header = codec.encode_header(message, api.DEFAULT_CONFIGURATION)
+  decoded = codec.decode_header(header, api.DEFAULT_CONFIGURATION)
+  assert decoded == codec.FrameHeader(258, 32, 48)
+  assert codec.header_frame_size(decoded) == codec.frame_size(message)
+
+
+def test_decode_too_short_header():
+  with pytest.raises(exceptions.NotEnoughDataInInput):
+    codec.decode_header(b'\0' * (codec.HEADER.size - 1), api.DEFAULT_CONFIGURATION)
+
+
+def test_decode_truncated_frame(message):
+  encoded = codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+  with pytest.raises(exceptions.NotEnoughDataInInput):
+    codec.decode_message(encoded[:-1], api.DEFAULT_CONFIGURATION)
+
+
+def test_decode_rejects_too_large_message(small_configuration):
+  header = codec.HEADER.pack(1, 65, 48)
+  with pytest.raises(exceptions.MessageTooLarge):
+    codec.decode_header(header, small_configuration)
+  with pytest.raises(exceptions.MessageTooLarge):
+    codec.decode_message(header, small_configuration)
+
+
+def test_encode_rejects_too_large_message(small_configuration):
+  message = api.Message(message_id=1, data=b'\0' * 65, hmac=b'')
+  with pytest.raises(exceptions.MessageTooLarge):
+    codec.encode_message(message, small_configuration)
+
+
+def test_encode_rejects_too_large_hmac():
+  message = api.Message(message_id=1, data=b'', hmac=b'\0' * (codec.MAX_HMAC_LENGTH + 1))
+  with pytest.raises(exceptions.MalformedFrame):
+    codec.encode_header(message, api.DEFAULT_CONFIGURATION)
@@ -1,8 +1,13 @@
 # pylint: disable=missing-docstring, redefined-outer-name, invalid-name
 
+import os
+import socket
+import threading
+import time
+
 import pytest
 
-from secure_channel import api, data_source
+from secure_channel import api, codec, data_source, exceptions
 
 
 def test_data_source_config():
@@ -50,3 +55,368 @@ def test_data_getter():
   assert sd.read() == 1
   assert sd.in_messages == [2, 3, 4]
 
+
+
+@pytest.fixture()
+def socket_pair():
+  left, right = socket.socketpair()
+  yield left, right
+  left.close()
+  right.close()
+
+
+@pytest.fixture()
+def socket_sources(socket_pair):
+  left, right = socket_pair
+  return (
+    data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, left, timeout=5),
+    data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, right, timeout=5, buffer_size=64),
+  )
+
+
+def make_message(message_id, size):
+  return api.Message(
+    message_id=message_id, data=bytearray(os.urandom(size)), hmac=bytearray(os.urandom(48))
+  )
+
+
+def assert_same_message(actual, expected):
+  assert actual.message_id == expected.message_id
+  assert actual.data == expected.data
+  assert actual.hmac == expected.hmac
+
+
+def test_socket_data_source_round_trip(socket_sources):
+  sender, receiver = socket_sources
+  message = make_message(1, 32)
+  sender.write(message)
+  assert_same_message(receiver.read(), message)
+
+
+def test_socket_data_source_many_frames_in_one_recv(socket_sources):
+  sender, receiver = socket_sources
+  receiver = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, receiver.socket)
+  messages = [make_message(ii, 16) for ii in range(1, 11)]
+  for message in messages:
+    sender.write(message)
+  # Wait until everything arrives, so first recv gets all frames.
+  sender.socket.shutdown(socket.SHUT_WR)
+  time.sleep(0.05)
+  for message in messages:
+    assert_same_message(receiver.read(), message)
+  assert receiver.statistics.recv_calls == 1
+  assert receiver.statistics.bytes_received == sender.statistics.bytes_sent
+
+
+def test_socket_data_source_grows_buffer(socket_sources):
+  sender, receiver = socket_sources
+  messages = [make_message(1, 16), make_message(2, 100000), make_message(3, 32)]
+  thread = threading.Thread(target=lambda: [sender.write(m) for m in messages])
+  thread.start()
+  for message in messages:
+    # Messages are views into receive buffer, valid until next read.
+    assert_same_message(receiver.read(), message)
+  thread.join()
+
+
+def test_socket_data_source_statistics(socket_sources):
+  sender, receiver = socket_sources
+  message = make_message(1, 32)
+  sender.write(message)
+  receiver.read()
+  frame_size = codec.frame_size(message)
+  assert sender.statistics.bytes_sent == frame_size
+  assert sender.statistics.send_calls == 1
+  assert receiver.statistics.bytes_received == frame_size
+  assert receiver.statistics.recv_calls >= 1
+
+
+def test_socket_data_source_timeout(socket_sources):
+  __, receiver = socket_sources
+  receiver.timeout = 0.01
+  assert receiver.timeout == 0.01
+  with pytest.raises(socket.timeout):
+    receiver.read()
+
+
+def test_socket_data_source_read_resumes_after_timeout(socket_sources):
+  sender, receiver = socket_sources
+  receiver.timeout = 0.05
+  message = make_message(1, 32)
+  frame = codec.encode_message(message, api.DEFAULT_CONFIGURATION)
+  sender.socket.sendall(frame[:20])
+  with pytest.raises(socket.timeout):
+    receiver.read()
+  sender.socket.sendall(frame[20:])
+  assert_same_message(receiver.read(), message)
+
+
+def test_socket_data_source_write_not_timed_out(socket_sources):
+  sender, receiver = socket_sources
+  sender.timeout = 0.01
+  assert sender.socket.gettimeout() is None
+  message = make_message(7, 4 * 1024 * 1024)
+  received = []
+
+  def read_later():
+    time.sleep(0.1)
+    received.append(receiver.read())
+
+  thread = threading.Thread(target=read_later)
+  thread.start()
+  # Write waits for the reader longer than the read timeout.
+  sender.write(message)
+  thread.join()
+  assert_same_message(received[0], message)
+
+
+def test_socket_data_source_closed_connection(socket_sources):
+  sender, receiver = socket_sources
+  sender.socket.sendall(b'\0' * 3)
+  sender.socket.shutdown(socket.SHUT_WR)
+  with pytest.raises(exceptions.NotEnoughDataInInput):
+    receiver.read()
+
+
+def test_socket_data_source_rejects_too_large_frame(socket_pair):
+  left, right = socket_pair
+  config = api.ChannelConfiguration(max_message_size_bytes=64, max_messages_in_session=100)
+  receiver = data_source.SocketDataSource(config, right, timeout=5)
+  left.sendall(codec.HEADER.pack(1, 2 ** 31, 48))
+  with pytest.raises(exceptions.MessageTooLarge):
+    receiver.read()
+
+
+def test_socket_data_source_partial_sends(socket_pair):
+  left, right = socket_pair
+  left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+  sender = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, left, timeout=5)
+  receiver = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, right, timeout=5)
+  message = make_message(7, 1024 * 1024)
+  thread = threading.Thread(target=sender.write, args=(message,))
+  thread.start()
+  received = receiver.read()
+  thread.join()
+  assert_same_message(received, message)
+  assert sender.statistics.bytes_sent == codec.frame_size(message)
+
+
+def test_data_source_read_many():
+  sd = data_source.TestDataSource(api.DEFAULT_CONFIGURATION, [1, 2, 3, 4, 5])
+  assert sd.read_many(2) == [1, 2]
+  assert sd.read_many(10) == [3, 4, 5]
+  with pytest.raises(IndexError):
+    sd.read_many(1)
+
+
+class SingleMessageDataSource(api.DataSource):
+
+  def __init__(self):
+    super().__init__(api.DEFAULT_CONFIGURATION)
+    self.written = []
+
+  def read(self):
+    return 1
+
+  def write(self, message):  # pylint: disable=arguments-differ
+    self.written.append(message)
+
+
+def test_default_write_and_read_many():
+  sd = SingleMessageDataSource()
+  sd.write_many([1, 2, 3])
+  assert sd.written == [1, 2, 3]
+  assert sd.read_many(5) == [1]
+
+
+def test_socket_data_source_write_many_single_syscall(socket_sources):
+  sender, receiver = socket_sources
+  messages = [make_message(ii, 16 * ii) for ii in range(1, 21)]
+  sender.write_many(messages)
+  assert sender.statistics.send_calls == 1
+  assert sender.statistics.bytes_sent == sum(codec.frame_size(m) for m in messages)
+  received = []
+  while len(received) < len(messages):
+    batch = receiver.read_many(100)
+    # Messages are valid only until next read.
+    received.extend(
+      api.Message(m.message_id, bytes(m.data), bytes(m.hmac)) for m in batch
+    )
+  for actual, expected in zip(received, messages):
+    assert_same_message(actual, expected)
+
+
+def test_socket_data_source_read_many_returns_buffered_frames(socket_sources):
+  sender, receiver = socket_sources
+  receiver = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, receiver.socket)
+  messages = [make_message(ii, 16) for ii in range(1, 11)]
+  sender.write_many(messages)
+  sender.socket.shutdown(socket.SHUT_WR)
+  time.sleep(0.05)
+  batch = receiver.read_many(4)
+  assert [m.message_id for m in batch] == [1, 2, 3, 4]
+  batch = receiver.read_many(100)
+  assert [m.message_id for m in batch] == [5, 6, 7, 8, 9, 10]
+  assert receiver.statistics.recv_calls == 1
+
+
+def test_socket_data_source_read_many_stops_at_partial_frame(socket_sources):
+  sender, receiver = socket_sources
+  frames = codec.encode_message(make_message(1, 16), api.DEFAULT_CONFIGURATION)
+  frames += codec.encode_message(make_message(2, 16), api.DEFAULT_CONFIGURATION)
+  sender.socket.sendall(frames[:-1])
+  time.sleep(0.05)
+  assert [m.message_id for m in receiver.read_many(10)] == [1]
+  sender.socket.sendall(frames[-1:])
+  assert [m.message_id for m in receiver.read_many(10)] == [2]
+
+
+def test_socket_data_source_read_many_keeps_messages_before_invalid_frame(socket_pair):
+  left, right = socket_pair
+  config = api.ChannelConfiguration(max_message_size_bytes=64, max_messages_in_session=100)
+  receiver = data_source.SocketDataSource(config, right, timeout=5)
+  frames = codec.encode_message(make_message(1, 16), config)
+  frames += codec.encode_message(make_message(2, 16), config)
+  left.sendall(frames + codec.HEADER.pack(3, 2 ** 31, 48))
+  time.sleep(0.05)
+  assert [m.message_id for m in receiver.read_many(10)] == [1, 2]
+  for __ in range(2):
+    with pytest.raises(exceptions.MessageTooLarge):
+      receiver.read_many(10)
+
+
+def test_socket_data_source_write_many_more_than_iov_max(socket_pair, monkeypatch):
+  monkeypatch.setattr(data_source, "IOV_MAX", 4)
+  left, right = socket_pair
+  sender = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, left, timeout=5)
+  receiver = data_source.SocketDataSource(api.DEFAULT_CONFIGURATION, right, timeout=5)
+  messages = [make_message(ii, 16) for ii in range(1, 6)]
+  sender.write_many(messages)
+  assert sender.statistics.send_calls == 4
+  for message in messages:
+    assert_same_message(receiver.read(), message)
+
+
+@pytest.fixture()
+def udp_pair():
+  left = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  right = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  left.bind(("127.0.0.1", 0))
+  right.bind(("127.0.0.1", 0))
+  left.connect(right.getsockname())
+  right.connect(left.getsockname())
+  yield left, right
+  left.close()
+  right.close()
+
+
+@pytest.fixture()
+def udp_sources(udp_pair):
+  config = data_source.datagram_configuration()
+  return tuple(
+    data_source.DatagramDataSource(config, sock, timeout=5) for sock in udp_pair
+  )
+
+
+def test_datagram_configuration():
+  config = data_source.datagram_configuration()
+  assert config.max_message_size_bytes == 1500 - 28 - codec.HEADER.size
+  assert config.max_messages_in_session == api.DEFAULT_CONFIGURATION.max_messages_in_session
+  assert data_source.datagram_configuration(
+    family=socket.AF_INET6
+  ).max_message_size_bytes == 1500 - 48 - codec.HEADER.size
+
+
+def test_datagram_data_source_round_trip(udp_sources):
+  sender, receiver = udp_sources
+  message = make_message(1, 64)
+  sender.write(message)
+  assert_same_message(receiver.read(), message)
+  assert sender.statistics.bytes_sent == codec.frame_size(message)
+  assert receiver.statistics.bytes_received == codec.frame_size(message)
+
+
+def test_datagram_data_source_largest_message(udp_sources):
+  sender, receiver = udp_sources
+  message = make_message(1, sender.max_datagram_size - codec.HEADER.size - 48)
+  sender.write(message)
+  assert_same_message(receiver.read(), message)
+
+
+def test_datagram_data_source_message_too_large(udp_sources):
+  sender, __ = udp_sources
+  with pytest.raises(exceptions.MessageTooLarge):
+    sender.write(make_message(1, sender.max_datagram_size - codec.HEADER.size))
+
+
+def test_datagram_data_source_read_many(udp_sources):
+  sender, receiver = udp_sources
+  messages = [make_message(ii, 32) for ii in range(1, 11)]
+  sender.write_many(messages)
+  time.sleep(0.05)
+  first = receiver.read_many(4)
+  for actual, expected in zip(first, messages):
+    assert_same_message(actual, expected)
+  second = receiver.read_many(100)
+  for actual, expected in zip(second, messages[4:]):
+    assert_same_message(actual, expected)
+  assert len(first) == 4
+  assert len(second) == 6
+
+
+def test_datagram_data_source_ignores_refused(udp_pair):
+  left, right = udp_pair
+  config = data_source.datagram_configuration()
+  receiver = data_source.DatagramDataSource(config, right, timeout=5)
+  address = left.getsockname()
+  left.close()
+  # Nobody listens on the port, so peer refuses the datagram.
+  receiver.write(make_message(1, 16))
+  time.sleep(0.05)
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as restarted:
+    restarted.bind(address)
+    restarted.connect(right.getsockname())
+    data_source.DatagramDataSource(config, restarted).write(make_message(2, 16))
+    assert receiver.read().message_id == 2
+  assert receiver.statistics.refused_received == 1
+
+
+@pytest.mark.parametrize("datagram", [
+  b"",
+  b"\0" * 5,
+  lambda: codec.encode_message(make_message(1, 16), api.DEFAULT_CONFIGURATION)[:-1],
+  lambda: codec.encode_message(make_message(1, 16), api.DEFAULT_CONFIGURATION) + b"\0",
+  lambda: codec.HEADER.pack(1, 2 ** 20, 0),
+  b"\0" * 1600,
+])
+def test_datagram_data_source_drops_malformed(udp_pair, udp_sources, datagram):
+  __, receiver = udp_sources
+  if callable(datagram):
+    datagram = datagram()
+  udp_pair[0].send(datagram)
+  message = make_message(2, 16)
+  udp_sources[0].write(message)
+  assert_same_message(receiver.read(), message)
+  assert receiver.statistics.malformed_received == 1
+
+
+def test_datagram_data_source_read_many_drops_malformed(udp_pair, udp_sources):
+  sender, receiver = udp_sources
+  messages = [make_message(ii, 16) for ii in range(1, 4)]
+  sender.write(messages[0])
+  udp_pair[0].send(b"\0")
+  sender.write_many(messages[1:])
+  time.sleep(0.05)
+  received = receiver.read_many(10)
+  assert len(received) == 3
+  for actual, expected in zip(received, messages):
+    assert_same_message(actual, expected)
+  assert receiver.statistics.malformed_received == 1
+
+
+def test_datagram_data_source_timeout(udp_sources):
+  __, receiver = udp_sources
+  receiver.timeout = 0.01
+  assert receiver.timeout == 0.01
+  with pytest.raises(socket.timeout):
+    receiver.read()
@@ -0,0 +1,232 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+# pylint: disable=protected-access
+
+import multiprocessing
+import os
+
+import pytest
+
+from secure_channel import (
+  api, data_source, exceptions, key_negotiation, persistent_state, secure_channel
+)
+from secure_channel.secure_channel import utils as channel_utils
+
+
+@pytest.fixture()
+def state_path(tmpdir):
+  return str(tmpdir.join("session-state"))
+
+
+def load(path, session_key, reservation_size=10, side=api.CommunicationSide.ALICE):
+  loader = persistent_state.FileSessionStateLoader(
+    path, session_key, side, reservation_size=reservation_size
+  )
+  return loader.create_session_state(
+    api.DEFAULT_CONFIGURATION, channel_utils.CRYPTO_CONFIGURATION
+  )
+
+
+@pytest.fixture()
+def fsync_calls(monkeypatch):
+  calls = []
+  fsync = os.fsync
+
+  def counting_fsync(fd):
+    calls.append(fd)
+    fsync(fd)
+
+  monkeypatch.setattr(os, "fsync", counting_fsync)
+  return calls
+
+
+def crash(state):
+  """Release state file, as if the process died."""
+  state.state_file.close()
+
+
+def test_new_state(state_path, session_key, alice_keys):
+  state = load(state_path, session_key)
+  assert state.get_extended_keys() == alice_keys
+  assert state.reservation == persistent_state.Reservation(0, 0)
+  assert state.get_send_message_number() == 1
+  assert state.reservation == persistent_state.Reservation(11, 0)
+
+
+def test_one_sync_per_reservation(state_path, session_key, fsync_calls):
+  state = load(state_path, session_key, reservation_size=10)
+  for __ in range(100):
+    state.get_send_message_number()
+  for message_id in range(1, 101):
+    state.verify_recv_message_number(message_id)
+  # One more to sync directory of the created file.
+  assert len(fsync_calls) == 1 + 20
+
+
+def test_restart_skips_reservation(state_path, session_key):
+  state = load(state_path, session_key)
+  sent = [state.get_send_message_number() for __ in range(15)]
+  state.verify_recv_message_number(5)
+  # Crash, state is never reset.
+  crash(state)
+  restarted = load(state_path, session_key)
+  assert restarted.get_send_message_number() > max(sent)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    restarted.verify_recv_message_number(6)
+  restarted.verify_recv_message_number(16)
+
+
+def test_contiguous_range(state_path, session_key):
+  state = load(state_path, session_key)
+  assert state.get_send_message_numbers(25) == range(1, 26)
+  assert state.reservation.send_message_number == 35
+
+
+def test_reservation_capped_at_end_of_session(state_path, session_key):
+  state = load(state_path, session_key)
+  last = state.configuration.max_messages_in_session - 1
+  state.verify_recv_message_number(last)
+  assert state.reservation.recv_message_number == state.configuration.max_messages_in_session
+
+
+def test_invalid_recv_does_not_reserve(state_path, session_key, fsync_calls):
+  state = load(state_path, session_key)
+  state.verify_recv_message_number(5)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(5)
+  # Directory of the created file, and a single reservation.
+  assert len(fsync_calls) == 1 + 1
+
+
+def test_torn_write_uses_previous_slot(state_path, session_key):
+  state = load(state_path, session_key, reservation_size=10)
+  state.get_send_message_number()
+  state.get_send_message_numbers(15)
+  assert state.reservation.send_message_number == 26
+  state.reset()
+  # Crash in the middle of writing the second reservation, that was
+  # never used as it wasn't synced.
+  with open(state_path, "r+b") as file:
+    file.seek(0)
+    file.write(b'\xff' * 8)
+  restarted = load(state_path, session_key)
+  assert restarted.reservation.send_message_number == 11
+
+
+@pytest.mark.parametrize("content", [b'\x00' * 64, b'garbage'])
+def test_corrupted_file(state_path, session_key, content):
+  with open(state_path, "wb") as file:
+    file.write(content)
+  with pytest.raises(exceptions.CorruptedSessionState):
+    load(state_path, session_key)
+
+
+def test_reset_closes_file(state_path, session_key):
+  state = load(state_path, session_key)
+  state.reset()
+  state.reset()
+  with pytest.raises(exceptions.AlreadyReseted):
+    state.get_send_message_number()
+
+
+def send_and_crash(path, session_key, connection):
+  state = load(path, session_key, reservation_size=7)
+  for __ in range(20):
+    connection.send(state.get_send_message_number())
+  os._exit(0)  # pylint: disable=protected-access
+
+
+def test_crashed_process(state_path, session_key):
+  context = multiprocessing.get_context("fork")
+  receiver, sender = context.Pipe(duplex=False)
+  process = context.Process(target=send_and_crash, args=(state_path, session_key, sender))
+  process.start()
+  used = [receiver.recv() for __ in range(20)]
+  process.join()
+  assert used == list(range(1, 21))
+  restarted = load(state_path, session_key)
+  assert restarted.get_send_message_number() > max(used)
+
+
+def load_in_other_process(path, session_key, connection):
+  try:
+    load(path, session_key)
+  except exceptions.SessionStateInUse:
+    connection.send("in use")
+  else:
+    connection.send("loaded")
+  connection.close()
+
+
+def test_state_used_by_other_process(state_path, session_key):
+  state = load(state_path, session_key)
+  context = multiprocessing.get_context("fork")
+
+  def load_in_child():
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=load_in_other_process, args=(state_path, session_key, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+  assert load_in_child() == "in use"
+  state.reset()
+  assert load_in_child() == "loaded"
+
+
+def test_state_used_in_same_process(state_path, session_key):
+  state = load(state_path, session_key)
+  with pytest.raises(exceptions.SessionStateInUse):
+    load(state_path, session_key)
+  assert state.get_send_message_number() == 1
+  state.reset()
+  assert load(state_path, session_key).get_send_message_number() > 1
+
+
+def test_created_file_directory_synced(state_path, session_key, fsync_calls):
+  load(state_path, session_key).reset()
+  # Directory of the created file, nothing was reserved yet.
+  assert len(fsync_calls) == 1
+  load(state_path, session_key).reset()
+  assert len(fsync_calls) == 1
+
+
+def test_channel_over_restarts(state_path, session_key, tmpdir):
+  bob_path = str(tmpdir.join("bob-state"))
+
+  def create_channels():
+    sources = [data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []) for __ in range(2)]
+    return [
+      secure_channel.SecureChannel(
+        source,
+        key_negotiation.LoadedSessionKeyNegotiator(
+          persistent_state.FileSessionStateLoader(path, session_key, side, reservation_size=4),
+          channel_utils.CRYPTO_CONFIGURATION
+        )
+      )
+      for source, path, side in zip(
+        sources, (state_path, bob_path), (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+      )
+    ]
+
+  alice, bob = create_channels()
+  alice.send_message(b'before restart..')
+  bob._data_source.in_messages = alice._data_source.out_messages
+  assert bob.receive_message() == b'before restart..'
+  first_messages = alice._data_source.out_messages
+  for channel in (alice, bob):
+    crash(channel._session_state)
+  alice, bob = create_channels()
+  alice.send_message(b'after restart...')
+  # Message received before restart is rejected.
+  bob._data_source.in_messages = first_messages
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    bob.receive_message()
+  bob._data_source.in_messages = alice._data_source.out_messages
+  assert bob.receive_message() == b'after restart...'
+
+
+def test_state_file_path(state_path):
+  state_file = persistent_state.SessionStateFile(state_path)
+  assert state_file.path == state_path
+  state_file.close()
@@ -0,0 +1,275 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+# pylint: disable=protected-access
+
+import threading
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, key_negotiation, ratchet, secure_channel
+from secure_channel.secure_channel import crypto_context
+from secure_channel.secure_channel import utils as channel_utils
+
+CONFIGURATION = api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=5)
+"""Four messages in every epoch."""
+
+
+def copy_keys(keys):
+  return api.ExtendedKeys(*(bytearray(key) for key in keys))
+
+
+@pytest.fixture()
+def alice_state(alice_keys):
+  return ratchet.RatchetSessionState(CONFIGURATION, copy_keys(alice_keys))
+
+
+@pytest.fixture()
+def bob_state(bobs_keys):
+  return ratchet.RatchetSessionState(CONFIGURATION, copy_keys(bobs_keys))
+
+
+def ids(epoch, *numbers):
+  return [ratchet.join_message_id(epoch, number) for number in numbers]
+
+
+def test_message_id():
+  message_id = ratchet.join_message_id(3, 7)
+  assert message_id == 3 * 2 ** 32 + 7
+  assert ratchet.split_message_id(message_id) == (3, 7)
+  assert ratchet.join_message_id(ratchet.MAX_EPOCH, 2 ** 32 - 1) < 2 ** 63
+
+
+def test_both_sides_ratchet_the_same_keys(alice_state, bob_state):
+  assert alice_state.send_chain.keys(1) == bob_state.recv_chain.keys(1)
+  assert alice_state.recv_chain.keys(1) == bob_state.send_chain.keys(1)
+  assert alice_state.send_chain.keys(1) != alice_state.send_chain.keys(0)
+
+
+def test_send_ids_roll_over(alice_state):
+  sent = [alice_state.get_send_message_number() for __ in range(9)]
+  assert sent == ids(0, 1, 2, 3, 4) + ids(1, 1, 2, 3, 4) + ids(2, 1)
+  assert alice_state.send_chain.epoch == 2
+  assert alice_state.send_message_number == ratchet.join_message_id(2, 1)
+
+
+def test_range_never_spans_epochs(alice_state):
+  assert list(alice_state.get_send_message_numbers(3)) == ids(0, 1, 2, 3)
+  assert list(alice_state.get_send_message_numbers(3)) == ids(1, 1, 2, 3)
+  assert list(alice_state.get_send_message_numbers(0)) == []
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    alice_state.get_send_message_numbers(5)
+
+
+def test_last_epoch(alice_keys):
+  state = ratchet.RatchetSessionState(
+    CONFIGURATION, copy_keys(alice_keys),
+    send_message_number=ratchet.join_message_id(ratchet.MAX_EPOCH, 3)
+  )
+  assert state.get_send_message_number() == ratchet.join_message_id(ratchet.MAX_EPOCH, 4)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    state.get_send_message_number()
+
+
+def test_old_keys_are_destroyed(alice_keys):
+  keys = copy_keys(alice_keys)
+  state = ratchet.RatchetSessionState(CONFIGURATION, keys)
+  first_epoch = state.send_chain.keys(0)
+  for __ in range(5):
+    state.get_send_message_number()
+  # Previous epoch is kept for messages sealed around the boundary.
+  assert keys.send_encryption_key == alice_keys.send_encryption_key
+  second_epoch = state.send_chain.keys(1)
+  for __ in range(4):
+    state.get_send_message_number()
+  for key in first_epoch:
+    assert key == bytes(32)
+  assert keys.send_sign_key == bytes(32)
+  assert second_epoch[0] != bytes(32)
+  # Receive keys are ratcheted separately.
+  assert keys.recv_encryption_key == alice_keys.recv_encryption_key
+  with pytest.raises(KeyError):
+    state.send_chain.keys(0)
+
+
+def test_chain_derives_only_next_epoch(alice_state):
+  alice_state.send_chain.keys(1)
+  with pytest.raises(KeyError):
+    alice_state.send_chain.keys(2)
+
+
+def test_recv_ids_across_epochs(bob_state):
+  for message_id in ids(0, 1, 4) + ids(1, 2) + ids(2, 1):
+    bob_state.precheck_recv_message_number(message_id)
+    bob_state.verify_recv_message_number(message_id)
+  assert bob_state.recv_chain.epoch == 2
+  assert bob_state.recv_message_number == ratchet.join_message_id(2, 1)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    bob_state.verify_recv_message_number(ratchet.join_message_id(1, 4))
+
+
+@pytest.mark.parametrize("message_id", [
+  ratchet.join_message_id(1, 0),
+  ratchet.join_message_id(0, 5),
+  ratchet.join_message_id(2, 1),
+])
+def test_invalid_recv_ids(bob_state, message_id):
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    bob_state.precheck_recv_message_number(message_id)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    bob_state.verify_recv_message_number(message_id)
+  assert bob_state.recv_chain.epoch == 0
+
+
+def test_precheck_does_not_advance(bob_state):
+  bob_state.precheck_recv_message_number(ratchet.join_message_id(1, 1))
+  assert bob_state.recv_chain.epoch == 0
+  assert bob_state.recv_message_number == 0
+
+
+def test_extended_keys_of_current_epochs(alice_state, bob_state):
+  for __ in range(5):
+    alice_state.get_send_message_number()
+  bob_state.verify_recv_message_number(ratchet.join_message_id(1, 1))
+  alice_keys = alice_state.get_extended_keys()
+  bob_keys = bob_state.get_extended_keys()
+  assert alice_keys.send_encryption_key == bob_keys.recv_encryption_key
+  assert alice_keys.send_sign_key == bob_keys.recv_sign_key
+  assert alice_keys.recv_encryption_key == alice_state.recv_chain.keys(0)[0]
+  assert alice_keys.recv_sign_key == alice_state.recv_chain.keys(0)[1]
+
+
+def test_reset(alice_state):
+  alice_state.get_send_message_numbers(5 - 1)
+  alice_state.get_send_message_number()
+  chain_keys = alice_state.send_chain.keys(0) + alice_state.send_chain.keys(1)
+  alice_state.reset()
+  alice_state.reset()
+  for key in chain_keys:
+    assert key == bytes(32)
+  for call in (
+      alice_state.get_send_message_number,
+      alice_state.get_extended_keys,
+      lambda: alice_state.verify_recv_message_number(1),
+      lambda: alice_state.send_chain.keys(1),
+      lambda: alice_state.recv_chain.advance(1),
+  ):
+    with pytest.raises(exceptions.AlreadyReseted):
+      call()
+
+
+def create_channels(session_key, crypto_configuration=channel_utils.CRYPTO_CONFIGURATION):
+  return [
+    secure_channel.SecureChannel(
+      data_source.TestDataSource(CONFIGURATION, []),
+      key_negotiation.TestSessionKeyNegotiator(
+        session_key, side, session_state_factory=ratchet.RatchetSessionState
+      ),
+      crypto_configration=crypto_configuration,
+      configuration=CONFIGURATION
+    )
+    for side in (api.CommunicationSide.ALICE, api.CommunicationSide.BOB)
+  ]
+
+
+@pytest.mark.parametrize("crypto_configuration", [
+  channel_utils.CRYPTO_CONFIGURATION,
+  channel_utils.AES_GCM_CRYPTO_CONFIGURATION,
+  channel_utils.ENCRYPT_THEN_MAC_CRYPTO_CONFIGURATION,
+])
+def test_channel_across_epochs(session_key, crypto_configuration):
+  alice, bob = create_channels(session_key, crypto_configuration)
+  data = [bytes([ii]) * 32 for ii in range(14)]
+  for message in data[:10]:
+    alice.send_message(message)
+  alice.send_messages(data[10:])
+  assert [message.message_id for message in alice._data_source.out_messages] == (
+    ids(0, 1, 2, 3, 4) + ids(1, 1, 2, 3, 4) + ids(2, 1, 2) + ids(3, 1, 2, 3, 4)
+  )
+  bob._data_source.in_messages = alice._data_source.out_messages
+  assert [bob.receive_message() for __ in range(10)] == data[:10]
+  assert [received.data for received in bob.receive_messages(4)] == data[10:]
+  assert bob._session_state.recv_chain.epoch == 3
+
+
+def test_concurrent_senders(session_key):
+  alice, bob = create_channels(session_key)
+
+  def produce(thread):
+    for index in range(10):
+      alice.send_message(bytes([thread, index]) * 16)
+
+  threads = [threading.Thread(target=produce, args=(thread, )) for thread in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  bob._data_source.in_messages = alice._data_source.out_messages
+  received = [bob.receive_message() for __ in range(40)]
+  assert sorted(received) == sorted(
+    bytes([thread, index]) * 16 for thread in range(4) for index in range(10)
+  )
+  assert bob._session_state.recv_chain.epoch == 9
+
+
+def test_forged_epoch(session_key):
+  alice, bob = create_channels(session_key)
+  for __ in range(5):
+    alice.send_message(b'ratchet message.')
+  message = alice._data_source.out_messages[-1]
+  context = bob._crypto_context
+  forged = message._replace(message_id=ratchet.join_message_id(2, 1))
+  with pytest.raises(exceptions.InvalidSignature):
+    context.open(forged)
+  with pytest.raises(exceptions.InvalidSignature):
+    context.open_into(forged, bytearray(32))
+  # Message from the next epoch, with keys derived but not used yet.
+  assert context.open(message) == b'ratchet message.'
+  assert bob._session_state.recv_chain.epoch == 0
+  received = context.open_many([message, forged, forged])
+  assert received[0].data == b'ratchet message.'
+  assert [type(result.error) for result in received[1:]] == [exceptions.InvalidSignature] * 2
+
+
+def test_seal_many_groups_by_epoch(session_key):
+  alice, bob = create_channels(session_key)
+  alice._session_state.get_send_message_numbers(4)
+  alice._session_state.get_send_message_number()
+  message_ids = ids(0, 4) + ids(1, 1)
+  messages = alice._crypto_context.seal_many(
+    message_ids, [b'first epoch.....', b'second epoch....']
+  )
+  plain = crypto_context.create_crypto_context(
+    channel_utils.CRYPTO_CONFIGURATION, bob._session_state.get_extended_keys()
+  )
+  assert plain.open(messages[0]) == b'first epoch.....'
+  with pytest.raises(exceptions.InvalidSignature):
+    plain.open(messages[1])
+  assert [received.data for received in bob._crypto_context.open_many(messages)] == [
+    b'first epoch.....', b'second epoch....'
+  ]
+
+
+def test_restored_session(session_key):
+  alice, bob = create_channels(session_key)
+  for __ in range(6):
+    alice.send_message(b'before restore..')
+  state = alice._session_state
+  restored = ratchet.RatchetSessionState(
+    CONFIGURATION, copy_keys(state.get_extended_keys()),
+    state.send_message_number, state.recv_message_number
+  )
+  context = restored.create_crypto_context(
+    channel_utils.CRYPTO_CONFIGURATION, crypto_context.create_crypto_context
+  )
+  message = context.seal(restored.get_send_message_number(), bytearray(b'after restore...'))
+  bob._data_source.in_messages = alice._data_source.out_messages + [message]
+  for __ in range(6):
+    assert bob.receive_message() == b'before restore..'
+  assert bob.receive_message() == b'after restore...'
+
+
+def test_default_crypto_context(alice_keys):
+  state = key_negotiation.DefaultSessionState(api.DEFAULT_CONFIGURATION, alice_keys)
+  context = state.create_crypto_context(
+    channel_utils.CRYPTO_CONFIGURATION, crypto_context.create_crypto_context
+  )
+  assert isinstance(context, crypto_context.HmacCtrCryptoContext)
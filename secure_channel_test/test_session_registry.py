@@ -0,0 +1,244 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+# pylint: disable=protected-access
+
+import os
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel, session_registry
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture()
+def clock():
+  return FakeClock()
+
+
+@pytest.fixture()
+def key_wrapper():
+  return session_registry.KeyWrapper(bytearray(os.urandom(32)))
+
+
+@pytest.fixture()
+def cold_store():
+  return session_registry.MemoryColdStore()
+
+
+def create_channel(peer_id, negotiator):
+  assert isinstance(peer_id, str)
+  return secure_channel.SecureChannel(
+    data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []), negotiator
+  )
+
+
+@pytest.fixture()
+def registry(cold_store, key_wrapper, clock):
+  return session_registry.ChannelRegistry(
+    create_channel, cold_store, key_wrapper, max_channels=2, idle_timeout=60, clock=clock
+  )
+
+
+def copy_keys(keys):
+  return api.ExtendedKeys(*(bytearray(key) for key in keys))
+
+
+def test_wrap_round_trip(key_wrapper, alice_keys):
+  record = key_wrapper.wrap("peer", 10, 20, alice_keys)
+  assert bytes(alice_keys.send_encryption_key) not in record
+  assert key_wrapper.unwrap("peer", record) == (10, 20, alice_keys)
+
+
+def test_wrap_is_bound_to_peer(key_wrapper, alice_keys):
+  record = key_wrapper.wrap("peer", 10, 20, alice_keys)
+  with pytest.raises(exceptions.InvalidSignature):
+    key_wrapper.unwrap("other peer", record)
+
+
+@pytest.mark.parametrize("position", [0, 8, 20, 30, -1])
+def test_wrap_detects_modification(key_wrapper, alice_keys, position):
+  record = bytearray(key_wrapper.wrap("peer", 10, 20, alice_keys))
+  record[position] ^= 1
+  with pytest.raises(exceptions.InvalidSignature):
+    key_wrapper.unwrap("peer", bytes(record))
+
+
+def test_wrap_uses_96_bit_nonces(key_wrapper, alice_keys, monkeypatch):
+  nonces = []
+  urandom = os.urandom
+
+  def recording_urandom(size):
+    nonces.append(urandom(size))
+    return nonces[-1]
+
+  monkeypatch.setattr(os, "urandom", recording_urandom)
+  record = key_wrapper.wrap("peer", 10, 20, alice_keys)
+  assert [len(nonce) for nonce in nonces] == [12]
+  assert record.startswith(nonces[0])
+
+
+def test_wrap_truncated(key_wrapper):
+  with pytest.raises(exceptions.InvalidSignature):
+    key_wrapper.unwrap("peer", bytes(30))
+
+
+def test_hot_channel(registry, alice_keys):
+  channel = registry.add("alice", copy_keys(alice_keys))
+  assert registry.get("alice") is channel
+  assert "alice" in registry
+  assert len(registry) == 1
+
+
+def test_unknown_peer(registry):
+  with pytest.raises(KeyError):
+    registry.get("nobody")
+
+
+def test_lru_eviction(registry, cold_store, alice_keys):
+  first = registry.add("first", copy_keys(alice_keys))
+  keys = first._session_state.get_extended_keys()
+  registry.add("second", copy_keys(alice_keys))
+  registry.get("first")
+  registry.add("third", copy_keys(alice_keys))
+  assert "second" not in registry
+  assert list(cold_store.records) == ["second"]
+  registry.add("fourth", copy_keys(alice_keys))
+  assert "first" not in registry
+  # Keys of evicted channel are zeroed.
+  for key in keys:
+    assert key == bytes(len(key))
+  with pytest.raises(exceptions.AlreadyReseted):
+    first.send_message(b'evicted channel')
+
+
+def test_idle_eviction(registry, cold_store, clock, alice_keys):
+  registry.add("first", copy_keys(alice_keys))
+  clock.now = 30
+  registry.add("second", copy_keys(alice_keys))
+  clock.now = 70
+  assert registry.evict_idle() == 1
+  assert "first" not in registry and "second" in registry
+  clock.now = 200
+  registry.add("third", copy_keys(alice_keys))
+  assert list(registry._ChannelRegistry__channels) == ["third"]
+  assert set(cold_store.records) == {"first", "second"}
+
+
+def test_idle_eviction_disabled(cold_store, key_wrapper, alice_keys):
+  registry = session_registry.ChannelRegistry(create_channel, cold_store, key_wrapper)
+  registry.add("first", copy_keys(alice_keys))
+  assert registry.evict_idle() == 0
+
+
+def test_rehydration(registry, alice_keys, bobs_keys):
+  alice = registry.add("alice", copy_keys(alice_keys))
+  bob = secure_channel.SecureChannel(
+    data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []),
+    session_registry._RegisteredNegotiator(copy_keys(bobs_keys), 0, 0)
+  )
+  alice.send_message(b'first message...')
+  registry.evict("alice")
+  assert "alice" not in registry
+  rehydrated = registry.get("alice")
+  assert rehydrated is not alice
+  assert rehydrated._session_state.get_extended_keys() == alice_keys
+  rehydrated.send_message(b'second message..')
+  messages = alice._data_source.out_messages + rehydrated._data_source.out_messages
+  assert [message.message_id for message in messages] == [1, 2]
+  bob._data_source.in_messages = messages
+  assert bob.receive_message() == b'first message...'
+  assert bob.receive_message() == b'second message..'
+  # Replay is still rejected after rehydration.
+  bob.send_message(b'reply...........')
+  rehydrated._data_source.in_messages = bob._data_source.out_messages
+  assert rehydrated.receive_message() == b'reply...........'
+  registry.evict("alice")
+  registry.get("alice")._data_source.in_messages = bob._data_source.out_messages
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    registry.get("alice").receive_message()
+
+
+class FactoryError(Exception):
+  pass
+
+
+def test_failed_rehydration_keeps_record(cold_store, key_wrapper, alice_keys):
+  failing = []
+
+  def factory(peer_id, negotiator):
+    if failing:
+      raise FactoryError()
+    return create_channel(peer_id, negotiator)
+
+  registry = session_registry.ChannelRegistry(factory, cold_store, key_wrapper)
+  registry.add("alice", copy_keys(alice_keys))
+  registry.evict("alice")
+  record = cold_store.records["alice"]
+  failing.append(True)
+  with pytest.raises(FactoryError):
+    registry.get("alice")
+  assert cold_store.records["alice"] == record
+  other_wrapper = session_registry.ChannelRegistry(
+    factory, cold_store, session_registry.KeyWrapper(bytearray(32))
+  )
+  with pytest.raises(exceptions.InvalidSignature):
+    other_wrapper.get("alice")
+  assert cold_store.records["alice"] == record
+  failing.clear()
+  assert registry.get("alice")._session_state.get_extended_keys() == alice_keys
+
+
+def test_evict_reset_session(registry, cold_store, alice_keys):
+  channel = registry.add("alice", copy_keys(alice_keys))
+  channel.destroy_session()
+  registry.evict("alice")
+  assert not cold_store.records
+  with pytest.raises(KeyError):
+    registry.get("alice")
+
+
+def test_remove(registry, cold_store, alice_keys):
+  registry.add("hot", copy_keys(alice_keys))
+  registry.add("cold", copy_keys(alice_keys))
+  registry.evict("cold")
+  registry.remove("hot")
+  registry.remove("cold")
+  assert len(registry) == 0
+  assert not cold_store.records
+
+
+def test_add_replaces_session(registry, cold_store, alice_keys):
+  registry.add("alice", copy_keys(alice_keys), send_message_number=5)
+  registry.evict("alice")
+  channel = registry.add("alice", copy_keys(alice_keys), send_message_number=100)
+  assert not cold_store.records
+  assert channel._session_state.get_send_message_number() == 101
+
+
+def test_directory_cold_store(tmpdir, key_wrapper, alice_keys):
+  cold_store = session_registry.DirectoryColdStore(str(tmpdir))
+  registry = session_registry.ChannelRegistry(create_channel, cold_store, key_wrapper)
+  registry.add("peer/with/slashes", copy_keys(alice_keys), send_message_number=7)
+  registry.evict("peer/with/slashes")
+  assert len(tmpdir.listdir()) == 1
+  channel = registry.get("peer/with/slashes")
+  assert channel._session_state.get_send_message_number() == 8
+  assert not tmpdir.listdir()
+  assert cold_store.pop("missing") is None
+
+
+def test_windowed_recv_message_number(alice_keys):
+  # pylint: disable=import-outside-toplevel
+  from secure_channel import session_state
+  state = session_state.WindowedSessionState(api.DEFAULT_CONFIGURATION, alice_keys)
+  state.verify_recv_message_number(10)
+  state.verify_recv_message_number(5)
+  assert state.recv_message_number == 10
+  assert state.send_message_number == 0
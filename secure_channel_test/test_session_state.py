@@ -1,5 +1,7 @@
 # pylint: disable=missing-docstring, redefined-outer-name, invalid-name
 # pylint: disable=protected-access
+import threading
+
 import pytest
 
 from secure_channel import session_state as session_state_module, api, exceptions
@@ -110,3 +112,298 @@ def test_verify_recv_message_number_need_to_renegotiate_key(session_state):
     session_state.verify_recv_message_number(
       session_state.configuration.max_messages_in_session
     )
+
+
+def test_get_send_message_numbers(session_state):
+  assert session_state.get_send_message_number() == 1
+  assert session_state.get_send_message_numbers(3) == range(2, 5)
+  assert session_state.get_send_message_number() == 5
+  assert session_state.get_send_message_numbers(0) == range(0)
+
+
+def test_get_send_message_numbers_over_max(session_state):
+  session_state._DefaultSessionState__send_message_number = \
+    session_state.configuration.max_messages_in_session - 3
+
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    session_state.get_send_message_numbers(3)
+  assert session_state.get_send_message_numbers(2) == range(
+    session_state.configuration.max_messages_in_session - 2,
+    session_state.configuration.max_messages_in_session
+  )
+
+
+class CountingSessionState(api.SessionState):
+
+  def __init__(self, numbers):
+    super().__init__(api.DEFAULT_CONFIGURATION)
+    self.numbers = list(numbers)
+
+  def get_send_message_number(self):
+    return self.numbers.pop(0)
+
+  def verify_recv_message_number(self, message_number):
+    pass  # pragma: no cover
+
+  def get_extended_keys(self):
+    pass  # pragma: no cover
+
+  def reset(self):
+    pass  # pragma: no cover
+
+
+def test_default_get_send_message_numbers():
+  state = CountingSessionState([1, 2, 3])
+  assert state.get_send_message_numbers(3) == range(1, 4)
+  assert state.get_send_message_numbers(0) == range(0)
+
+
+def test_default_get_send_message_numbers_skips_gaps():
+  state = CountingSessionState([1, 3, 4, 5])
+  # Ids before a gap are skipped, the run after it is used.
+  assert state.get_send_message_numbers(2) == range(3, 5)
+
+
+def test_default_get_send_message_numbers_under_contention():
+  # Every other id taken by another thread, for longer than recursion limit.
+  state = CountingSessionState([*range(1, 20000, 2), 20001, 20002, 20003])
+  assert state.get_send_message_numbers(3) == range(20001, 20004)
+
+
+def test_precheck_recv_message_number(session_state):
+  session_state.precheck_recv_message_number(5)
+  session_state.verify_recv_message_number(5)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    session_state.precheck_recv_message_number(5)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    session_state.precheck_recv_message_number(session_state.configuration.max_messages_in_session)
+
+
+def test_precheck_does_not_update_state(session_state):
+  session_state.precheck_recv_message_number(10)
+  session_state.verify_recv_message_number(1)
+
+
+def test_precheck_after_reset(session_state):
+  session_state.reset()
+  with pytest.raises(exceptions.AlreadyReseted):
+    session_state.precheck_recv_message_number(1)
+
+
+def test_default_precheck_accepts_everything():
+  CountingSessionState([]).precheck_recv_message_number(0)
+
+
+@pytest.fixture()
+def windowed_state(alice_keys):
+  return session_state_module.WindowedSessionState(
+    configuration=api.DEFAULT_CONFIGURATION,
+    key=alice_keys,
+    window_size=8
+  )
+
+
+def test_windowed_accepts_in_order(windowed_state):
+  for message_id in range(1, 20):
+    windowed_state.verify_recv_message_number(message_id)
+
+
+def test_windowed_accepts_reordered(windowed_state):
+  for message_id in [3, 1, 2, 7, 5, 4, 6]:
+    windowed_state.verify_recv_message_number(message_id)
+
+
+def test_windowed_restored(alice_keys):
+  state = session_state_module.WindowedSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys, recv_message_number=100,
+    window_size=16
+  )
+  for message_id in (100, 99, 50):
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      state.precheck_recv_message_number(message_id)
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      state.verify_recv_message_number(message_id)
+  state.verify_recv_message_number(103)
+  # Ids below the restored one still count as received.
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(99)
+  state.verify_recv_message_number(101)
+
+
+def test_windowed_zero_invalid(windowed_state):
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    windowed_state.verify_recv_message_number(0)
+
+
+@pytest.mark.parametrize("received", [[1, 1], [5, 3, 3], [5, 5], [10, 2], [20, 12]])
+def test_windowed_rejects_replay_and_old(windowed_state, received):
+  for message_id in received[:-1]:
+    windowed_state.verify_recv_message_number(message_id)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    windowed_state.verify_recv_message_number(received[-1])
+
+
+def test_windowed_oldest_in_window(windowed_state):
+  windowed_state.verify_recv_message_number(20)
+  windowed_state.verify_recv_message_number(13)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    windowed_state.verify_recv_message_number(13)
+
+
+def test_windowed_large_jump_clears_window(windowed_state):
+  windowed_state.verify_recv_message_number(3)
+  windowed_state.verify_recv_message_number(1000)
+  windowed_state.verify_recv_message_number(999)
+  assert windowed_state._WindowedSessionState__window.bit_length() <= 8
+
+
+def test_windowed_huge_jump(alice_keys):
+  state = session_state_module.WindowedSessionState(
+    configuration=api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=2 ** 64),
+    key=alice_keys,
+    window_size=8
+  )
+  state.verify_recv_message_number(3)
+  # Window is not shifted by the whole gap, that would allocate 2 ** 40 bits.
+  state.verify_recv_message_number(2 ** 40)
+  assert state._WindowedSessionState__window == 1
+  state.verify_recv_message_number(2 ** 40 - 7)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(2 ** 40 - 8)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(2 ** 40)
+
+
+def test_windowed_need_to_renegotiate_key(windowed_state):
+  max_messages = windowed_state.configuration.max_messages_in_session
+  windowed_state.verify_recv_message_number(max_messages - 1)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    windowed_state.verify_recv_message_number(max_messages)
+
+
+def test_windowed_precheck(windowed_state):
+  windowed_state.verify_recv_message_number(5)
+  windowed_state.precheck_recv_message_number(4)
+  windowed_state.precheck_recv_message_number(4)
+  windowed_state.verify_recv_message_number(4)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    windowed_state.precheck_recv_message_number(4)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    windowed_state.precheck_recv_message_number(
+      windowed_state.configuration.max_messages_in_session)
+
+
+def test_windowed_reset(windowed_state):
+  assert windowed_state.window_size == 8
+  windowed_state.reset()
+  with pytest.raises(exceptions.AlreadyReseted):
+    windowed_state.verify_recv_message_number(1)
+  with pytest.raises(exceptions.AlreadyReseted):
+    windowed_state.precheck_recv_message_number(1)
+
+
+@pytest.fixture()
+def blocked_state(alice_keys):
+  return session_state_module.DefaultSessionState(
+    configuration=api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=20),
+    key=alice_keys,
+    id_block_size=4
+  )
+
+
+def test_id_blocks_per_thread(blocked_state):
+  assert blocked_state.id_block_size == 4
+  assert blocked_state.get_send_message_number() == 1
+  other_thread = []
+  thread = threading.Thread(
+    target=lambda: other_thread.extend(blocked_state.get_send_message_number() for __ in range(5))
+  )
+  thread.start()
+  thread.join()
+  assert other_thread == [5, 6, 7, 8, 9]
+  assert [blocked_state.get_send_message_number() for __ in range(4)] == [2, 3, 4, 13]
+  # Contiguous ranges are taken from the shared counter.
+  assert blocked_state.get_send_message_numbers(2) == range(17, 19)
+
+
+def test_idle_thread_block_dropped(alice_keys):
+  sender = session_state_module.DefaultSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys, id_block_size=64
+  )
+  receiver = session_state_module.WindowedSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys
+  )
+  receiver.verify_recv_message_number(sender.get_send_message_number())
+  thread = threading.Thread(target=lambda: [
+    receiver.verify_recv_message_number(sender.get_send_message_number()) for __ in range(2000)
+  ])
+  thread.start()
+  thread.join()
+  # Rest of the block of idle thread would be rejected, so a new one is leased.
+  message_id = sender.get_send_message_number()
+  assert message_id > 2000
+  receiver.verify_recv_message_number(message_id)
+
+
+def test_id_blocks_end_of_session(blocked_state):
+  blocked_state.get_send_message_numbers(14)
+  # Last block is shorter, as ids past the end of session can't be used.
+  assert [blocked_state.get_send_message_number() for __ in range(5)] == list(range(15, 20))
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    blocked_state.get_send_message_number()
+
+
+def test_id_blocks_after_reset(blocked_state):
+  blocked_state.get_send_message_number()
+  blocked_state.reset()
+  with pytest.raises(exceptions.AlreadyReseted):
+    blocked_state.get_send_message_number()
+
+
+def test_id_blocks_unique_across_threads(alice_keys):
+  state = session_state_module.DefaultSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys, id_block_size=16
+  )
+  results = [[] for __ in range(8)]
+  threads = [
+    threading.Thread(
+      target=lambda result=result: result.extend(
+        state.get_send_message_number() for __ in range(1000)
+      )
+    )
+    for result in results
+  ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  message_ids = [message_id for result in results for message_id in result]
+  assert len(set(message_ids)) == 8 * 1000
+  for result in results:
+    assert result == sorted(result)
+
+
+def test_send_and_recv_use_separate_locks(session_state, alice_keys):
+  with session_state._send_lock:
+    session_state.verify_recv_message_number(1)
+    assert session_state.get_extended_keys() is alice_keys
+  with session_state._recv_lock:
+    assert session_state.get_send_message_number() == 1
+    assert session_state.get_extended_keys() is alice_keys
+
+
+def test_windowed_with_id_blocks(alice_keys):
+  sender = session_state_module.DefaultSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys, id_block_size=4
+  )
+  receiver = session_state_module.WindowedSessionState(
+    configuration=api.DEFAULT_CONFIGURATION, key=alice_keys, window_size=16, id_block_size=4
+  )
+  assert receiver.id_block_size == 4
+  first = [sender.get_send_message_number() for __ in range(2)]
+  other = []
+  thread = threading.Thread(target=lambda: other.append(sender.get_send_message_number()))
+  thread.start()
+  thread.join()
+  for message_id in other + first:
+    receiver.verify_recv_message_number(message_id)
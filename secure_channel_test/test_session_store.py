@@ -0,0 +1,252 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+# pylint: disable=protected-access
+
+import multiprocessing
+import os
+
+import pytest
+
+from secure_channel import api, data_source, exceptions, secure_channel, session_store
+
+
+@pytest.fixture()
+def store_path(tmpdir):
+  return str(tmpdir.join("sessions"))
+
+
+@pytest.fixture()
+def store(store_path):
+  with session_store.SessionStore(store_path, capacity=100) as result:
+    yield result
+
+
+@pytest.fixture()
+def state(store, alice_keys):
+  store.put(7, alice_keys)
+  return store.session_state(7, api.DEFAULT_CONFIGURATION)
+
+
+def test_file_size(store, store_path):
+  assert store.path == store_path
+  assert store.capacity == 100
+  assert os.path.getsize(store_path) == (
+    session_store.STORE_HEADER.size + 100 * session_store.RECORD_SIZE
+  )
+
+
+def test_put_and_get(store, state, alice_keys):
+  assert 7 in store
+  assert 8 not in store
+  assert state.peer_id == 7
+  assert state.get_extended_keys() == alice_keys
+  assert state.get_extended_keys() is state.get_extended_keys()
+
+
+@pytest.mark.parametrize("peer_id", [-1, 100])
+def test_peer_id_out_of_range(store, alice_keys, peer_id):
+  assert peer_id not in store
+  with pytest.raises(KeyError):
+    store.session_state(peer_id, api.DEFAULT_CONFIGURATION)
+  with pytest.raises(KeyError):
+    store.put(peer_id, alice_keys)
+
+
+def test_missing_peer(store):
+  with pytest.raises(KeyError):
+    store.session_state(3, api.DEFAULT_CONFIGURATION)
+
+
+def test_invalid_key_size(store, alice_keys):
+  with pytest.raises(ValueError):
+    store.put(1, alice_keys._replace(send_sign_key=bytearray(16)))
+
+
+def test_counters(store, state):
+  assert state.get_send_message_number() == 1
+  assert state.get_send_message_numbers(3) == range(2, 5)
+  state.verify_recv_message_number(5)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(5)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.precheck_recv_message_number(4)
+  # Other views see the same state.
+  other = store.session_state(7, api.DEFAULT_CONFIGURATION)
+  assert other.get_send_message_number() == 5
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    other.verify_recv_message_number(5)
+
+
+def test_end_of_session(store, alice_keys):
+  store.put(1, alice_keys, send_message_number=98, recv_message_number=0)
+  state = store.session_state(1, api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=100))
+  assert state.get_send_message_number() == 99
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    state.get_send_message_number()
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    state.verify_recv_message_number(100)
+
+
+def test_reset(store, state):
+  keys = state.get_extended_keys()
+  state.reset()
+  state.reset()
+  for key in keys:
+    assert key == bytes(len(key))
+  assert 7 not in store
+  for call in (
+      state.get_send_message_number,
+      state.get_extended_keys,
+      lambda: state.verify_recv_message_number(1),
+  ):
+    with pytest.raises(exceptions.AlreadyReseted):
+      call()
+  assert store._read_keys(store._offset(7)) == api.ExtendedKeys(*[bytearray(32)] * 4)
+
+
+def test_remove(store, state):
+  store.remove(7)
+  assert 7 not in store
+  with pytest.raises(exceptions.AlreadyReseted):
+    state.get_send_message_number()
+
+
+def test_reopen(store_path, alice_keys, bobs_keys):
+  with session_store.SessionStore(store_path, capacity=10) as store:
+    store.put(0, alice_keys)
+    store.put(9, bobs_keys)
+    state = store.session_state(9, api.DEFAULT_CONFIGURATION)
+    state.get_send_message_numbers(10)
+    state.verify_recv_message_number(3)
+    store.flush()
+  store.close()
+  with session_store.SessionStore(store_path, capacity=10) as store:
+    state = store.session_state(9, api.DEFAULT_CONFIGURATION)
+    assert state.get_extended_keys() == bobs_keys
+    assert state.get_send_message_number() == 11
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      state.verify_recv_message_number(3)
+    assert store.session_state(0, api.DEFAULT_CONFIGURATION).get_extended_keys() == alice_keys
+
+
+def in_child(func, *args):
+  """Run ``func`` in a process, that exits without closing anything."""
+  context = multiprocessing.get_context("fork")
+
+  def run():
+    func(*args)
+    os._exit(0)  # pylint: disable=protected-access
+
+  process = context.Process(target=run)
+  process.start()
+  process.join()
+  assert process.exitcode == 0
+
+
+def use_sessions(store_path, alice_keys):
+  store = session_store.SessionStore(store_path, capacity=10, reservation_size=100)
+  store.put(1, alice_keys)
+  state = store.session_state(1, api.DEFAULT_CONFIGURATION)
+  state.get_send_message_numbers(150)
+  state.verify_recv_message_number(20)
+  store.put(2, alice_keys, send_message_number=5, recv_message_number=6)
+
+
+def crash(store_path, alice_keys):
+  """Use sessions in a store that is never closed."""
+  in_child(use_sessions, store_path, alice_keys)
+
+
+def test_store_not_closed(store_path, alice_keys):
+  crash(store_path, alice_keys)
+  with session_store.SessionStore(store_path, capacity=10) as store:
+    # Counters might be stale, so they continue from the reservations.
+    state = store.session_state(1, api.DEFAULT_CONFIGURATION)
+    assert state.get_send_message_number() == 251
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      state.verify_recv_message_number(120)
+    state.verify_recv_message_number(121)
+    other = store.session_state(2, api.DEFAULT_CONFIGURATION)
+    assert other.get_send_message_number() == 6
+  # Records written after the crash are trusted again.
+  with session_store.SessionStore(store_path, capacity=10) as store:
+    state = store.session_state(1, api.DEFAULT_CONFIGURATION)
+    assert state.get_send_message_number() == 252
+    with pytest.raises(exceptions.RecvMessageOutOfSequence):
+      state.precheck_recv_message_number(121)
+    state.precheck_recv_message_number(122)
+
+
+def test_crash_after_recovery(store_path, alice_keys):
+  crash(store_path, alice_keys)
+
+  def recover():
+    store = session_store.SessionStore(store_path, capacity=10, reservation_size=100)
+    assert store.session_state(1, api.DEFAULT_CONFIGURATION).get_send_message_number() == 251
+
+  in_child(recover)
+  with session_store.SessionStore(store_path, capacity=10) as store:
+    assert store.session_state(1, api.DEFAULT_CONFIGURATION).get_send_message_number() == 352
+
+
+def test_reservation_syncs(store, state, monkeypatch):
+  synced = []
+  monkeypatch.setattr(store, "_sync", synced.append)
+  state.get_send_message_numbers(store.reservation_size)
+  state.verify_recv_message_number(1)
+  assert len(synced) == 2
+  state.get_send_message_number()
+  state.verify_recv_message_number(store.reservation_size + 1)
+  assert len(synced) == 2
+  state.verify_recv_message_number(store.reservation_size + 2)
+  assert len(synced) == 3
+
+
+def test_reservation_ends_with_session(store, alice_keys):
+  store.put(1, alice_keys)
+  state = store.session_state(
+    1, api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=10)
+  )
+  state.get_send_message_number()
+  assert store._record(store._offset(1))[3] == 10
+
+
+def test_store_in_use(store_path):
+  with session_store.SessionStore(store_path, capacity=10):
+    with pytest.raises(exceptions.SessionStateInUse):
+      session_store.SessionStore(store_path, capacity=10)
+
+    def open_store():
+      with pytest.raises(exceptions.SessionStateInUse):
+        session_store.SessionStore(store_path, capacity=10)
+
+    in_child(open_store)
+  session_store.SessionStore(store_path, capacity=10).close()
+
+
+def test_capacity_mismatch(store_path):
+  session_store.SessionStore(store_path, capacity=10).close()
+  with pytest.raises(exceptions.CorruptedSessionState):
+    session_store.SessionStore(store_path, capacity=20)
+
+
+def test_channel_over_store(store, alice_keys, bobs_keys):
+
+  class StoreNegotiator(api.SessionKeyNegotiator):
+
+    def __init__(self, peer_id):
+      self.peer_id = peer_id
+
+    def create_session_state(self, source, configuration):
+      return store.session_state(self.peer_id, configuration)
+
+  store.put(1, alice_keys)
+  store.put(2, bobs_keys)
+  alice, bob = [
+    secure_channel.SecureChannel(
+      data_source.TestDataSource(api.DEFAULT_CONFIGURATION, []), StoreNegotiator(peer_id)
+    )
+    for peer_id in (1, 2)
+  ]
+  alice.send_message(b'stored session..')
+  bob._data_source.in_messages = alice._data_source.out_messages
+  assert bob.receive_message() == b'stored session..'
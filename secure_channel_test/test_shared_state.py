@@ -0,0 +1,240 @@
+# pylint: disable=missing-docstring, redefined-outer-name, invalid-name
+# pylint: disable=protected-access
+
+import multiprocessing
+import os
+
+import pytest
+
+from secure_channel import api, exceptions, session_state, shared_state
+
+
+@pytest.fixture()
+def id_file(tmpdir):
+  result = shared_state.IdRangeFile(str(tmpdir.join("ids")))
+  yield result
+  result.close()
+
+
+def create_state(keys, id_file, max_messages=2 ** 32 - 1, lease_size=4):
+  return shared_state.SharedSessionState(
+    api.DEFAULT_CONFIGURATION._replace(max_messages_in_session=max_messages),
+    keys,
+    id_file,
+    lease_size=lease_size
+  )
+
+
+def test_id_file_lease(id_file):
+  assert id_file.highest_leased() == 0
+  assert id_file.lease(3, 100) == range(1, 4)
+  assert id_file.lease(3, 100) == range(4, 7)
+  assert id_file.highest_leased() == 6
+
+
+def test_id_file_end_of_session(id_file):
+  assert id_file.lease(8, 10) == range(1, 9)
+  assert id_file.lease(8, 10) == range(9, 10)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    id_file.lease(1, 10)
+
+
+def test_id_file_durable(tmpdir):
+  path = str(tmpdir.join("ids"))
+  id_file = shared_state.IdRangeFile(path, durable=True)
+  assert id_file.path == path
+  id_file.lease(5, 100)
+  id_file.close()
+  id_file.close()
+  reopened = shared_state.IdRangeFile(path)
+  assert reopened.lease(1, 100) == range(6, 7)
+  reopened.close()
+
+
+def test_states_lease_disjoint_ranges(alice_keys, id_file):
+  first = create_state(alice_keys, id_file)
+  second = create_state(alice_keys, id_file)
+  assert first.id_file is id_file
+  assert [first.get_send_message_number() for __ in range(2)] == [1, 2]
+  assert [second.get_send_message_number() for __ in range(5)] == [5, 6, 7, 8, 9]
+  assert [first.get_send_message_number() for __ in range(3)] == [3, 4, 13]
+
+
+def test_contiguous_range(alice_keys, id_file):
+  state = create_state(alice_keys, id_file)
+  assert state.get_send_message_number() == 1
+  # Doesn't fit in the current lease, so rest of the lease is skipped.
+  assert state.get_send_message_numbers(6) == range(5, 11)
+  assert state.get_send_message_numbers(2) == range(11, 13)
+
+
+def test_exhaustion_is_global(alice_keys, id_file):
+  first = create_state(alice_keys, id_file, max_messages=10)
+  second = create_state(alice_keys, id_file, max_messages=10)
+  assert first.get_send_message_numbers(8) == range(1, 9)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    second.get_send_message_numbers(2)
+  # Last id is still in the lease of the second state.
+  assert second.get_send_message_number() == 9
+  for state in (first, second):
+    with pytest.raises(exceptions.NeedToRenegotiateKey):
+      state.get_send_message_number()
+
+
+def test_last_lease_is_shorter(alice_keys, id_file):
+  state = create_state(alice_keys, id_file, max_messages=7)
+  assert [state.get_send_message_number() for __ in range(6)] == list(range(1, 7))
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    state.get_send_message_number()
+
+
+def test_reset(alice_keys, id_file):
+  state = create_state(alice_keys, id_file)
+  state.get_send_message_number()
+  state.reset()
+  with pytest.raises(exceptions.AlreadyReseted):
+    state.get_send_message_number()
+
+
+def send_in_worker(state, count, connection):
+  connection.send([state.get_send_message_number() for __ in range(count)])
+  connection.close()
+
+
+def test_forked_workers(alice_keys, id_file):
+  state = create_state(alice_keys, id_file)
+  parent_ids = [state.get_send_message_number()]
+  context = multiprocessing.get_context("fork")
+  workers = []
+  for __ in range(4):
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_in_worker, args=(state, 10, sender))
+    process.start()
+    workers.append((process, receiver))
+  worker_ids = []
+  for process, receiver in workers:
+    worker_ids.append(receiver.recv())
+    process.join()
+  parent_ids.extend(state.get_send_message_number() for __ in range(10))
+  all_ids = parent_ids + [message_id for ids in worker_ids for message_id in ids]
+  assert len(set(all_ids)) == len(all_ids) == 51
+  # Messages of all processes interleaved, windowed receiver accepts them all.
+  receiver_state = session_state.WindowedSessionState(
+    api.DEFAULT_CONFIGURATION, alice_keys, window_size=64
+  )
+  for message_ids in zip(parent_ids, *worker_ids):
+    for message_id in message_ids:
+      receiver_state.verify_recv_message_number(message_id)
+  assert os.path.getsize(id_file.path) == shared_state.ID_RANGE_RECORD.size
+
+
+def test_lease_dropped_after_fork(alice_keys, id_file, monkeypatch):
+  state = create_state(alice_keys, id_file)
+  assert state.get_send_message_number() == 1
+  monkeypatch.setattr(os, "getpid", lambda: -1)
+  assert state.get_send_message_number() == 5
+  assert state.get_send_message_number() == 6
+
+
+def test_default_leases_fit_peer_window(alice_keys, id_file):
+  workers = [
+    shared_state.SharedSessionState(
+      api.DEFAULT_CONFIGURATION, alice_keys, id_file, lag_check_interval=0
+    )
+    for __ in range(8)
+  ]
+  receiver_state = session_state.WindowedSessionState(api.DEFAULT_CONFIGURATION, alice_keys)
+  for __ in range(3):
+    for worker in workers:
+      receiver_state.verify_recv_message_number(worker.get_send_message_number())
+  # First worker is idle while the others send a lot.
+  for __ in range(2000):
+    receiver_state.verify_recv_message_number(workers[1].get_send_message_number())
+  receiver_state.verify_recv_message_number(workers[0].get_send_message_number())
+
+
+def test_idle_lease_dropped(alice_keys, id_file):
+  idle = shared_state.SharedSessionState(
+    api.DEFAULT_CONFIGURATION, alice_keys, id_file, lease_size=4, peer_window_size=16,
+    lag_check_interval=0
+  )
+  busy = create_state(alice_keys, id_file)
+  assert idle.get_send_message_number() == 1
+  assert [busy.get_send_message_number() for __ in range(3)] == [5, 6, 7]
+  # Still within the window.
+  assert idle.get_send_message_number() == 2
+  busy.get_send_message_numbers(8)
+  assert id_file.highest_leased() == 16
+  assert idle.get_send_message_number() == 17
+
+
+def test_lag_checked_once_per_interval(alice_keys, id_file, monkeypatch):
+  state = shared_state.SharedSessionState(
+    api.DEFAULT_CONFIGURATION, alice_keys, id_file, lease_size=20, peer_window_size=64,
+    lag_check_interval=60
+  )
+  busy = create_state(alice_keys, id_file)
+  checks = []
+  highest_leased = id_file.highest_leased
+  monkeypatch.setattr(id_file, "highest_leased", lambda: checks.append(1) or highest_leased())
+  assert state.get_send_message_number() == 1
+  busy.get_send_message_numbers(100)
+  # Sends don't read the file until the interval passes.
+  assert [state.get_send_message_number() for __ in range(10)] == list(range(2, 12))
+  assert not checks
+  now = shared_state.time.monotonic()
+  monkeypatch.setattr(shared_state.time, "monotonic", lambda: now + 60)
+  assert state.get_send_message_number() == 121
+  assert len(checks) == 1
+
+
+def test_received_ids_are_shared(alice_keys, id_file):
+  first = create_state(alice_keys, id_file)
+  second = create_state(alice_keys, id_file)
+  first.verify_recv_message_number(5)
+  # Replayed to other process.
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    second.precheck_recv_message_number(5)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    second.verify_recv_message_number(5)
+  # Reordered between processes.
+  second.precheck_recv_message_number(3)
+  second.verify_recv_message_number(3)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    first.verify_recv_message_number(3)
+  assert first.recv_message_number == second.recv_message_number == 5
+  assert id_file.highest_received() == 5
+
+
+def test_received_window(alice_keys, tmpdir):
+  id_file = shared_state.IdRangeFile(str(tmpdir.join("ids")), durable=True, window_size=8)
+  assert id_file.window_size == 8
+  state = create_state(alice_keys, id_file, max_messages=100)
+  state.verify_recv_message_number(20)
+  state.verify_recv_message_number(13)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(12)
+  with pytest.raises(exceptions.NeedToRenegotiateKey):
+    state.verify_recv_message_number(100)
+  id_file.close()
+  reopened = shared_state.IdRangeFile(str(tmpdir.join("ids")), window_size=8)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    reopened.receive(13)
+  reopened.receive(14)
+  # Window is not shifted by the whole gap.
+  reopened.receive(2 ** 40)
+  reopened.receive(2 ** 40 - 7)
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    reopened.receive(2 ** 40 - 8)
+  reopened.close()
+
+
+def test_restored_recv_message_number(alice_keys, id_file):
+  state = shared_state.SharedSessionState(
+    api.DEFAULT_CONFIGURATION, alice_keys, id_file, recv_message_number=10
+  )
+  assert state.recv_message_number == 10
+  with pytest.raises(exceptions.RecvMessageOutOfSequence):
+    state.verify_recv_message_number(9)
+  state.verify_recv_message_number(11)
+  assert state.recv_message_number == 11
@@ -29,3 +29,7 @@ def test_clear_keys(random_buffer):
       assert elem == 0
 
 
+def test_clear_buffer_view():
+  buffer = bytearray(b'\xff' * 32)
+  utils.clear_buffer(memoryview(buffer)[8:16])
+  assert buffer == b'\xff' * 8 + bytes(8) + b'\xff' * 16
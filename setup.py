@@ -10,9 +10,10 @@ MAIN_DIR = pathlib.Path(__file__).absolute().parent
 
 
 def get_requirements():
+  # Installs need lowest supported versions, pinned versions are in base.txt.
   pip_session = PipSession()
   return parse_requirements(
-      str(MAIN_DIR / 'requirements' / 'base.txt'),
+      str(MAIN_DIR / 'requirements' / 'base.in'),
       session=pip_session
   )
 
@@ -18,6 +18,11 @@ def test(ctx):
   ctx.run("py.test -v --cov secure_channel --cov-report=html --cov-report=term-missing secure_channel_test")
 
 
+@task
+def benchmark(ctx, name="channel"):
+  ctx.run("python -m benchmarks.bench_{}".format(name))
+
+
 @task(pre=[pep8, lint, test])
 def check(ctx):
   pass